@@ -0,0 +1,271 @@
+import argparse
+import json
+import struct
+
+#
+# A compact binary form of the abilityInfo .json lookup tables.
+#
+# Looking up a single ability in the .json files means parsing the whole file. This
+# index keeps the same information in fixed size columns, so an ability can be found
+# with a binary search directly on the file bytes, without parsing anything else.
+#
+# Layout (all little endian):
+#   header:       magic "DDRA", uint16 version, uint16 reserved, uint32 count,
+#                 uint32 stringTableSize
+#   ids:          int32[count]  sorted ability IDs (custom ability IDs are negative)
+#   assetIds:     uint32[count] NO_VALUE if the ability has no assetId
+#   nameOffsets:  uint32[count] offset into the string table, or NO_VALUE
+#   iconOffsets:  uint32[count] offset into the string table, or NO_VALUE
+#   stringTable:  interned strings, each stored as uint16 byte length + utf-8 bytes
+#
+
+# Resources in project
+ABILITY_INFO_API_FILE = "../DanceDanceRotationModule/ref/abilityInfoApi.json"
+ABILITY_INFO_CUSTOM_FILE = "../DanceDanceRotationModule/ref/abilityInfoCustom.json"
+
+# Binary index of abilityInfoApi.json
+ABILITY_INFO_API_INDEX_FILE = "../DanceDanceRotationModule/ref/abilityInfoApi.bin"
+# Binary index of abilityInfoApi.json with abilityInfoCustom.json merged on top
+ABILITY_INFO_INDEX_FILE = "../DanceDanceRotationModule/ref/abilityInfo.bin"
+
+MAGIC = b"DDRA"
+VERSION = 1
+HEADER_FORMAT = "<4sHHII"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+NO_VALUE = 0xFFFFFFFF
+
+
+# MARK: Writing
+
+#
+# Merges abilityInfo tables. Later tables override whole entries of earlier ones,
+# the same way the module loads abilityInfoApi.json and then abilityInfoCustom.json
+#
+def mergeAbilityInfo(abilityInfoTables):
+    mergedAbilityInfo = {}
+    for abilityInfo in abilityInfoTables:
+        for abilityId, info in abilityInfo.items():
+            mergedAbilityInfo[str(abilityId)] = info
+    return mergedAbilityInfo
+
+#
+# Loads and merges abilityInfo .json files
+#
+def loadAbilityInfoFiles(fileNames):
+    abilityInfoTables = []
+    for fileName in fileNames:
+        with open(fileName, 'r', encoding='utf-8-sig') as f:
+            abilityInfoTables.append(json.load(f))
+    return mergeAbilityInfo(abilityInfoTables)
+
+#
+# Encodes an abilityId -> { assetId, name, icon } table into the binary index form
+#
+def encodeAbilityInfoIndex(abilityInfo):
+    entries = sorted((int(abilityId), info) for abilityId, info in abilityInfo.items())
+
+    stringTable = bytearray()
+    stringOffsets = {}
+
+    def internString(value):
+        if value is None:
+            return NO_VALUE
+        if value not in stringOffsets:
+            encoded = value.encode("utf-8")
+            stringOffsets[value] = len(stringTable)
+            stringTable.extend(struct.pack("<H", len(encoded)))
+            stringTable.extend(encoded)
+        return stringOffsets[value]
+
+    ids = []
+    assetIds = []
+    nameOffsets = []
+    iconOffsets = []
+    for abilityId, info in entries:
+        ids.append(abilityId)
+        assetIds.append(info.get("assetId", NO_VALUE))
+        nameOffsets.append(internString(info.get("name")))
+        iconOffsets.append(internString(info.get("icon")))
+
+    count = len(entries)
+    return b"".join([
+        struct.pack(HEADER_FORMAT, MAGIC, VERSION, 0, count, len(stringTable)),
+        struct.pack(f"<{count}i", *ids),
+        struct.pack(f"<{count}I", *assetIds),
+        struct.pack(f"<{count}I", *nameOffsets),
+        struct.pack(f"<{count}I", *iconOffsets),
+        bytes(stringTable)
+    ])
+
+def writeAbilityInfoIndex(abilityInfo, fileName):
+    with open(fileName, "wb") as f:
+        f.write(encodeAbilityInfoIndex(abilityInfo))
+
+
+# MARK: Reading
+
+#
+# Reads a binary abilityInfo index. Only the header is decoded up front, every
+# lookup is a binary search over the ids column of the raw bytes.
+#
+class AbilityInfoIndex:
+    def __init__(self, data):
+        magic, version, _, count, stringTableSize = struct.unpack_from(HEADER_FORMAT, data, 0)
+        if magic != MAGIC:
+            raise ValueError("Not an abilityInfo index")
+        if version != VERSION:
+            raise ValueError(f"Unsupported abilityInfo index version: {version}")
+
+        self.data = data
+        self.count = count
+        self.idsOffset = HEADER_SIZE
+        self.assetIdsOffset = self.idsOffset + 4 * count
+        self.nameOffsetsOffset = self.assetIdsOffset + 4 * count
+        self.iconOffsetsOffset = self.nameOffsetsOffset + 4 * count
+        self.stringTableOffset = self.iconOffsetsOffset + 4 * count
+        if len(data) != self.stringTableOffset + stringTableSize:
+            raise ValueError("abilityInfo index is truncated or has trailing data")
+
+    @staticmethod
+    def open(fileName):
+        with open(fileName, "rb") as f:
+            return AbilityInfoIndex(f.read())
+
+    def __len__(self):
+        return self.count
+
+    def idAt(self, position):
+        return struct.unpack_from("<i", self.data, self.idsOffset + 4 * position)[0]
+
+    def _uint32At(self, columnOffset, position):
+        return struct.unpack_from("<I", self.data, columnOffset + 4 * position)[0]
+
+    def _stringAt(self, offset):
+        if offset == NO_VALUE:
+            return None
+        start = self.stringTableOffset + offset
+        length = struct.unpack_from("<H", self.data, start)[0]
+        return self.data[start + 2:start + 2 + length].decode("utf-8")
+
+    #
+    # Returns the position of the abilityId in the index, or -1 if it is not in it
+    #
+    def find(self, abilityId):
+        low = 0
+        high = self.count - 1
+        while low <= high:
+            middle = (low + high) // 2
+            middleId = self.idAt(middle)
+            if middleId < abilityId:
+                low = middle + 1
+            elif middleId > abilityId:
+                high = middle - 1
+            else:
+                return middle
+        return -1
+
+    #
+    # Returns the entry at a position, in the same form as the .json files
+    #
+    def entryAt(self, position):
+        info = {}
+        assetId = self._uint32At(self.assetIdsOffset, position)
+        if assetId != NO_VALUE:
+            info["assetId"] = assetId
+        name = self._stringAt(self._uint32At(self.nameOffsetsOffset, position))
+        if name is not None:
+            info["name"] = name
+        icon = self._stringAt(self._uint32At(self.iconOffsetsOffset, position))
+        if icon is not None:
+            info["icon"] = icon
+        return info
+
+    #
+    # Returns the info for an abilityId, or None if it is not known
+    #
+    def lookup(self, abilityId):
+        position = self.find(int(abilityId))
+        if position < 0:
+            return None
+        return self.entryAt(position)
+
+    def items(self):
+        for position in range(self.count):
+            yield self.idAt(position), self.entryAt(position)
+
+
+# MARK: Validation
+
+#
+# Round trips an index against the .json files it was made from.
+# Returns a list of problems, which is empty if the index matches
+#
+def validateAbilityInfoIndex(indexFileName, jsonFileNames):
+    problems = []
+    abilityInfo = loadAbilityInfoFiles(jsonFileNames)
+    index = AbilityInfoIndex.open(indexFileName)
+
+    if len(index) != len(abilityInfo):
+        problems.append(f"Index has {len(index)} entries, json has {len(abilityInfo)}")
+
+    previousId = None
+    for position in range(len(index)):
+        abilityId = index.idAt(position)
+        if previousId is not None and abilityId <= previousId:
+            problems.append(f"IDs are not sorted at position {position}: {previousId} -> {abilityId}")
+        previousId = abilityId
+
+    for abilityId, info in abilityInfo.items():
+        indexInfo = index.lookup(int(abilityId))
+        if indexInfo is None:
+            problems.append(f"{abilityId}: missing from index")
+        elif indexInfo != info:
+            problems.append(f"{abilityId}: index has {indexInfo}, json has {info}")
+    return problems
+
+
+# MARK: Main
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="abilityInfoIndex")
+    parser.add_argument(
+        '--build',
+        action='store_true',
+        help='Builds the binary indexes from the abilityInfo .json files before validating them'
+    )
+    parser.add_argument(
+        '--lookup',
+        type=int,
+        nargs='*',
+        default=[],
+        help='Ability IDs to look up in the merged index'
+    )
+    args = parser.parse_args()
+
+    indexFiles = [
+        (ABILITY_INFO_API_INDEX_FILE, [ABILITY_INFO_API_FILE]),
+        (ABILITY_INFO_INDEX_FILE, [ABILITY_INFO_API_FILE, ABILITY_INFO_CUSTOM_FILE])
+    ]
+
+    if args.build:
+        for indexFileName, jsonFileNames in indexFiles:
+            writeAbilityInfoIndex(loadAbilityInfoFiles(jsonFileNames), indexFileName)
+
+    hasError = False
+    for indexFileName, jsonFileNames in indexFiles:
+        problems = validateAbilityInfoIndex(indexFileName, jsonFileNames)
+        if len(problems) == 0:
+            print(f"{indexFileName}: Valid")
+        else:
+            hasError = True
+            print(f"{indexFileName}: {len(problems)} problems")
+            for problem in problems:
+                print("  " + problem)
+
+    if len(args.lookup) > 0:
+        index = AbilityInfoIndex.open(ABILITY_INFO_INDEX_FILE)
+        for abilityId in args.lookup:
+            print(f"{abilityId}: {index.lookup(abilityId)}")
+
+    if hasError:
+        raise SystemExit(1)
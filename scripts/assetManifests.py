@@ -0,0 +1,193 @@
+import argparse
+import collections
+import hashlib
+import json
+
+import abilityInfoIndex
+import noteColumns
+import songBundle
+
+#
+# Icon asset manifests of the songs, so the module can prefetch the icons a song needs
+# in the order it needs them, instead of loading them the first time a note shows up.
+#
+# A song's manifest is its deduplicated list of assetIds (see getImageFileName in
+# generateData.py), in the order they are first shown:
+#   + the icons of the build's utility palette skills, which the song info shows
+#   + the icons of the notes in the first PREFETCH_SECONDS of the song, in play order
+#   + the icons of the rest of the notes, in play order
+# firstCount is how many assetIds are in the first two parts, which are the ones to
+# have loaded before the song starts.
+#
+# Abilities with a custom "icon" in abilityInfoCustom.json are loaded from the module's
+# own files, and unknown abilities show the unknown icon, so neither has an assetId.
+#
+# createDefaultSongsArray.py stores the manifests in the song bundle (section "assets"),
+# and writes the number of songs that use each assetId to ASSET_COUNTS_FILE.
+#
+# Encoded manifest of a song, all varints:
+#   firstCount, assetId count, then the assetIds
+#
+# Run on its own to print the manifests in a bundle:
+#   python assetManifests.py ../DanceDanceRotationModule/ref/defaultSongs.ddrbundle
+#
+
+ABILITY_INFO_FILES = [
+    '../DanceDanceRotationModule/ref/abilityInfoApi.json',
+    '../DanceDanceRotationModule/ref/abilityInfoCustom.json'
+]
+PALETTE_SKILL_LOOKUP_FILE = '../DanceDanceRotationModule/ref/paletteSkillLookup.json'
+# The files the manifests are made from, other than the songs
+REFERENCE_FILES = ABILITY_INFO_FILES + [PALETTE_SKILL_LOOKUP_FILE]
+
+ASSET_COUNTS_FILE = "../DanceDanceRotationModule/ref/defaultSongsAssets.json"
+ASSET_COUNTS_VERSION = 1
+
+# Name of the section in the song bundle
+BUNDLE_SECTION = "assets"
+
+PREFETCH_SECONDS = 10
+
+# assetIds printed per song, before the rest are only counted
+MAX_PRINTED_ASSETS = 20
+
+
+# MARK: Lookup Tables
+
+# (abilityId -> assetId, paletteId -> abilityId), loaded the first time they are needed
+lookupTables = None
+
+def loadLookupTables():
+    global lookupTables
+    if lookupTables is None:
+        assetIds = {}
+        for abilityId, info in abilityInfoIndex.loadAbilityInfoFiles(ABILITY_INFO_FILES).items():
+            if "assetId" in info and not info.get("icon"):
+                assetIds[abilityId] = info["assetId"]
+        with open(PALETTE_SKILL_LOOKUP_FILE, 'r') as f:
+            paletteSkillLookup = {paletteId: str(abilityId) for paletteId, abilityId in json.load(f).items()}
+        lookupTables = (assetIds, paletteSkillLookup)
+    return lookupTables
+
+#
+# A hash of the reference files, which changes when the manifests of unchanged songs
+# need to be made again
+#
+def referencesHash():
+    digest = hashlib.sha256()
+    for fileName in REFERENCE_FILES:
+        with open(fileName, 'rb') as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+
+# MARK: Manifests
+
+#
+# { assetIds, firstCount } of a song
+#
+def createAssetManifest(song, prefetchSeconds=PREFETCH_SECONDS):
+    assetIds, paletteSkillLookup = loadLookupTables()
+    manifest = []
+    seenAssetIds = set()
+
+    def addAbility(abilityId):
+        assetId = assetIds.get(str(abilityId))
+        if assetId is not None and assetId not in seenAssetIds:
+            seenAssetIds.add(assetId)
+            manifest.append(assetId)
+
+    utilities = song.get("decodedBuildTemplate", {}).get("skills", {}).get("terrestrial", {}).get("utilities", [])
+    for paletteId in utilities:
+        if str(paletteId) in paletteSkillLookup:
+            addAbility(paletteSkillLookup[str(paletteId)])
+
+    notes = song.get("notes", [])
+    for note in notes:
+        if note.get("time", 0) < prefetchSeconds * 1000:
+            addAbility(note.get("abilityId"))
+    firstCount = len(manifest)
+    for note in notes:
+        addAbility(note.get("abilityId"))
+    return {"assetIds": manifest, "firstCount": firstCount}
+
+def encodeAssetManifest(manifest):
+    output = bytearray()
+    noteColumns.writeVarint(output, manifest["firstCount"])
+    noteColumns.writeVarint(output, len(manifest["assetIds"]))
+    for assetId in manifest["assetIds"]:
+        noteColumns.writeVarint(output, assetId)
+    return bytes(output)
+
+def decodeAssetManifest(data):
+    firstCount, offset = noteColumns.readVarint(data, 0)
+    assetCount, offset = noteColumns.readVarint(data, offset)
+    assetIds = []
+    for _ in range(assetCount):
+        assetId, offset = noteColumns.readVarint(data, offset)
+        assetIds.append(assetId)
+    return {"assetIds": assetIds, "firstCount": firstCount}
+
+#
+# The data of a song in the bundle's section
+#
+def encodeBundleSection(song):
+    return encodeAssetManifest(createAssetManifest(song))
+
+#
+# assetId -> number of songs that use it, most used first
+#
+def countAssetReferences(manifests):
+    counts = collections.Counter()
+    for manifest in manifests:
+        counts.update(manifest["assetIds"])
+    return {assetId: count for assetId, count in sorted(counts.items(), key=lambda item: (-item[1], item[0]))}
+
+#
+# The contents of ASSET_COUNTS_FILE
+#
+def encodeAssetCounts(manifests):
+    return json.dumps({
+        "version": ASSET_COUNTS_VERSION,
+        "prefetchSeconds": PREFETCH_SECONDS,
+        "songCount": len(manifests),
+        "assets": {str(assetId): count for assetId, count in countAssetReferences(manifests).items()}
+    }, indent=4).encode("utf-8")
+
+
+# MARK: Main
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="assetManifests")
+    parser.add_argument('bundleFile', help='Song bundle written by createDefaultSongsArray.py')
+    parser.add_argument('--song', help='Only prints the song with this name, with every assetId')
+    args = parser.parse_args()
+
+    with songBundle.SongBundle(args.bundleFile) as bundle:
+        if BUNDLE_SECTION not in bundle.sectionNames():
+            raise SystemExit(f"{args.bundleFile} has no '{BUNDLE_SECTION}' section")
+        manifests = []
+        for position, entry in enumerate(bundle.songList()):
+            manifest = decodeAssetManifest(bundle.readSection(position, BUNDLE_SECTION))
+            manifests.append(manifest)
+            if args.song is not None and entry["name"] != args.song:
+                continue
+            assetIds = manifest["assetIds"]
+            if args.song is None:
+                assetIds = assetIds[:MAX_PRINTED_ASSETS]
+            print(
+                f"{position:4d}  {entry['name']}  ({len(manifest['assetIds'])} assets, "
+                f"{manifest['firstCount']} in the first {PREFETCH_SECONDS}s)"
+            )
+            print(f"      first: {assetIds[:manifest['firstCount']]}")
+            print(f"      rest:  {assetIds[manifest['firstCount']:]}" + (
+                f" ... and {len(manifest['assetIds']) - len(assetIds)} more"
+                if len(assetIds) < len(manifest["assetIds"]) else ""
+            ))
+
+    if args.song is None:
+        assetCounts = countAssetReferences(manifests)
+        print("")
+        print(f"{len(assetCounts)} distinct assets in {len(manifests)} songs. Most used:")
+        for assetId, count in list(assetCounts.items())[:10]:
+            print(f"  {assetId:10d}  {count} songs")
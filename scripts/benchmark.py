@@ -0,0 +1,409 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import time
+import tracemalloc
+
+import createDefaultSongsArray
+import generateData
+import songBundle
+import songModel
+import songVerifier
+import syntheticSongs
+import verifyData
+
+#
+# Benchmarks of the data scripts on synthetic corpora of 1k, 10k and 100k songs
+# (see syntheticSongs.py):
+#   parseSong               verifying songs that are already loaded
+#   parseFolder             verifying the whole song folder, like verifyData.py does
+#   createDefaultSongsArray building the merged outputs (full, no-op and --check)
+#   createAbilityInfoTable  building the ability info tables from allSkills.json
+#   refJsonLoad             loading the generated ref/ files
+#   songModel               loading every song as dicts (json.load) and as songModel
+#                           records with each json backend, and the memory per note
+#
+# Each corpus is generated once into its own copy of the project layout under the
+# workspace folder, and the scripts are run from its scripts/ folder, so they read and
+# write the synthetic files instead of the real ones.
+#
+# Results are written as json. Pass --compare with the results of another commit to see
+# what got faster or slower:
+#   python benchmark.py --sizes 1000 --output before.json
+#   python benchmark.py --sizes 1000 --compare before.json
+#
+
+WORKSPACE_FOLDER = "./benchmarkData"
+RESULTS_FILE = "./benchmarkResults.json"
+RESULTS_VERSION = 1
+
+CORPUS_SIZES = [1000, 10000, 100000]
+DEFAULT_SEED = 1
+# parseSong is timed on this many songs, so the songs fit in memory for any corpus size
+PARSE_SONG_SAMPLE_SIZE = 1000
+
+# Results that got this much slower are marked when comparing
+REGRESSION_THRESHOLD = 0.10
+
+REF_FOLDER = "../DanceDanceRotationModule/ref"
+REF_FILES_TO_COPY = [
+    "abilityInfoApi.json",
+    "abilityInfoCustom.json",
+    "paletteSkillLookup.json"
+]
+
+BENCHMARKS = [
+    "parseSong",
+    "parseFolder",
+    "createDefaultSongsArray",
+    "createAbilityInfoTable",
+    "refJsonLoad",
+    "songModel"
+]
+
+
+# MARK: Workspace
+
+#
+# Creates the project layout for a corpus size, and returns its scripts/ folder
+#
+def prepareWorkspace(size, seed, sourceSongs):
+    root = os.path.abspath(os.path.join(WORKSPACE_FOLDER, f"size{size}"))
+    scriptsFolder = os.path.join(root, "scripts")
+    refFolder = os.path.join(root, "DanceDanceRotationModule", "ref")
+    songsFolder = os.path.join(root, "defaultSongs")
+    os.makedirs(scriptsFolder, exist_ok=True)
+    os.makedirs(refFolder, exist_ok=True)
+
+    for fileName in REF_FILES_TO_COPY:
+        shutil.copyfile(os.path.join(REF_FOLDER, fileName), os.path.join(refFolder, fileName))
+
+    allSkills = syntheticSongs.createAllSkills(os.path.join(REF_FOLDER, "abilityInfoApi.json"), sourceSongs)
+    with open(os.path.join(scriptsFolder, "allSkills.json"), "w") as f:
+        json.dump(allSkills, f, indent=4)
+
+    if not syntheticSongs.isCorpusCurrent(songsFolder, size, seed):
+        print(f"Generating {size} synthetic songs")
+        syntheticSongs.generateCorpus(songsFolder, size, seed, sourceSongs)
+    return scriptsFolder
+
+@contextlib.contextmanager
+def workingDirectory(folder):
+    previousFolder = os.getcwd()
+    os.chdir(folder)
+    # Tables loaded from another folder don't apply here
+    songVerifier.clearReferenceTables()
+    try:
+        yield
+    finally:
+        os.chdir(previousFolder)
+        songVerifier.clearReferenceTables()
+
+#
+# The scripts print progress and reports, which would drown out the results
+#
+@contextlib.contextmanager
+def quiet():
+    with open(os.devnull, "w") as devnull:
+        with contextlib.redirect_stdout(devnull):
+            yield
+
+
+# MARK: Timing
+
+def timeRuns(function, repeats):
+    times = []
+    for _ in range(repeats):
+        startTime = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - startTime)
+    return times
+
+def createResult(name, size, times, **metrics):
+    result = {
+        "name": name,
+        "size": size,
+        "repeats": len(times),
+        "best": min(times),
+        "median": statistics.median(times),
+        "times": times
+    }
+    result.update(metrics)
+    return result
+
+def printResult(result):
+    extra = ", ".join(
+        f"{key} {value:.0f}" if isinstance(value, float) else f"{key} {value}"
+        for key, value in result.items()
+        if key not in ["name", "size", "repeats", "best", "median", "times"]
+    )
+    print(f"  {result['name']:40s} {result['size']:7d} {result['best'] * 1000:10.1f} ms  {extra}")
+
+
+# MARK: Benchmarks
+
+def benchParseSong(size, repeats):
+    fileNames = verifyData.listSongFiles(songVerifier.DEFAULT_SONGS_FOLDER)[:PARSE_SONG_SAMPLE_SIZE]
+    songs = [songModel.loadSongFile(fileName) for fileName in fileNames]
+    noteCount = sum(len(song.notes) for song in songs)
+
+    # Loads the reference tables, which is timed by refJsonLoad instead
+    verifyData.parseSong(songs[0])
+
+    def run():
+        for song in songs:
+            verifyData.parseSong(song)
+    times = timeRuns(run, repeats)
+    return [createResult(
+        "parseSong",
+        size,
+        times,
+        songs=len(songs),
+        notes=noteCount,
+        songsPerSecond=len(songs) / min(times),
+        notesPerSecond=noteCount / min(times)
+    )]
+
+def benchParseFolder(size, repeats, workers):
+    fileNames = verifyData.listSongFiles(songVerifier.DEFAULT_SONGS_FOLDER)
+
+    def run():
+        with quiet():
+            verifyData.parseFiles(fileNames, workers)
+    times = timeRuns(run, repeats)
+    return [createResult(
+        "parseFolder",
+        size,
+        times,
+        workers=workers,
+        songsPerSecond=len(fileNames) / min(times)
+    )]
+
+def benchCreateDefaultSongsArray(size, repeats):
+    folder = createDefaultSongsArray.DEFAULT_SONGS_FOLDER
+    with quiet():
+        fullTimes = timeRuns(lambda: createDefaultSongsArray.buildOutputs(folder, True), repeats)
+        incrementalTimes = timeRuns(lambda: createDefaultSongsArray.buildOutputs(folder, False), repeats)
+        checkTimes = timeRuns(lambda: createDefaultSongsArray.checkUpToDate(folder), repeats)
+    return [
+        createResult(
+            "createDefaultSongsArray.full",
+            size,
+            fullTimes,
+            jsonBytes=os.path.getsize(createDefaultSongsArray.OUTPUT_FILE),
+            bundleBytes=os.path.getsize(createDefaultSongsArray.BUNDLE_OUTPUT_FILE)
+        ),
+        createResult("createDefaultSongsArray.noChanges", size, incrementalTimes),
+        createResult("createDefaultSongsArray.check", size, checkTimes)
+    ]
+
+def benchCreateAbilityInfoTable(size, repeats):
+    with quiet():
+        times = timeRuns(generateData.createAbilityInfoTable, repeats)
+    return [createResult("createAbilityInfoTable", size, times)]
+
+def benchRefJsonLoad(size, repeats):
+    results = []
+    fileNames = [
+        generateData.ABILITY_INFO_FILENAME,
+        generateData.ABILITY_INFO_HOT_FILENAME,
+        generateData.ABILITY_INFO_COLD_FILENAME,
+        songVerifier.ABILITY_INFO_FILES[1],
+        songVerifier.PALETTE_SKILL_LOOKUP_FILE,
+        createDefaultSongsArray.OUTPUT_FILE
+    ]
+    for fileName in fileNames:
+        if not os.path.exists(fileName):
+            continue
+
+        def run():
+            with open(fileName, 'r', encoding='utf-8-sig') as f:
+                json.load(f)
+        times = timeRuns(run, repeats)
+        results.append(createResult(
+            "refJsonLoad." + os.path.basename(fileName),
+            size,
+            times,
+            bytes=os.path.getsize(fileName)
+        ))
+
+    if os.path.exists(createDefaultSongsArray.BUNDLE_OUTPUT_FILE):
+        def run():
+            with songBundle.SongBundle(createDefaultSongsArray.BUNDLE_OUTPUT_FILE) as bundle:
+                bundle.songList()
+        results.append(createResult(
+            "refJsonLoad.bundleSongList",
+            size,
+            timeRuns(run, repeats),
+            bytes=os.path.getsize(createDefaultSongsArray.BUNDLE_OUTPUT_FILE)
+        ))
+    return results
+
+def loadSongDict(fileName):
+    with open(fileName, 'r') as f:
+        return json.load(f)
+
+#
+# Bytes allocated to hold the songs loaded by loadSong
+#
+def measureSongMemory(fileNames, loadSong):
+    tracemalloc.start()
+    try:
+        songs = [loadSong(fileName) for fileName in fileNames]
+        memory, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del songs
+    return memory
+
+def benchSongModel(size, repeats):
+    fileNames = verifyData.listSongFiles(songVerifier.DEFAULT_SONGS_FOLDER)
+    # Memory is measured on a sample, so the songs fit in memory for any corpus size
+    sampleFileNames = fileNames[:PARSE_SONG_SAMPLE_SIZE]
+    sampleNoteCount = sum(len(songModel.loadSongFile(fileName).notes) for fileName in sampleFileNames)
+
+    loaders = [("dict", loadSongDict, None)]
+    loaders.append(("songModel.json", songModel.loadSongFile, songModel.JSON_BACKEND_STDLIB))
+    if songModel.orjson is not None:
+        loaders.append(("songModel.orjson", songModel.loadSongFile, songModel.JSON_BACKEND_ORJSON))
+
+    results = []
+    previousBackend = songModel.jsonBackend
+    try:
+        for name, loadSong, backend in loaders:
+            if backend is not None:
+                songModel.setJsonBackend(backend)
+
+            def run():
+                for fileName in fileNames:
+                    loadSong(fileName)
+            times = timeRuns(run, repeats)
+            memory = measureSongMemory(sampleFileNames, loadSong)
+            results.append(createResult(
+                "songModel.load." + name,
+                size,
+                times,
+                songsPerSecond=len(fileNames) / min(times),
+                bytesPerNote=memory / max(1, sampleNoteCount)
+            ))
+    finally:
+        songModel.setJsonBackend(previousBackend)
+    return results
+
+def runBenchmarks(size, benchmarks, repeats, workers):
+    results = []
+    if "parseSong" in benchmarks:
+        results += benchParseSong(size, repeats)
+    if "parseFolder" in benchmarks:
+        results += benchParseFolder(size, repeats, workers)
+    # These write the ref files that refJsonLoad loads
+    if "createDefaultSongsArray" in benchmarks:
+        results += benchCreateDefaultSongsArray(size, repeats)
+    if "createAbilityInfoTable" in benchmarks:
+        results += benchCreateAbilityInfoTable(size, repeats)
+    if "refJsonLoad" in benchmarks:
+        results += benchRefJsonLoad(size, repeats)
+    if "songModel" in benchmarks:
+        results += benchSongModel(size, repeats)
+    return results
+
+
+# MARK: Results
+
+def gitCommit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def environmentInfo():
+    return {
+        "commit": gitCommit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpuCount": os.cpu_count()
+    }
+
+#
+# Prints how the best time of each result changed from the previous results
+#
+def compareResults(previousResults, results):
+    previousByKey = {(result["name"], result["size"]): result for result in previousResults["results"]}
+    print("")
+    print(f"Compared to {previousResults['environment'].get('commit')}:")
+    for result in results:
+        previous = previousByKey.get((result["name"], result["size"]))
+        if previous is None:
+            continue
+        change = result["best"] / previous["best"] - 1
+        marker = "  << SLOWER" if change > REGRESSION_THRESHOLD else ""
+        print(
+            f"  {result['name']:40s} {result['size']:7d} "
+            f"{previous['best'] * 1000:10.1f} ms -> {result['best'] * 1000:10.1f} ms "
+            f"({100 * change:+6.1f}%){marker}"
+        )
+
+
+# MARK: Main
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmark")
+    parser.add_argument(
+        '--sizes',
+        type=int,
+        nargs='+',
+        default=CORPUS_SIZES,
+        help='Corpus sizes to run (number of songs)'
+    )
+    parser.add_argument(
+        '--benchmarks',
+        nargs='+',
+        choices=BENCHMARKS,
+        default=BENCHMARKS,
+        help='Benchmarks to run'
+    )
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help='Random seed of the corpora')
+    parser.add_argument('--repeats', type=int, default=3, help='Times each benchmark is run')
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=os.cpu_count() or 1,
+        help='Worker processes for parseFolder'
+    )
+    parser.add_argument('--output', default=RESULTS_FILE, help='File the results are written to')
+    parser.add_argument('--compare', help='Results of a previous run to compare with')
+    args = parser.parse_args()
+
+    sourceSongs = syntheticSongs.loadSourceSongs(syntheticSongs.SOURCE_SONGS_FOLDER)
+    results = []
+    for size in args.sizes:
+        scriptsFolder = prepareWorkspace(size, args.seed, sourceSongs)
+        print(f"{size} songs:")
+        with workingDirectory(scriptsFolder):
+            sizeResults = runBenchmarks(size, args.benchmarks, max(1, args.repeats), args.workers)
+        for result in sizeResults:
+            printResult(result)
+        results += sizeResults
+
+    with open(args.output, "w") as f:
+        json.dump({
+            "version": RESULTS_VERSION,
+            "environment": environmentInfo(),
+            "seed": args.seed,
+            "results": results
+        }, f, indent=4)
+    print(f"Wrote results to {args.output}")
+
+    if args.compare is not None:
+        with open(args.compare, 'r') as f:
+            compareResults(json.load(f), results)
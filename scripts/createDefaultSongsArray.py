@@ -1,30 +1,359 @@
+import argparse
+import hashlib
 import json
 import os
+import time
+
+import assetManifests
+import instrumentation
+import laneLayouts
+import resolvedPalettes
+import seekIndex
+import songBundle
+import songModel
 
 #
 # This script merges all the .json files in the defaultSongs/ folder into a single .json array
 # and places it in the ref/ folder of the module
+# The same songs are also written as a random access song bundle (see songBundle.py), with
+# data precomputed for every song: the lane layouts (see laneLayouts.py), a seek index
+# (see seekIndex.py), the icons to prefetch (see assetManifests.py) and the resolved
+# utility palette (see resolvedPalettes.py). How many songs use each icon is written
+# next to them.
+#
+# Songs are always written in file name order, so the same input files give byte for byte
+# the same outputs. A manifest of every song file's hash is kept between runs, and only
+# songs that were added or changed are re-encoded. Everything else is spliced in from the
+# previous outputs. Sections that are also made from the ability info tables are made
+# again for every song when the tables change.
+#
+# Run with --check to only check if the outputs are up to date
 #
 
 DEFAULT_SONGS_FOLDER = "../defaultSongs"
 OUTPUT_FILE = "../DanceDanceRotationModule/ref/defaultSongs.json"
+BUNDLE_OUTPUT_FILE = "../DanceDanceRotationModule/ref/defaultSongs.ddrbundle"
+
+# Hashes of the song files and where each song was written in the outputs of the last build
+MANIFEST_FILE = "./defaultSongs.manifest.json"
+MANIFEST_VERSION = 4
+
+# Indentation of the songs in the .json array output
+JSON_INDENT = 4
+
+# Sections of the bundle: name -> function that encodes a song's data in it
+BUNDLE_SECTIONS = {
+    laneLayouts.BUNDLE_SECTION: laneLayouts.encodeBundleSection,
+    seekIndex.BUNDLE_SECTION: seekIndex.encodeBundleSection,
+    assetManifests.BUNDLE_SECTION: assetManifests.encodeBundleSection,
+    resolvedPalettes.BUNDLE_SECTION: resolvedPalettes.encodeBundleSection
+}
+# Sections that depend on assetManifests.REFERENCE_FILES, and not only on the song
+REFERENCE_SECTIONS = [assetManifests.BUNDLE_SECTION, resolvedPalettes.BUNDLE_SECTION]
+
+OUTPUT_FILES = {
+    "json": OUTPUT_FILE,
+    "bundle": BUNDLE_OUTPUT_FILE,
+    "assets": assetManifests.ASSET_COUNTS_FILE
+}
+
+
+# MARK: Manifest
+
+def hashBytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+def fileStat(fileName):
+    stat = os.stat(fileName)
+    return {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+
+def loadManifest():
+    try:
+        with open(MANIFEST_FILE, 'r') as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+def saveManifest(manifest):
+    tempFileName = MANIFEST_FILE + ".tmp"
+    with open(tempFileName, "w") as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(tempFileName, MANIFEST_FILE)
+
+#
+# Returns true if the output files are the same ones the manifest was written with
+#
+def outputsMatchManifest(manifest):
+    if manifest is None:
+        return False
+    for outputName, outputFileName in OUTPUT_FILES.items():
+        if not os.path.exists(outputFileName):
+            return False
+        if fileStat(outputFileName) != manifest["outputs"][outputName]:
+            return False
+    return True
+
+def listSongFiles(folder):
+    return sorted(fileName for fileName in os.listdir(folder) if fileName.endswith(".json"))
+
+#
+# Returns the hash of a song file. The file is only read if its size or modified time
+# changed since the manifest was written
+#
+def songFileHash(fileName, manifestSong):
+    stat = fileStat(fileName)
+    if manifestSong is not None and manifestSong["stat"] == stat:
+        return manifestSong["hash"], stat, None
+    with open(fileName, 'rb') as f:
+        fileBytes = f.read()
+    return hashBytes(fileBytes), stat, fileBytes
+
+
+# MARK: Check
+
+#
+# Returns a list of reasons the outputs are out of date, which is empty if they are up
+# to date. This only stats files, and only hashes song files whose stats changed.
+#
+def checkUpToDate(folder):
+    manifest = loadManifest()
+    if manifest is None:
+        return ["No manifest from a previous build"]
+    if not outputsMatchManifest(manifest):
+        return ["Outputs are missing or were changed after the last build"]
+
+    reasons = []
+    if manifest["referencesHash"] != assetManifests.referencesHash():
+        reasons.append("Ability info or palette skill lookup changed")
+    manifestSongs = {song["fileName"]: song for song in manifest["songs"]}
+    fileNames = listSongFiles(folder)
+    for fileName in fileNames:
+        manifestSong = manifestSongs.get(fileName)
+        if manifestSong is None:
+            reasons.append(f"Added: {fileName}")
+            continue
+        fileHash, _, _ = songFileHash(os.path.join(folder, fileName), manifestSong)
+        if fileHash != manifestSong["hash"]:
+            reasons.append(f"Modified: {fileName}")
+    for fileName in sorted(set(manifestSongs) - set(fileNames)):
+        reasons.append(f"Removed: {fileName}")
+    return reasons
+
+
+# MARK: Build
+
+#
+# Renders a song the way json.dumps(songs, indent=JSON_INDENT) renders an array element
+#
+def renderJsonArrayElement(song):
+    indent = " " * JSON_INDENT
+    return (indent + json.dumps(song, indent=JSON_INDENT).replace("\n", "\n" + indent)).encode("utf-8")
+
+#
+# Joins rendered elements into the same bytes as json.dumps(songs, indent=JSON_INDENT)
+#
+def assembleJsonArray(elements):
+    if len(elements) == 0:
+        return b"[]"
+    return b"[\n" + b",\n".join(elements) + b"\n]"
+
+#
+# Raises a SongFormatError if a song doesn't match the schema, before any of it is encoded.
+# The outputs are still made from the parsed json, so they keep the song file's values
+# as they are written (like abilityIds written as strings)
+#
+def checkSongFormat(fileName, song):
+    try:
+        noteProblems = songModel.decodeSong(song).noteProblems
+    except songModel.SongFormatError as e:
+        raise songModel.SongFormatError(f"{fileName}: {e}")
+    if len(noteProblems) > 0:
+        index, reason = noteProblems[0]
+        raise songModel.SongFormatError(f"{fileName}: note {index}: {reason}")
+
+def writeFileAtomically(fileName, data):
+    tempFileName = fileName + ".tmp"
+    with open(tempFileName, "wb") as f:
+        f.write(data)
+    os.replace(tempFileName, fileName)
+    instrumentation.count("bytesWritten", len(data))
+
+#
+# Prints the songs whose build has palette IDs that aren't in paletteSkillLookup.json,
+# since their utility icons can't be shown until the lookup is updated
+#
+def printUnresolvedPalettes(catalog, paletteSections):
+    unresolvedSongs = []
+    for catalogEntry, data in zip(catalog, paletteSections):
+        palette = resolvedPalettes.decodePalette(data, catalogEntry["noteCount"])
+        paletteIds = resolvedPalettes.unresolvedPaletteIds(palette)
+        if len(paletteIds) > 0:
+            unresolvedSongs.append((catalogEntry["name"], paletteIds))
+    if len(unresolvedSongs) == 0:
+        return
+    print(f"{len(unresolvedSongs)} songs have palette IDs that are not in paletteSkillLookup.json:")
+    for name, paletteIds in unresolvedSongs:
+        print(f"  {name}: {', '.join(str(paletteId) for paletteId in paletteIds)}")
+
+#
+# Builds the outputs. Songs that have the same hash as in the manifest are copied out
+# of the previous outputs, everything else is read and encoded.
+#
+def buildOutputs(folder, forceFull):
+    manifest = None if forceFull else loadManifest()
+    if not outputsMatchManifest(manifest):
+        manifest = None
+    referencesHash = assetManifests.referencesHash()
+    referencesChanged = manifest is not None and manifest["referencesHash"] != referencesHash
+    if referencesChanged:
+        print("Ability info or palette skill lookup changed, updating the icon manifests of every song")
+
+    previousSongs = {}
+    previousJsonBytes = None
+    previousBundle = None
+    if manifest is not None:
+        previousSongs = {song["fileName"]: song for song in manifest["songs"]}
+        with open(OUTPUT_FILE, 'rb') as f:
+            previousJsonBytes = f.read()
+        previousBundle = songBundle.SongBundle(BUNDLE_OUTPUT_FILE)
+        # Songs can't be copied out of a bundle that doesn't have every section
+        if not set(BUNDLE_SECTIONS).issubset(previousBundle.sectionNames()):
+            previousBundle.close()
+            previousSongs = {}
+            previousJsonBytes = None
+            previousBundle = None
+
+    jsonElements = []
+    catalog = []
+    payloads = []
+    sections = {name: [] for name in BUNDLE_SECTIONS}
+    manifestSongs = []
+    addedCount = 0
+    modifiedCount = 0
+    unchangedCount = 0
+
+    jsonOffset = len(b"[\n")
+    for position, fileName in enumerate(listSongFiles(folder)):
+        fullFileName = os.path.join(folder, fileName)
+        previousSong = previousSongs.get(fileName)
+        fileHash, stat, fileBytes = songFileHash(fullFileName, previousSong)
+
+        instrumentation.count("songs")
+        if previousSong is not None and previousSong["hash"] == fileHash:
+            unchangedCount += 1
+            element = previousJsonBytes[
+                previousSong["jsonOffset"]:previousSong["jsonOffset"] + previousSong["jsonLength"]
+            ]
+            catalogEntry = previousBundle.songList()[previousSong["position"]]
+            payload = previousBundle.readPayload(previousSong["position"])
+            sectionData = {
+                name: previousBundle.readSection(previousSong["position"], name) for name in BUNDLE_SECTIONS
+            }
+            if referencesChanged:
+                song = songBundle.decodeSongPayload(payload)
+                for name in REFERENCE_SECTIONS:
+                    sectionData[name] = BUNDLE_SECTIONS[name](song)
+        else:
+            if previousSong is None:
+                addedCount += 1
+                print("Adding '" + fileName + "'")
+            else:
+                modifiedCount += 1
+                print("Updating '" + fileName + "'")
+            with instrumentation.span("encodeSong", fileName=fileName):
+                song = songModel.loadsJson(fileBytes)
+                checkSongFormat(fileName, song)
+                element = renderJsonArrayElement(song)
+                catalogEntry = songBundle.createCatalogEntry(song)
+                payload = songBundle.encodeSongPayload(song, songBundle.ENCODING_COLUMNAR)
+                sectionData = {name: encodeSection(song) for name, encodeSection in BUNDLE_SECTIONS.items()}
+            instrumentation.count("songsEncoded")
+            instrumentation.count("notesEncoded", len(song.get("notes", [])))
+
+        jsonElements.append(element)
+        catalog.append(catalogEntry)
+        payloads.append(payload)
+        for name, data in sectionData.items():
+            sections[name].append(data)
+        manifestSongs.append({
+            "fileName": fileName,
+            "hash": fileHash,
+            "stat": stat,
+            "position": position,
+            "jsonOffset": jsonOffset,
+            "jsonLength": len(element)
+        })
+        jsonOffset += len(element) + len(b",\n")
+
+    if previousBundle is not None:
+        previousBundle.close()
+
+    removedCount = len(set(previousSongs) - set(song["fileName"] for song in manifestSongs))
+    for fileName in sorted(set(previousSongs) - set(song["fileName"] for song in manifestSongs)):
+        print("Removing '" + fileName + "'")
+
+    # Write out the array, the bundle and the icon counts
+    with instrumentation.span("writeOutputs"):
+        writeFileAtomically(OUTPUT_FILE, assembleJsonArray(jsonElements))
+        writeFileAtomically(BUNDLE_OUTPUT_FILE, songBundle.assembleSongBundle(catalog, payloads, sections))
+        writeFileAtomically(assetManifests.ASSET_COUNTS_FILE, assetManifests.encodeAssetCounts([
+            assetManifests.decodeAssetManifest(data) for data in sections[assetManifests.BUNDLE_SECTION]
+        ]))
+
+    saveManifest({
+        "version": MANIFEST_VERSION,
+        "outputs": {
+            outputName: fileStat(outputFileName) for outputName, outputFileName in OUTPUT_FILES.items()
+        },
+        "referencesHash": referencesHash,
+        "songs": manifestSongs
+    })
+
+    print(
+        f"{len(manifestSongs)} songs: {addedCount} added, {modifiedCount} modified, "
+        f"{removedCount} removed, {unchangedCount} unchanged"
+    )
+    printUnresolvedPalettes(catalog, sections[resolvedPalettes.BUNDLE_SECTION])
+
+
+# MARK: Main
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="createDefaultSongsArray")
+    parser.add_argument(
+        '--check',
+        action='store_true',
+        help='Only checks if the outputs are up to date. Exits with 1 if they are not'
+    )
+    parser.add_argument(
+        '--full',
+        action='store_true',
+        help='Ignores the manifest and re-encodes every song'
+    )
+    parser.add_argument(
+        '--trace',
+        metavar='FILE',
+        help='Records timings and counters, and writes them to FILE as a Chrome trace'
+    )
+    args = parser.parse_args()
+    if args.trace:
+        instrumentation.enable(args.trace)
 
-outputJson = []
-for filename in os.listdir(DEFAULT_SONGS_FOLDER):
-    if filename.endswith(".json"):
-        print("Adding '" + filename + "'")
-        with open(os.path.join(DEFAULT_SONGS_FOLDER, filename), 'r') as f:
-            fileJson = json.load(f)
-            outputJson.append(fileJson)
-
-# Write out the array
-prettyJson = json.dumps(
-    outputJson,
-    # sort_keys=True,
-    indent=4
-)
-outputFile = open(OUTPUT_FILE, "w")
-outputFile.write(
-    prettyJson
-)
-outputFile.close()
+    if args.check:
+        startTime = time.perf_counter()
+        with instrumentation.span("checkUpToDate"):
+            reasons = checkUpToDate(DEFAULT_SONGS_FOLDER)
+        elapsed = (time.perf_counter() - startTime) * 1000
+        if len(reasons) == 0:
+            print(f"Up to date ({elapsed:.1f} ms)")
+        else:
+            print(f"Out of date ({elapsed:.1f} ms):")
+            for reason in reasons:
+                print("  " + reason)
+            raise SystemExit(1)
+    else:
+        with instrumentation.span("buildOutputs"):
+            buildOutputs(DEFAULT_SONGS_FOLDER, args.full)
@@ -1,7 +1,20 @@
 import argparse
-import requests
+import collections
+import email.utils
+import hashlib
+import heapq
 import json
+import os
+import threading
 import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import abilityInfoIndex
+import instrumentation
+import songModel
 
 #
 # This is a script that will generate the required metadata files used by this project.
@@ -12,25 +25,170 @@ ALL_SKILLS_FILENAME = "./allSkills.json"
 # A json object of paletteSkillId -> abilityId. Taken from wiki
 # PALETTE_SKILL_LOOKUP_FILENAME = "./paletteSkillLookup.json"
 
+# Cached batch responses from previous fetches, used by the --incremental mode
+SKILL_CACHE_FILENAME = "./skillCache.json"
+
+# Append-only journal of the batches finished by the current crawl, and the
+# checkpoint that records how much of the journal has been committed.
+# Both are removed once the crawl completes
+CRAWL_JOURNAL_FILENAME = "./skillCrawl.ndjson"
+CRAWL_CHECKPOINT_FILENAME = "./skillCrawl.checkpoint.json"
+
+# How long a cached batch is used before it is revalidated with the server (seconds)
+DEFAULT_CACHE_MAX_AGE = 24 * 60 * 60
+
 # Output filename for generated info used by the module
 ABILITY_INFO_FILENAME = "../DanceDanceRotationModule/ref/abilityInfoApi.json"
+# abilityInfoApi.json split into the abilities the default songs reference (hot)
+# and all the others (cold)
+ABILITY_INFO_HOT_FILENAME = "../DanceDanceRotationModule/ref/abilityInfoApiHot.json"
+ABILITY_INFO_COLD_FILENAME = "../DanceDanceRotationModule/ref/abilityInfoApiCold.json"
+
+# Used to find which abilities are referenced by the default songs
+DEFAULT_SONGS_FOLDER = "../defaultSongs"
+PALETTE_SKILL_LOOKUP_FILE = "../DanceDanceRotationModule/ref/paletteSkillLookup.json"
+
+SKILLS_API_URL = "https://api.guildwars2.com/v2/skills"
 
-# Don't want to hammer the guild wars server, so sleep a bit between requests
-SLEEP_TIME = 5.0
+# The API allows requesting multiple IDs at once, so block it with this stepSize
+# This is the step size used by the wiki tool
+REQUEST_STEP_SIZE = 200
+
+# Number of batch requests that are allowed to be in flight at the same time
+DEFAULT_CONCURRENCY = 4
+
+# Don't want to hammer the guild wars server, so requests are rate limited.
+# The limiter starts at this rate, slows down when the server responds with 429
+# (or sends a Retry-After), and works its way back up once requests succeed again.
+DEFAULT_REQUESTS_PER_SECOND = 4.0
+MIN_REQUESTS_PER_SECOND = 0.2
+
+# How many times a single batch is retried after being rate limited
+MAX_THROTTLE_RETRIES = 5
+
+# Batches that fail (errors, bad json) are retried this many times, waiting
+# BATCH_RETRY_BASE_DELAY * 2^attempt seconds before each retry
+MAX_BATCH_RETRIES = 4
+BATCH_RETRY_BASE_DELAY = 2.0
 
 
 ##########################################
 
 
 
+## MARK: Rate Limiting
+
+#
+# A thread safe token bucket. Every request has to acquire a token first.
+# The refill rate is adaptive: it is halved whenever the server throttles us and
+# recovers a bit after every successful request, up to the configured maximum.
+#
+class RateLimiter:
+    def __init__(self, maxRate, minRate=MIN_REQUESTS_PER_SECOND):
+        self.maxRate = maxRate
+        self.minRate = min(minRate, maxRate)
+        self.rate = maxRate
+        self.capacity = max(1.0, maxRate)
+        self.tokens = self.capacity
+        self.lastRefill = time.monotonic()
+        self.blockedUntil = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.lastRefill) * self.rate)
+        self.lastRefill = now
+
+    # Blocks until a request is allowed to be sent
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self.blockedUntil and self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                waitTime = max(
+                    self.blockedUntil - now,
+                    (1.0 - self.tokens) / self.rate
+                )
+            with instrumentation.span("sleep", reason="rateLimit"):
+                time.sleep(waitTime)
+
+    def onSuccess(self):
+        with self.lock:
+            self.rate = min(self.maxRate, self.rate + self.maxRate * 0.1)
+
+    def onThrottled(self, retryAfter):
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.rate = max(self.minRate, self.rate / 2)
+            self.tokens = 0.0
+            if retryAfter is not None:
+                self.blockedUntil = max(self.blockedUntil, now + retryAfter)
+            print(f"Throttled by server. Slowing down to {self.rate:.2f} requests/sec")
+
+#
+# Returns the Retry-After header of a response in seconds, or None if it is missing.
+# The header is allowed to be either a number of seconds or an HTTP date.
+#
+def parseRetryAfter(response):
+    retryAfter = response.headers.get("Retry-After")
+    if retryAfter is None:
+        return None
+    try:
+        return max(0.0, float(retryAfter))
+    except ValueError:
+        pass
+    try:
+        retryDate = email.utils.parsedate_to_datetime(retryAfter)
+        return max(0.0, retryDate.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+#
+# Counts the requests made during a fetch, so the totals can be reported at the end
+#
+class FetchStats:
+    def __init__(self):
+        self.startTime = time.monotonic()
+        self.requestCount = 0
+        self.throttledCount = 0
+        self.lock = threading.Lock()
+
+    def addRequest(self, wasThrottled):
+        with self.lock:
+            self.requestCount += 1
+            if wasThrottled:
+                self.throttledCount += 1
+
+    def report(self, batchCount):
+        elapsed = time.monotonic() - self.startTime
+        requestsPerSecond = self.requestCount / elapsed if elapsed > 0 else 0.0
+        print(
+            f"Fetched {batchCount} batches with {self.requestCount} requests "
+            f"({self.throttledCount} throttled) in {elapsed:.2f}s "
+            f"({requestsPerSecond:.2f} requests/sec)"
+        )
+
 ## MARK: allSkills.json generation methods
 
+#
+# Creates a requests Session that keeps alive enough connections for every
+# request in flight
+#
+def createSession(concurrency):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+    session.mount("https://", adapter)
+    return session
+
 #
 # Makes an API request and returns an array of all ability IDs in the API
 #
 def fetchSkillIds():
     # Returns an array of ints, each int is a skill ID
-    response = requests.get(url="https://api.guildwars2.com/v2/skills")
+    response = requests.get(url=SKILLS_API_URL)
     return response.json()
 
 #
@@ -46,76 +204,477 @@ def createRequestChunk(ids, startIndex, endIndex):
     return idsToRequest
 
 #
-# Makes multiple requests to fetch the requested ability ID jsons and writes the json
-# into an output file
+# Fetches a single batch of skills, retrying if the server throttles the request.
+# Any extra headers (like the conditional request headers) are sent along with it.
+# Returns the response (either 200 or 304), or None if the batch failed
 #
-def fetchSkills(ids, outputFile):
-    # The API allows requesting multiple IDs at once, so block it with this stepSize
-    # This is the step size used by the wiki tool
-    stepSize = 200
-    
-    outputFile = open(ALL_SKILLS_FILENAME, "w")
-    maxIndex = len(ids) - 1
+def fetchSkillBatch(session, limiter, stats, batchIds, headers=None):
+    idsString = ",".join(str(id) for id in batchIds)
+    print(f"Making Fetch: {batchIds[0]} -> {batchIds[-1]}")
 
-    isFirstSkill = True
-    outputFile.write("{\n")
-    
-    for startIndex in range(0, len(ids), stepSize):
-        idsToRequest = []  # Use a list instead of string concatenation
-        endIndex = min(startIndex + stepSize, maxIndex + 1)  # Fix the endIndex calculation
-        
-        # Collect IDs for this batch
-        idsToRequest = ids[startIndex:endIndex]
-        
-        # Join IDs with commas
-        ids_string = ",".join(str(id) for id in idsToRequest)
-        
-        print(f"Making Fetch: {ids[startIndex]} -> {ids[endIndex-1]}")
-        
-        response = requests.get(url=f"https://api.guildwars2.com/v2/skills?ids={ids_string}")
-        
-        if response.status_code != 200:
+    for attempt in range(MAX_THROTTLE_RETRIES + 1):
+        limiter.acquire()
+        try:
+            with instrumentation.span("request", firstId=batchIds[0], attempt=attempt):
+                response = session.get(
+                    url=SKILLS_API_URL,
+                    params={"ids": idsString},
+                    headers=headers
+                )
+        except requests.RequestException as e:
+            stats.addRequest(False)
+            instrumentation.count("requestErrors")
+            print(f"Error with request: {e}")
+            return None
+        instrumentation.count("requests")
+        instrumentation.count("bytesFetched", len(response.content))
+
+        isThrottled = response.status_code == 429 or (
+            response.status_code == 503 and "Retry-After" in response.headers
+        )
+        stats.addRequest(isThrottled)
+        if isThrottled:
+            instrumentation.count("throttled")
+            limiter.onThrottled(parseRetryAfter(response))
+            continue
+
+        if response.status_code not in (200, 304):
             print(f"Error with request: {response.status_code}")
             print(f"Response: {response.text[:200]}")
-            continue
-            
-        try:
+            return None
+
+        limiter.onSuccess()
+        if response.status_code == 304:
+            instrumentation.count("notModified")
+        return response
+
+    print(f"Giving up on batch {batchIds[0]} -> {batchIds[-1]} after {MAX_THROTTLE_RETRIES} retries")
+    return None
+
+#
+# Decodes a batch response and returns only the skills that belong to a profession,
+# or None if the response was not valid json
+#
+def decodeProfessionSkills(response):
+    try:
+        with instrumentation.span("decodeJson"):
             jsonResponse = response.json()
-            professionSkillsFound = 0
-            for skillJson in jsonResponse:
-                skillId = skillJson.get("id")
-                if not skillId:
-                    print("Skill Has No ID:\n" + str(skillJson))
-                    continue
-
-                professions = skillJson.get("professions", [])
-                if not professions:
-                    continue
-
-                if len(professions) > 0:
-                    professionSkillsFound += 1
-                    prettyJson = ""
-                    if not isFirstSkill:
-                        prettyJson += ","
-                    isFirstSkill = False
-                    prettyJson += f'\n"{skillId}": '
-                    prettyJson += json.dumps(
-                        skillJson,
-                        sort_keys=True,
-                        indent=4,
-                        separators=(',', ': ')
-                    )
-                    outputFile.write(prettyJson)
-            
-            print(f"Found {professionSkillsFound} Profession Skills")
-            time.sleep(SLEEP_TIME)
-            
-        except json.JSONDecodeError as e:
-            print(f"JSON Decode Error: {e}")
+    except json.JSONDecodeError as e:
+        print(f"JSON Decode Error: {e}")
+        return None
+
+    professionSkills = []
+    for skillJson in jsonResponse:
+        skillId = skillJson.get("id")
+        if not skillId:
+            print("Skill Has No ID:\n" + str(skillJson))
+            continue
+
+        professions = skillJson.get("professions", [])
+        if not professions:
             continue
 
+        professionSkills.append(skillJson)
+
+    print(f"Found {len(professionSkills)} Profession Skills")
+    return professionSkills
+
+#
+# Writes the allSkills.json file from the skill jsons, in the order they are given.
+# The file is written next to the output and then moved over it, so a crash
+# never leaves a partially written allSkills.json behind
+#
+def writeAllSkills(outputFileName, skillJsons):
+    tempFileName = outputFileName + ".tmp"
+    outputFile = open(tempFileName, "w")
+    isFirstSkill = True
+    outputFile.write("{\n")
+    for skillJson in skillJsons:
+        prettyJson = ""
+        if not isFirstSkill:
+            prettyJson += ","
+        isFirstSkill = False
+        prettyJson += f'\n"{skillJson["id"]}": '
+        prettyJson += json.dumps(
+            skillJson,
+            sort_keys=True,
+            indent=4,
+            separators=(',', ': ')
+        )
+        outputFile.write(prettyJson)
     outputFile.write("\n}")
     outputFile.close()
+    os.replace(tempFileName, outputFileName)
+
+## MARK: Skill Cache
+
+#
+# Counts how the cached batches were used during an incremental fetch
+#
+class CacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.refreshes = 0
+        self.newIds = 0
+        self.removedIds = 0
+
+    def report(self):
+        print(
+            f"Cache: {self.hits} hits, {self.misses} misses, "
+            f"{self.revalidations} revalidations (304), {self.refreshes} refreshed. "
+            f"{self.newIds} new IDs, {self.removedIds} removed IDs"
+        )
+
+#
+# Loads the cached batches written by a previous fetch. Returns an empty list if
+# there is no cache yet, or if it can't be read
+#
+def loadSkillCache(cacheFileName):
+    try:
+        with open(cacheFileName, 'r') as f:
+            return json.load(f)["batches"]
+    except FileNotFoundError:
+        return []
+    except (json.JSONDecodeError, KeyError) as e:
+        print(f"Ignoring unreadable skill cache '{cacheFileName}': {e}")
+        return []
+
+#
+# Writes the cached batches out. The file is replaced in one step, so an
+# interrupted write never leaves a half written cache behind
+#
+def saveSkillCache(cacheFileName, batches):
+    tempFileName = cacheFileName + ".tmp"
+    with open(tempFileName, "w") as f:
+        json.dump({"batches": batches}, f)
+    os.replace(tempFileName, cacheFileName)
+
+def createCacheBatch(batchIds):
+    return {
+        "ids": batchIds,
+        "etag": None,
+        "lastModified": None,
+        "fetchedAt": 0,
+        "skills": []
+    }
+
+#
+# Diffs the current list of IDs against the cached batches.
+# Removed IDs are dropped from their cached batch, and new IDs are grouped into
+# new (empty) batches at the end. Returns the planned list of batches.
+#
+def planSkillBatches(ids, cachedBatches, cacheStats):
+    currentIds = set(ids)
+    cachedIds = set()
+    plannedBatches = []
+    for batch in cachedBatches:
+        keptIds = [id for id in batch["ids"] if id in currentIds and id not in cachedIds]
+        cacheStats.removedIds += len(batch["ids"]) - len(keptIds)
+        cachedIds.update(keptIds)
+        if not keptIds:
+            continue
+        if len(keptIds) != len(batch["ids"]):
+            # The validators belong to the old request, which asked for different IDs
+            keptIdSet = set(keptIds)
+            batch = dict(
+                batch,
+                ids=keptIds,
+                etag=None,
+                lastModified=None,
+                skills=[skill for skill in batch["skills"] if skill["id"] in keptIdSet]
+            )
+        plannedBatches.append(batch)
+
+    newIds = [id for id in dict.fromkeys(ids) if id not in cachedIds]
+    cacheStats.newIds = len(newIds)
+    for startIndex in range(0, len(newIds), REQUEST_STEP_SIZE):
+        plannedBatches.append(
+            createCacheBatch(newIds[startIndex:startIndex + REQUEST_STEP_SIZE])
+        )
+    return plannedBatches
+
+#
+# Returns the conditional request headers for a cached batch
+#
+def conditionalHeaders(batch):
+    headers = {}
+    if batch["etag"]:
+        headers["If-None-Match"] = batch["etag"]
+    if batch["lastModified"]:
+        headers["If-Modified-Since"] = batch["lastModified"]
+    return headers
+
+## MARK: Crawl Journal
+
+#
+# An append-only record of the batches a crawl has finished, so an interrupted
+# crawl can pick up where it left off.
+#
+# Every finished batch is appended to the journal as one json line and flushed to
+# disk. Then the checkpoint file is replaced with the new committed size of the
+# journal. Anything in the journal past the committed size (a line that was being
+# written when the crawl died) is thrown away on resume.
+#
+class CrawlJournal:
+    def __init__(self, journalFileName, checkpointFileName, planHash):
+        self.journalFileName = journalFileName
+        self.checkpointFileName = checkpointFileName
+        self.planHash = planHash
+        self.committedBatches = 0
+        self.committedSize = 0
+        self.journalFile = None
+
+    #
+    # Returns the records committed by a previous crawl of the same plan, and opens
+    # the journal for appending. A journal from a different plan, or one that is
+    # missing records the checkpoint committed, is discarded
+    #
+    def resume(self):
+        records = []
+        checkpoint = None
+        try:
+            with open(self.checkpointFileName, 'r') as f:
+                checkpoint = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+
+        # The journal has to still have every record the checkpoint committed
+        try:
+            journalSize = os.path.getsize(self.journalFileName)
+        except FileNotFoundError:
+            journalSize = -1
+        if checkpoint is not None and (
+            checkpoint.get("planHash") != self.planHash or journalSize < checkpoint.get("journalSize", 0)
+        ):
+            checkpoint = None
+
+        if checkpoint is not None:
+            self.committedSize = checkpoint["journalSize"]
+            with open(self.journalFileName, 'rb') as f:
+                committedBytes = f.read(self.committedSize)
+            for line in committedBytes.splitlines():
+                records.append(json.loads(line))
+            self.committedBatches = len(records)
+            self.journalFile = open(self.journalFileName, "r+b")
+            self.journalFile.truncate(self.committedSize)
+            self.journalFile.seek(self.committedSize)
+        else:
+            self.journalFile = open(self.journalFileName, "wb")
+            self.writeCheckpoint()
+        return records
+
+    def commit(self, record):
+        line = json.dumps(record, separators=(',', ':')) + "\n"
+        self.journalFile.write(line.encode("utf-8"))
+        self.journalFile.flush()
+        os.fsync(self.journalFile.fileno())
+        self.committedSize += len(line.encode("utf-8"))
+        self.committedBatches += 1
+        self.writeCheckpoint()
+
+    def writeCheckpoint(self):
+        tempFileName = self.checkpointFileName + ".tmp"
+        with open(tempFileName, "w") as f:
+            json.dump(
+                {
+                    "planHash": self.planHash,
+                    "committedBatches": self.committedBatches,
+                    "journalSize": self.committedSize
+                },
+                f
+            )
+        os.replace(tempFileName, self.checkpointFileName)
+
+    #
+    # Closes the journal. Once the crawl is complete its output has been written,
+    # so the journal and checkpoint are no longer needed
+    #
+    def close(self, isComplete):
+        self.journalFile.close()
+        if isComplete:
+            os.remove(self.journalFileName)
+            os.remove(self.checkpointFileName)
+
+#
+# A hash of the IDs in every planned batch. A crawl can only be resumed with the
+# same plan, since the journal refers to batches by their index
+#
+def hashBatchPlan(batches):
+    planHash = hashlib.sha1()
+    for batch in batches:
+        planHash.update((",".join(str(id) for id in batch["ids"]) + ";").encode("utf-8"))
+    return planHash.hexdigest()
+
+#
+# Applies a journal record onto the planned batch it was made for
+#
+def applyBatchRecord(batch, record):
+    batch["fetchedAt"] = record["fetchedAt"]
+    if record["status"] == 200:
+        batch["skills"] = record["skills"]
+        batch["etag"] = record["etag"]
+        batch["lastModified"] = record["lastModified"]
+
+## MARK: allSkills.json fetching
+
+#
+# Fetches one planned batch and turns it into a journal record.
+# Returns None if the batch failed and should be retried
+#
+def fetchBatchRecord(session, limiter, stats, index, batch):
+    response = fetchSkillBatch(
+        session, limiter, stats, batch["ids"], conditionalHeaders(batch)
+    )
+    if response is None:
+        return None
+
+    record = {
+        "index": index,
+        "status": response.status_code,
+        "fetchedAt": time.time()
+    }
+    if response.status_code == 200:
+        professionSkills = decodeProfessionSkills(response)
+        if professionSkills is None:
+            return None
+        record["skills"] = professionSkills
+        record["etag"] = response.headers.get("ETag")
+        record["lastModified"] = response.headers.get("Last-Modified")
+    return record
+
+#
+# Makes multiple concurrent requests to fetch the requested ability ID jsons and
+# writes the json into an output file. Batches are written in the same order they
+# were requested, so the output does not depend on which request finishes first.
+#
+# Every batch response is stored in the skill cache along with its ETag and
+# Last-Modified values. When incremental is set, the cache from the previous run
+# is used: only new IDs and expired batches are requested, and expired batches
+# are revalidated with conditional requests.
+#
+# Finished batches are committed to the crawl journal as they arrive, so if the
+# crawl is interrupted the next run resumes from there. Failed batches are put in
+# a retry queue with an exponential backoff. Returns False (without writing the
+# output) if a batch still failed after all of its retries.
+#
+def fetchSkills(
+    ids,
+    outputFileName,
+    concurrency=DEFAULT_CONCURRENCY,
+    requestsPerSecond=DEFAULT_REQUESTS_PER_SECOND,
+    cacheFileName=SKILL_CACHE_FILENAME,
+    incremental=False,
+    cacheMaxAge=DEFAULT_CACHE_MAX_AGE
+):
+    cacheStats = CacheStats()
+    cachedBatches = loadSkillCache(cacheFileName) if incremental else []
+    batches = planSkillBatches(ids, cachedBatches, cacheStats)
+
+    journal = CrawlJournal(
+        CRAWL_JOURNAL_FILENAME,
+        CRAWL_CHECKPOINT_FILENAME,
+        hashBatchPlan(batches)
+    )
+    resumedIndexes = set()
+    for record in journal.resume():
+        applyBatchRecord(batches[record["index"]], record)
+        resumedIndexes.add(record["index"])
+    if len(resumedIndexes) > 0:
+        print(f"Resuming crawl: {len(resumedIndexes)} batches were already committed")
+
+    now = time.time()
+    indexesToFetch = collections.deque()
+    for index, batch in enumerate(batches):
+        if index in resumedIndexes:
+            continue
+        if now - batch["fetchedAt"] < cacheMaxAge:
+            cacheStats.hits += 1
+        else:
+            indexesToFetch.append(index)
+    fetchCount = len(indexesToFetch)
+
+    session = createSession(concurrency)
+    limiter = RateLimiter(requestsPerSecond)
+    stats = FetchStats()
+
+    # Heap of (retryTime, index, attempt) for batches waiting to be retried
+    retryQueue = []
+    failedIndexes = []
+    pendingFutures = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while indexesToFetch or retryQueue or pendingFutures:
+            now = time.monotonic()
+            while len(pendingFutures) < concurrency:
+                if retryQueue and retryQueue[0][0] <= now:
+                    _, index, attempt = heapq.heappop(retryQueue)
+                elif indexesToFetch:
+                    index, attempt = indexesToFetch.popleft(), 0
+                else:
+                    break
+                future = executor.submit(
+                    fetchBatchRecord, session, limiter, stats, index, batches[index]
+                )
+                pendingFutures[future] = (index, attempt)
+
+            timeout = None
+            if retryQueue:
+                timeout = max(0.0, retryQueue[0][0] - now)
+            if not pendingFutures:
+                with instrumentation.span("sleep", reason="retryBackoff"):
+                    time.sleep(timeout)
+                continue
+
+            doneFutures, _ = wait(pendingFutures, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in doneFutures:
+                index, attempt = pendingFutures.pop(future)
+                record = future.result()
+                batch = batches[index]
+                if record is not None:
+                    if record["status"] == 304:
+                        cacheStats.revalidations += 1
+                    elif batch["fetchedAt"] > 0:
+                        cacheStats.refreshes += 1
+                    else:
+                        cacheStats.misses += 1
+                    applyBatchRecord(batch, record)
+                    journal.commit(record)
+                    instrumentation.count("batches")
+                elif attempt < MAX_BATCH_RETRIES:
+                    instrumentation.count("retries")
+                    retryDelay = BATCH_RETRY_BASE_DELAY * (2 ** attempt)
+                    print(f"Retrying batch {batch['ids'][0]} -> {batch['ids'][-1]} in {retryDelay:.1f}s")
+                    heapq.heappush(retryQueue, (time.monotonic() + retryDelay, index, attempt + 1))
+                else:
+                    failedIndexes.append(index)
+
+    session.close()
+    stats.report(fetchCount)
+    if incremental:
+        cacheStats.report()
+
+    # Batches that were fetched by a previous run can still use their old data
+    missingIndexes = [index for index in failedIndexes if batches[index]["fetchedAt"] == 0]
+    for index in failedIndexes:
+        if batches[index]["fetchedAt"] > 0:
+            print(f"Keeping previous data for batch {batches[index]['ids'][0]} -> {batches[index]['ids'][-1]}")
+    if len(missingIndexes) > 0:
+        print(f"!! {len(missingIndexes)} batches failed after {MAX_BATCH_RETRIES} retries !!")
+        for index in missingIndexes:
+            print(f"  {batches[index]['ids'][0]} -> {batches[index]['ids'][-1]}")
+        print(f"{ALL_SKILLS_FILENAME} was not written. Run again to resume the crawl")
+        journal.close(False)
+        return False
+
+    with instrumentation.span("writeOutputs"):
+        saveSkillCache(cacheFileName, batches)
+        writeAllSkills(
+            outputFileName,
+            [skill for batch in batches for skill in batch["skills"]]
+        )
+    journal.close(True)
+    return True
 
 # MARK: AbilityInfo Lookup Table Functions
 
@@ -125,7 +684,7 @@ def fetchSkills(ids, outputFile):
 #
 def createAbilityInfoTable():
     abilityIdToImageId = {}
-    with open(ALL_SKILLS_FILENAME, 'r') as f:
+    with open(ALL_SKILLS_FILENAME, 'r') as f, instrumentation.span("readAllSkills"):
         allSkillsJson = json.load(f)
         for abilityId, info in allSkillsJson.items():
             abilityInfo = {}
@@ -146,17 +705,101 @@ def createAbilityInfoTable():
     #             abilityIdToImageId[paletteId] = abilityIdToImageId[abilityId]
                 # print("PALETTE: " + str(paletteId) + ": " + str(abilityIdToImageId[abilityId]))
 
+    writeAbilityInfoJson(abilityIdToImageId, ABILITY_INFO_FILENAME)
+
+    # Binary indexes of the same table, one with the custom abilities merged on top
+    with instrumentation.span("writeAbilityInfoIndex"):
+        abilityInfoIndex.writeAbilityInfoIndex(
+            abilityIdToImageId,
+            abilityInfoIndex.ABILITY_INFO_API_INDEX_FILE
+        )
+        abilityInfoIndex.writeAbilityInfoIndex(
+            abilityInfoIndex.loadAbilityInfoFiles([
+                ABILITY_INFO_FILENAME,
+                abilityInfoIndex.ABILITY_INFO_CUSTOM_FILE
+            ]),
+            abilityInfoIndex.ABILITY_INFO_INDEX_FILE
+        )
+
+    with instrumentation.span("createTieredAbilityInfoTables"):
+        createTieredAbilityInfoTables(abilityIdToImageId)
+
+#
+# Writes an abilityId -> info table in the same format as abilityInfoApi.json.
+# Returns the size of the written file in bytes
+#
+def writeAbilityInfoJson(abilityInfo, fileName):
     prettyJson = json.dumps(
-        abilityIdToImageId,
+        abilityInfo,
         sort_keys=True,
         indent=4
         # separators=(',', ': ')
     )
-    outputFile = open(ABILITY_INFO_FILENAME, "w")
-    outputFile.write(
-        prettyJson
+    with instrumentation.span("writeAbilityInfoJson", fileName=fileName):
+        outputFile = open(fileName, "w")
+        outputFile.write(
+            prettyJson
+        )
+        outputFile.close()
+    size = len(prettyJson.encode("utf-8"))
+    instrumentation.count("bytesWritten", size)
+    return size
+
+#
+# Returns the set of ability IDs (as strings) a default song session can look up:
+# every note in the default songs, plus every palette skill target
+#
+def findReferencedAbilityIds():
+    referencedAbilityIds = set()
+    for fileName in sorted(os.listdir(DEFAULT_SONGS_FOLDER)):
+        if not fileName.endswith(".json"):
+            continue
+        song = songModel.loadSongFile(os.path.join(DEFAULT_SONGS_FOLDER, fileName))
+        for note in song.notes:
+            if note.abilityId is not None:
+                referencedAbilityIds.add(str(note.abilityId))
+
+    with open(PALETTE_SKILL_LOOKUP_FILE, 'r') as f:
+        paletteSkillLookup = json.load(f)
+    for abilityId in paletteSkillLookup.values():
+        referencedAbilityIds.add(str(abilityId))
+    return referencedAbilityIds
+
+#
+# Splits the ability info table in two:
+#   hot:  abilities referenced by the default songs (or palette skills). This is all a
+#         default song session needs, so it is small and cheap to parse at startup
+#   cold: everything else, only needed when a custom song uses other abilities
+#
+def createTieredAbilityInfoTables(abilityInfo):
+    referencedAbilityIds = findReferencedAbilityIds()
+
+    hotAbilityInfo = {}
+    coldAbilityInfo = {}
+    for abilityId, info in abilityInfo.items():
+        if abilityId in referencedAbilityIds:
+            hotAbilityInfo[abilityId] = info
+        else:
+            coldAbilityInfo[abilityId] = info
+
+    hotSize = writeAbilityInfoJson(hotAbilityInfo, ABILITY_INFO_HOT_FILENAME)
+    coldSize = writeAbilityInfoJson(coldAbilityInfo, ABILITY_INFO_COLD_FILENAME)
+    totalSize = hotSize + coldSize
+    totalCount = len(abilityInfo)
+
+    print("Ability Info Tiers:")
+    print(
+        f"  hot : {len(hotAbilityInfo):6d} entries ({100 * len(hotAbilityInfo) / max(1, totalCount):5.1f}%)"
+        f" {hotSize:10d} bytes ({100 * hotSize / max(1, totalSize):5.1f}%)"
     )
-    outputFile.close()
+    print(
+        f"  cold: {len(coldAbilityInfo):6d} entries ({100 * len(coldAbilityInfo) / max(1, totalCount):5.1f}%)"
+        f" {coldSize:10d} bytes ({100 * coldSize / max(1, totalSize):5.1f}%)"
+    )
+    missingCount = len([
+        abilityId for abilityId in referencedAbilityIds if abilityId not in abilityInfo
+    ])
+    print(f"  {missingCount} referenced ability IDs are not in the API table (custom or unknown)")
 
 # MARK: Utility Functions
 
@@ -175,19 +818,66 @@ def getImageFileName(iconUrl):
 
 # MARK: Main
 
-parser = argparse.ArgumentParser(description="generateData")
-parser.add_argument(
-    '--skip-fetch', 
-    action='store_true',
-    help='Skips fetching and generating allSkills.json, assumes it is already made and up to date'
-)
-args = parser.parse_args()
-
-if args.skip_fetch:
-    print("Argument '--skip-fetch' detected. Skipping skill data fetch and allSkills.json generation")
-else:
-    allIds = fetchSkillIds()
-    print("Found " + str(len(allIds)) + " IDs. Starting fetch")
-    fetchSkills(allIds, ALL_SKILLS_FILENAME)
-
-createAbilityInfoTable()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="generateData")
+    parser.add_argument(
+        '--skip-fetch', 
+        action='store_true',
+        help='Skips fetching and generating allSkills.json, assumes it is already made and up to date'
+    )
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help='Number of batch requests allowed to be in flight at once'
+    )
+    parser.add_argument(
+        '--rate',
+        type=float,
+        default=DEFAULT_REQUESTS_PER_SECOND,
+        help='Maximum number of requests per second sent to the API'
+    )
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        help='Only fetches new IDs and expired batches, reusing the skill cache from the previous fetch'
+    )
+    parser.add_argument(
+        '--cache-max-age',
+        type=float,
+        default=DEFAULT_CACHE_MAX_AGE / 3600,
+        help='Hours a cached batch is trusted before it is revalidated (used with --incremental)'
+    )
+    parser.add_argument(
+        '--trace',
+        metavar='FILE',
+        help='Records timings and counters, and writes them to FILE as a Chrome trace'
+    )
+    args = parser.parse_args()
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+    if args.rate <= 0:
+        parser.error("--rate must be more than 0")
+    if args.trace:
+        instrumentation.enable(args.trace)
+
+    if args.skip_fetch:
+        print("Argument '--skip-fetch' detected. Skipping skill data fetch and allSkills.json generation")
+    else:
+        with instrumentation.span("fetchSkillIds"):
+            allIds = fetchSkillIds()
+        print("Found " + str(len(allIds)) + " IDs. Starting fetch")
+        with instrumentation.span("fetchSkills"):
+            isFetchComplete = fetchSkills(
+                allIds,
+                ALL_SKILLS_FILENAME,
+                concurrency=args.concurrency,
+                requestsPerSecond=args.rate,
+                incremental=args.incremental,
+                cacheMaxAge=args.cache_max_age * 3600
+            )
+        if not isFetchComplete:
+            raise SystemExit(1)
+
+    with instrumentation.span("createAbilityInfoTable"):
+        createAbilityInfoTable()
@@ -0,0 +1,569 @@
+import argparse
+import json
+import os
+import re
+import struct
+import urllib.parse
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+import assetManifests
+import instrumentation
+
+#
+# Packs the ability icons the default songs use into texture atlases, one set of atlases
+# per profession, so a song's icons are a few textures instead of one per ability.
+#
+#   1. The icons are found from the "icon" urls in allSkills.json (see generateData.py),
+#      for the abilities with an assetId (the same ones createAbilityInfoTable writes)
+#   2. They are downloaded from the render service into ICON_CACHE_FOLDER, once.
+#      --source replaces the render service with a folder of <assetId>.png files, or
+#      with another server (like a local stub server) that has the same paths
+#   3. The icons of each profession's songs (notes and utility palette skills) are
+#      packed into atlases of up to --max-size pixels, on shelves, tallest icons first
+#   4. The atlases are written to OUTPUT_FOLDER, along with LOOKUP_FILE_NAME, which has the
+#      atlas and UVs of every abilityId for each profession. Atlases of an earlier run
+#      that weren't written again are deleted
+#
+# Every icon is surrounded by --padding pixels that repeat its edges, so filtering at the
+# edge of an icon doesn't pick up its neighbours. The UVs are of the icon itself.
+#
+# Abilities with a custom "icon" in abilityInfoCustom.json are loaded from the module's
+# own files, so they are not packed (see assetManifests.py).
+#
+# The output only depends on the icons and the songs: icons are packed in a fixed order,
+# and the PNGs are written without timestamps, so running again gives the same files.
+#
+#   python iconAtlas.py
+#   python iconAtlas.py --source ./testIcons
+#   python iconAtlas.py --source http://localhost:8000
+#
+
+ALL_SKILLS_FILENAME = "./allSkills.json"
+DEFAULT_SONGS_FOLDER = "../defaultSongs"
+
+# Downloaded icons, as <assetId>.png
+ICON_CACHE_FOLDER = "./iconCache"
+
+OUTPUT_FOLDER = "../DanceDanceRotationModule/ref/iconAtlases"
+# Written to the output folder, next to the atlases
+LOOKUP_FILE_NAME = "iconAtlases.json"
+LOOKUP_VERSION = 1
+
+PROFESSIONS_BY_CODE = {
+    1: "Guardian",
+    2: "Warrior",
+    3: "Engineer",
+    4: "Ranger",
+    5: "Thief",
+    6: "Elementalist",
+    7: "Mesmer",
+    8: "Necromancer",
+    9: "Revenant"
+}
+
+MIN_ATLAS_SIZE = 64
+DEFAULT_MAX_ATLAS_SIZE = 1024
+DEFAULT_PADDING = 2
+
+# Number of icons downloaded at the same time
+DOWNLOAD_CONCURRENCY = 4
+
+# <Profession>_<n>.png, the file names of the atlases
+ATLAS_FILE_PATTERN = re.compile(r"^[A-Za-z]+_[0-9]+\.png$")
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# Only the compression level changes the bytes of a written PNG, so it is fixed
+PNG_COMPRESSION_LEVEL = 9
+
+
+# MARK: PNG
+
+def readPngChunks(data):
+    if not data.startswith(PNG_SIGNATURE):
+        raise ValueError("Not a PNG file")
+    offset = len(PNG_SIGNATURE)
+    while offset + 8 <= len(data):
+        length, chunkType = struct.unpack_from(">I4s", data, offset)
+        yield chunkType, data[offset + 8:offset + 8 + length]
+        offset += 12 + length
+        if chunkType == b"IEND":
+            break
+
+def paethPredictor(left, up, upLeft):
+    estimate = left + up - upLeft
+    distanceLeft = abs(estimate - left)
+    distanceUp = abs(estimate - up)
+    distanceUpLeft = abs(estimate - upLeft)
+    if distanceLeft <= distanceUp and distanceLeft <= distanceUpLeft:
+        return left
+    if distanceUp <= distanceUpLeft:
+        return up
+    return upLeft
+
+#
+# Undoes the filter of every row. Sub and Up are done on whole rows, Average and Paeth
+# depend on the byte before, so they are done a byte at a time
+#
+def unfilterRows(raw, height, stride, bytesPerPixel):
+    rows = np.frombuffer(raw, dtype=np.uint8)[:height * (stride + 1)].reshape(height, stride + 1)
+    output = np.zeros((height, stride), dtype=np.uint8)
+    previous = np.zeros(stride, dtype=np.uint8)
+    for y in range(height):
+        filterType = rows[y, 0]
+        line = rows[y, 1:]
+        if filterType == 0:
+            current = line.copy()
+        elif filterType == 1:
+            current = line.reshape(-1, bytesPerPixel).cumsum(axis=0, dtype=np.uint8).reshape(-1)
+        elif filterType == 2:
+            current = line + previous
+        elif filterType in (3, 4):
+            current = [0] * stride
+            up = previous.tolist()
+            for x, value in enumerate(line.tolist()):
+                left = current[x - bytesPerPixel] if x >= bytesPerPixel else 0
+                if filterType == 3:
+                    predicted = (left + up[x]) // 2
+                else:
+                    upLeft = up[x - bytesPerPixel] if x >= bytesPerPixel else 0
+                    predicted = paethPredictor(left, up[x], upLeft)
+                current[x] = (value + predicted) & 0xFF
+            current = np.array(current, dtype=np.uint8)
+        else:
+            raise ValueError(f"Unknown PNG filter type {filterType}")
+        output[y] = current
+        previous = output[y]
+    return output
+
+#
+# Decodes a PNG into a (height, width, 4) RGBA array. Only 8 bit, non interlaced PNGs
+# are supported, which is what the render service returns
+#
+def readPng(data):
+    header = None
+    palette = None
+    transparency = None
+    compressed = bytearray()
+    for chunkType, chunk in readPngChunks(data):
+        if chunkType == b"IHDR":
+            header = struct.unpack(">IIBBBBB", chunk)
+        elif chunkType == b"PLTE":
+            palette = np.frombuffer(chunk, dtype=np.uint8).reshape(-1, 3)
+        elif chunkType == b"tRNS":
+            transparency = np.frombuffer(chunk, dtype=np.uint8)
+        elif chunkType == b"IDAT":
+            compressed += chunk
+    if header is None:
+        raise ValueError("PNG has no IHDR chunk")
+    width, height, bitDepth, colorType, _, _, interlace = header
+    if bitDepth != 8 or interlace != 0:
+        raise ValueError(f"Unsupported PNG (bit depth {bitDepth}, interlace {interlace})")
+    channelsByColorType = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+    if colorType not in channelsByColorType:
+        raise ValueError(f"Unsupported PNG color type {colorType}")
+    channels = channelsByColorType[colorType]
+
+    rows = unfilterRows(zlib.decompress(bytes(compressed)), height, width * channels, channels)
+    pixels = rows.reshape(height, width, channels)
+    rgba = np.full((height, width, 4), 255, dtype=np.uint8)
+    if colorType == 6:
+        rgba[:] = pixels
+    elif colorType == 2:
+        rgba[:, :, :3] = pixels
+    elif colorType == 0:
+        rgba[:, :, :3] = pixels
+    elif colorType == 4:
+        rgba[:, :, :3] = pixels[:, :, :1]
+        rgba[:, :, 3] = pixels[:, :, 1]
+    else:
+        if palette is None:
+            raise ValueError("Palette PNG has no PLTE chunk")
+        indexes = pixels[:, :, 0]
+        rgba[:, :, :3] = palette[indexes]
+        if transparency is not None:
+            alpha = np.full(256, 255, dtype=np.uint8)
+            alpha[:len(transparency)] = transparency
+            rgba[:, :, 3] = alpha[indexes]
+    return rgba
+
+def writePngChunk(output, chunkType, chunk):
+    output += struct.pack(">I", len(chunk))
+    output += chunkType
+    output += chunk
+    output += struct.pack(">I", zlib.crc32(chunkType + chunk) & 0xFFFFFFFF)
+
+#
+# Encodes a (height, width, 4) RGBA array as a PNG. Every row uses the Up filter
+#
+def writePng(pixels):
+    height, width, _ = pixels.shape
+    rows = pixels.reshape(height, width * 4)
+    filtered = np.empty((height, width * 4 + 1), dtype=np.uint8)
+    filtered[:, 0] = 2
+    filtered[0, 1:] = rows[0]
+    filtered[1:, 1:] = rows[1:] - rows[:-1]
+
+    output = bytearray(PNG_SIGNATURE)
+    writePngChunk(output, b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))
+    writePngChunk(output, b"IDAT", zlib.compress(filtered.tobytes(), PNG_COMPRESSION_LEVEL))
+    writePngChunk(output, b"IEND", b"")
+    return bytes(output)
+
+
+# MARK: Icon Cache
+
+#
+# assetId -> icon url, from allSkills.json
+#
+def loadIconUrls():
+    iconUrls = {}
+    with open(ALL_SKILLS_FILENAME, 'r') as f:
+        for info in json.load(f).values():
+            if "icon" in info:
+                iconUrls[getImageFileName(info["icon"])] = info["icon"]
+    return iconUrls
+
+#
+# Same as generateData.getImageFileName, without needing its imports
+#
+def getImageFileName(iconUrl):
+    startIndex = iconUrl.rindex("/") + 1
+    return int(iconUrl[startIndex:].split(".")[0])
+
+#
+# True if the source is a folder of icons instead of a server
+#
+def isFolderSource(source):
+    return source is not None and not source.startswith(("http://", "https://"))
+
+def cachedIconFileName(cacheFolder, assetId):
+    return os.path.join(cacheFolder, f"{assetId}.png")
+
+#
+# The bytes of an icon from the source: the render service when source is None, a
+# folder of <assetId>.png files, or a server with the same paths as the render service.
+# Returns None if the icon couldn't be found
+#
+def fetchIcon(session, source, assetId, iconUrl):
+    if isFolderSource(source):
+        fileName = os.path.join(source, f"{assetId}.png")
+        if not os.path.exists(fileName):
+            return None
+        with open(fileName, 'rb') as f:
+            return f.read()
+
+    url = iconUrl
+    if source is not None:
+        url = urllib.parse.urljoin(source.rstrip("/") + "/", urllib.parse.urlparse(iconUrl).path.lstrip("/"))
+    try:
+        with instrumentation.span("fetchIcon", assetId=assetId):
+            response = session.get(url)
+    except requests.RequestException as e:
+        print(f"Error fetching icon {assetId}: {e}")
+        return None
+    if response.status_code != 200:
+        print(f"Error fetching icon {assetId}: {response.status_code}")
+        return None
+    instrumentation.count("bytesFetched", len(response.content))
+    return response.content
+
+#
+# Makes sure every icon is in the cache, downloading the missing ones.
+# Returns (fetched count, missing assetIds)
+#
+def fillIconCache(assetIds, iconUrls, cacheFolder, source):
+    os.makedirs(cacheFolder, exist_ok=True)
+    toFetch = [
+        assetId for assetId in sorted(assetIds)
+        if not os.path.exists(cachedIconFileName(cacheFolder, assetId))
+    ]
+    # A folder has the icons by assetId, everything else needs the icon url
+    isFolder = isFolderSource(source)
+    missing = [assetId for assetId in toFetch if assetId not in iconUrls and not isFolder]
+    toFetch = [assetId for assetId in toFetch if assetId not in missing]
+    if len(toFetch) == 0:
+        return 0, missing
+
+    print(f"Fetching {len(toFetch)} icons")
+    fetchedCount = 0
+    with requests.Session() as session, ThreadPoolExecutor(max_workers=DOWNLOAD_CONCURRENCY) as executor:
+        futures = [
+            executor.submit(fetchIcon, session, source, assetId, iconUrls.get(assetId))
+            for assetId in toFetch
+        ]
+        for assetId, future in zip(toFetch, futures):
+            data = future.result()
+            if data is None or not data.startswith(PNG_SIGNATURE):
+                missing.append(assetId)
+                continue
+            writeFileAtomically(cachedIconFileName(cacheFolder, assetId), data)
+            fetchedCount += 1
+            instrumentation.count("iconsFetched")
+    return fetchedCount, sorted(missing)
+
+#
+# Written to a tmp file first, so a stopped run never leaves half a file
+#
+def writeFileAtomically(fileName, data):
+    tempFileName = fileName + ".tmp"
+    with open(tempFileName, 'wb') as f:
+        f.write(data)
+    os.replace(tempFileName, fileName)
+
+def loadCachedIcon(cacheFolder, assetId):
+    with open(cachedIconFileName(cacheFolder, assetId), 'rb') as f:
+        return readPng(f.read())
+
+
+# MARK: Packing
+
+#
+# The atlas sizes to try, smallest first: powers of two, square or twice as wide as tall
+#
+def atlasSizes(maxSize):
+    sizes = []
+    width = MIN_ATLAS_SIZE
+    while width <= maxSize:
+        sizes.append((width, width // 2))
+        sizes.append((width, width))
+        width *= 2
+    return [size for size in sizes if size[1] >= MIN_ATLAS_SIZE // 2]
+
+#
+# Places the icons on shelves, in order. An icon goes at the end of the current shelf,
+# or starts a new shelf below it. Returns assetId -> (x, y) of the icons that fit
+#
+def packShelves(icons, width, height, padding):
+    placements = {}
+    shelfX = 0
+    shelfY = 0
+    shelfHeight = 0
+    for assetId, (iconWidth, iconHeight) in icons:
+        paddedWidth = iconWidth + 2 * padding
+        paddedHeight = iconHeight + 2 * padding
+        if paddedWidth > width:
+            continue
+        if shelfX + paddedWidth > width:
+            shelfY += shelfHeight
+            shelfX = 0
+            shelfHeight = 0
+        if shelfY + paddedHeight > height:
+            continue
+        placements[assetId] = (shelfX + padding, shelfY + padding)
+        shelfX += paddedWidth
+        shelfHeight = max(shelfHeight, paddedHeight)
+    return placements
+
+#
+# Packs icons ({ assetId: (width, height) }) into as few atlases as possible, each as
+# small as possible. Returns a list of { width, height, placements }
+#
+def packAtlases(iconSizes, maxSize, padding):
+    # Tallest first makes shelves with little wasted space. The assetId keeps the order fixed
+    remaining = sorted(iconSizes.items(), key=lambda item: (-item[1][1], -item[1][0], item[0]))
+    atlases = []
+    while len(remaining) > 0:
+        packed = None
+        for width, height in atlasSizes(maxSize):
+            placements = packShelves(remaining, width, height, padding)
+            if len(placements) == len(remaining):
+                packed = (width, height, placements)
+                break
+        if packed is None:
+            placements = packShelves(remaining, maxSize, maxSize, padding)
+            if len(placements) == 0:
+                raise ValueError(f"Icon {remaining[0][0]} does not fit in a {maxSize}x{maxSize} atlas")
+            packed = (maxSize, maxSize, placements)
+        width, height, placements = packed
+        atlases.append({"width": width, "height": height, "placements": placements})
+        remaining = [icon for icon in remaining if icon[0] not in placements]
+    return atlases
+
+#
+# Draws the icons of a packed atlas, each surrounded by padding pixels that repeat its edges
+#
+def drawAtlas(atlas, icons, padding):
+    pixels = np.zeros((atlas["height"], atlas["width"], 4), dtype=np.uint8)
+    for assetId, (x, y) in atlas["placements"].items():
+        icon = icons[assetId]
+        paddedIcon = np.pad(icon, ((padding, padding), (padding, padding), (0, 0)), mode="edge")
+        pixels[y - padding:y + icon.shape[0] + padding, x - padding:x + icon.shape[1] + padding] = paddedIcon
+    return pixels
+
+#
+# How much of the atlas is covered by icons, not counting the padding
+#
+def fillRatio(atlas, iconSizes):
+    iconArea = sum(iconSizes[assetId][0] * iconSizes[assetId][1] for assetId in atlas["placements"])
+    return iconArea / (atlas["width"] * atlas["height"])
+
+
+# MARK: Atlases
+
+#
+# profession name -> { abilityId: assetId } of every icon its songs show
+#
+def findProfessionIcons(folder):
+    assetIds, paletteSkillLookup = assetManifests.loadLookupTables()
+    professionIcons = {}
+    for fileName in sorted(os.listdir(folder)):
+        if not fileName.endswith(".json"):
+            continue
+        with open(os.path.join(folder, fileName), 'r') as f:
+            song = json.load(f)
+        buildTemplate = song.get("decodedBuildTemplate", {})
+        profession = PROFESSIONS_BY_CODE.get(buildTemplate.get("profession"), "Unknown")
+        icons = professionIcons.setdefault(profession, {})
+
+        abilityIds = [str(note.get("abilityId")) for note in song.get("notes", [])]
+        for paletteId in buildTemplate.get("skills", {}).get("terrestrial", {}).get("utilities", []):
+            if str(paletteId) in paletteSkillLookup:
+                abilityIds.append(paletteSkillLookup[str(paletteId)])
+        for abilityId in abilityIds:
+            if abilityId in assetIds:
+                icons[abilityId] = assetIds[abilityId]
+    return professionIcons
+
+#
+# Deletes the atlases in the folder that aren't in fileNames, like the last atlases of a
+# profession that now fits in fewer
+#
+def removeStaleAtlases(outputFolder, fileNames):
+    for fileName in sorted(os.listdir(outputFolder)):
+        if ATLAS_FILE_PATTERN.match(fileName) and fileName not in fileNames:
+            print(f"Removing stale atlas {fileName}")
+            os.remove(os.path.join(outputFolder, fileName))
+
+#
+# Packs and writes the atlases of every profession, and the lookup file.
+# Returns the report rows: (file, profession, width, height, icon count, fill ratio)
+#
+def buildAtlases(professionIcons, cacheFolder, outputFolder, maxSize, padding, missing):
+    os.makedirs(outputFolder, exist_ok=True)
+    icons = {}
+    atlasInfos = []
+    lookup = {}
+    for profession in sorted(professionIcons):
+        abilityAssetIds = {
+            abilityId: assetId for abilityId, assetId in professionIcons[profession].items()
+            if assetId not in missing
+        }
+        for assetId in abilityAssetIds.values():
+            if assetId not in icons:
+                icons[assetId] = loadCachedIcon(cacheFolder, assetId)
+        iconSizes = {
+            assetId: (icons[assetId].shape[1], icons[assetId].shape[0]) for assetId in set(abilityAssetIds.values())
+        }
+
+        with instrumentation.span("packAtlases", profession=profession):
+            atlases = packAtlases(iconSizes, maxSize, padding)
+        professionLookup = {}
+        for atlasNumber, atlas in enumerate(atlases):
+            fileName = f"{profession}_{atlasNumber}.png"
+            with instrumentation.span("writeAtlas", fileName=fileName):
+                data = writePng(drawAtlas(atlas, icons, padding))
+                writeFileAtomically(os.path.join(outputFolder, fileName), data)
+            instrumentation.count("bytesWritten", len(data))
+
+            atlasIndex = len(atlasInfos)
+            atlasInfos.append({
+                "file": fileName,
+                "profession": profession,
+                "width": atlas["width"],
+                "height": atlas["height"],
+                "iconCount": len(atlas["placements"]),
+                "fillRatio": round(fillRatio(atlas, iconSizes), 4)
+            })
+            for abilityId, assetId in abilityAssetIds.items():
+                if assetId in atlas["placements"]:
+                    x, y = atlas["placements"][assetId]
+                    iconWidth, iconHeight = iconSizes[assetId]
+                    professionLookup[abilityId] = {
+                        "atlas": atlasIndex,
+                        "assetId": assetId,
+                        "uv": [
+                            round(x / atlas["width"], 6),
+                            round(y / atlas["height"], 6),
+                            round((x + iconWidth) / atlas["width"], 6),
+                            round((y + iconHeight) / atlas["height"], 6)
+                        ]
+                    }
+        lookup[profession] = {
+            abilityId: professionLookup[abilityId] for abilityId in sorted(professionLookup, key=int)
+        }
+
+    lookupData = json.dumps({
+        "version": LOOKUP_VERSION,
+        "padding": padding,
+        "atlases": atlasInfos,
+        "professions": lookup
+    }, indent=4)
+    writeFileAtomically(os.path.join(outputFolder, LOOKUP_FILE_NAME), lookupData.encode("utf-8"))
+    removeStaleAtlases(outputFolder, {info["file"] for info in atlasInfos})
+    return atlasInfos
+
+def printReport(atlasInfos, fetchedCount, missing):
+    print("")
+    print(f"{'Atlas':28s} {'Size':>11s} {'Icons':>6s} {'Fill':>7s}")
+    for info in atlasInfos:
+        print(
+            f"{info['file']:28s} {str(info['width']) + 'x' + str(info['height']):>11s} "
+            f"{info['iconCount']:6d} {100 * info['fillRatio']:6.1f}%"
+        )
+    totalArea = sum(info["width"] * info["height"] for info in atlasInfos)
+    iconArea = sum(info["width"] * info["height"] * info["fillRatio"] for info in atlasInfos)
+    print(
+        f"{len(atlasInfos)} atlases, {sum(info['iconCount'] for info in atlasInfos)} icons, "
+        f"{100 * iconArea / max(1, totalArea):.1f}% filled overall"
+    )
+    print(f"{fetchedCount} icons fetched")
+    if len(missing) > 0:
+        print(f"{len(missing)} icons could not be found, and are left out: {missing}")
+
+
+# MARK: Main
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="iconAtlas")
+    parser.add_argument(
+        '--source',
+        help='Folder of <assetId>.png files, or the url of a server to use instead of the render service'
+    )
+    parser.add_argument('--cache', default=ICON_CACHE_FOLDER, help='Folder the downloaded icons are kept in')
+    parser.add_argument('--output', default=OUTPUT_FOLDER, help='Folder the atlases are written to')
+    parser.add_argument('--folder', default=DEFAULT_SONGS_FOLDER, help='Folder of the songs to pack the icons of')
+    parser.add_argument(
+        '--max-size',
+        type=int,
+        default=DEFAULT_MAX_ATLAS_SIZE,
+        help='Largest width and height of an atlas, in pixels'
+    )
+    parser.add_argument(
+        '--padding',
+        type=int,
+        default=DEFAULT_PADDING,
+        help='Pixels around every icon that repeat its edges'
+    )
+    parser.add_argument(
+        '--trace',
+        metavar='FILE',
+        help='Records timings and counters, and writes them to FILE as a Chrome trace'
+    )
+    args = parser.parse_args()
+    if args.trace:
+        instrumentation.enable(args.trace)
+
+    with instrumentation.span("findProfessionIcons"):
+        professionIcons = findProfessionIcons(args.folder)
+    allAssetIds = {assetId for icons in professionIcons.values() for assetId in icons.values()}
+    with instrumentation.span("fillIconCache"):
+        # A folder has the icons by assetId, so allSkills.json isn't needed
+        iconUrls = {} if isFolderSource(args.source) else loadIconUrls()
+        fetchedCount, missing = fillIconCache(allAssetIds, iconUrls, args.cache, args.source)
+    with instrumentation.span("buildAtlases"):
+        atlasInfos = buildAtlases(professionIcons, args.cache, args.output, args.max_size, args.padding, set(missing))
+    printReport(atlasInfos, fetchedCount, missing)
@@ -0,0 +1,266 @@
+import atexit
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows. Peak memory is reported as unknown there
+    resource = None
+
+#
+# Timed spans and counters for the data scripts (generateData.py, verifyData.py and
+# createDefaultSongsArray.py), enabled with their --trace flag.
+#
+#   with instrumentation.span("writeOutputs"):
+#       ...
+#   instrumentation.count("bytesFetched", len(response.content))
+#
+# When tracing is enabled, a Chrome trace is written when the script exits (open it in
+# chrome://tracing or https://ui.perfetto.dev), and a one line summary is printed with
+# the slowest top level spans, the counters, and the peak memory.
+#
+# When tracing is not enabled, span() returns a shared no-op context manager and count()
+# returns right away, so the calls can stay in hot loops.
+#
+# Worker processes of a multiprocessing.Pool record into their own memory. Start them with
+# initWorker(workerState()), and send their takeEvents() back with each result for the
+# parent to addEvents(), or their spans and counters are lost.
+#
+
+enabled = False
+traceFileName = None
+startTime = 0.0
+isFinished = False
+# Set in worker processes, which don't write a trace of their own
+isWorker = False
+
+events = []
+counters = {}
+lock = threading.Lock()
+# The depth of the open spans on each thread, to find the top level spans
+threadState = threading.local()
+
+NULL_SPAN = contextlib.nullcontext()
+
+
+def timestamp():
+    # Chrome traces are in microseconds
+    return (time.perf_counter() - startTime) * 1000000
+
+#
+# Starts recording. The trace is written to traceFileName when the script exits
+#
+def enable(fileName):
+    global enabled
+    global traceFileName
+    global startTime
+    enabled = True
+    traceFileName = fileName
+    startTime = time.perf_counter()
+    atexit.register(finish)
+
+#
+# What a worker process needs to record into the same trace, for initWorker()
+#
+def workerState():
+    return enabled, startTime
+
+#
+# Starts recording in a worker process, as the parent process that called workerState()
+#
+def initWorker(state):
+    global enabled
+    global startTime
+    global isWorker
+    global events
+    global counters
+    enabled, startTime = state
+    isWorker = True
+    # A forked worker starts with the events, counters and open spans of the parent, which
+    # the parent already has
+    events = []
+    counters = {}
+    threadState.depth = 0
+
+
+# MARK: Recording
+
+class Span:
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+        self.start = 0.0
+        self.depth = 0
+
+    def __enter__(self):
+        self.depth = getattr(threadState, "depth", 0)
+        threadState.depth = self.depth + 1
+        self.start = timestamp()
+        return self
+
+    def __exit__(self, *exc):
+        end = timestamp()
+        threadState.depth = self.depth
+        event = {
+            "name": self.name,
+            "ph": "X",
+            "ts": self.start,
+            "dur": end - self.start,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": self.args
+        }
+        if self.depth == 0:
+            isMainThread = threading.current_thread() is threading.main_thread()
+            event["args"] = dict(
+                self.args,
+                topLevel="main" if isMainThread and not isWorker else "worker"
+            )
+        with lock:
+            events.append(event)
+        return False
+
+#
+# Times the code in a with block
+#
+def span(name, **args):
+    if not enabled:
+        return NULL_SPAN
+    return Span(name, args)
+
+#
+# Adds to a counter. Every change is also recorded in the trace, so the counters can
+# be seen over time
+#
+def count(name, amount=1):
+    if not enabled:
+        return
+    with lock:
+        value = counters.get(name, 0) + amount
+        counters[name] = value
+        events.append({
+            "name": name,
+            "ph": "C",
+            "ts": timestamp(),
+            "pid": os.getpid(),
+            "args": {name: value}
+        })
+
+
+#
+# Returns the events recorded so far and how much each counter changed, and forgets them.
+# Called in worker processes, to send them to the parent process:
+#   { events, counters }
+#
+def takeEvents():
+    global events
+    global counters
+    with lock:
+        recording = {"events": events, "counters": counters}
+        events = []
+        counters = {}
+    return recording
+
+#
+# Adds the events and counters that were recorded in a worker process. The counter events
+# of the worker are moved on by the counters of this process, so they show the total
+#
+def addEvents(recording):
+    if not enabled:
+        return
+    with lock:
+        for event in recording["events"]:
+            if event["ph"] == "C":
+                name = event["name"]
+                event["args"] = {name: counters.get(name, 0) + event["args"][name]}
+            events.append(event)
+        for name, amount in recording["counters"].items():
+            counters[name] = counters.get(name, 0) + amount
+
+
+# MARK: Output
+
+#
+# The largest resident memory of this process and its finished worker processes, in
+# bytes. None if it can't be measured on this platform
+#
+def peakMemory():
+    if resource is None:
+        return None
+    # ru_maxrss is in bytes on macOS and kilobytes everywhere else
+    scale = 1 if sys.platform == "darwin" else 1024
+    ownPeak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    childrenPeak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+    return max(ownPeak, childrenPeak)
+
+def formatValue(name, value):
+    if "bytes" in name.lower():
+        return f"{value / (1024 * 1024):.1f}MB"
+    if isinstance(value, float):
+        return f"{value:.2f}"
+    return str(value)
+
+#
+# The total seconds of the slowest top level spans on the main thread, or on worker threads
+# and processes
+#
+def slowestSpans(thread):
+    totals = {}
+    for event in events:
+        if event["ph"] == "X" and event["args"].get("topLevel") == thread:
+            totals[event["name"]] = totals.get(event["name"], 0) + event["dur"] / 1000000
+    slowest = sorted(totals.items(), key=lambda item: -item[1])[:5]
+    return ", ".join(f"{name} {seconds:.2f}s" for name, seconds in slowest)
+
+def createSummary(elapsed, memory):
+    parts = [f"{elapsed:.2f}s total"]
+    mainSpans = slowestSpans("main")
+    if mainSpans != "":
+        parts.append(mainSpans)
+    # Workers run at the same time, so their spans can add up to more than the total
+    workerSpans = slowestSpans("worker")
+    if workerSpans != "":
+        parts.append("workers: " + workerSpans)
+    if len(counters) > 0:
+        parts.append(" ".join(
+            f"{name}={formatValue(name, value)}" for name, value in sorted(counters.items())
+        ))
+    parts.append("peak memory " + ("unknown" if memory is None else f"{memory / (1024 * 1024):.0f}MB"))
+    return "Trace: " + " | ".join(parts)
+
+#
+# Writes the trace and prints the summary. Called when the script exits
+#
+def finish():
+    global isFinished
+    if not enabled or isFinished:
+        return
+    isFinished = True
+
+    elapsed = time.perf_counter() - startTime
+    memory = peakMemory()
+    with lock:
+        traceEvents = [
+            {
+                "name": "process_name",
+                "ph": "M",
+                "pid": os.getpid(),
+                "args": {"name": os.path.basename(sys.argv[0])}
+            }
+        ] + events
+    with open(traceFileName, "w") as f:
+        json.dump({
+            "traceEvents": traceEvents,
+            "displayTimeUnit": "ms",
+            "otherData": {
+                "counters": counters,
+                "peakMemoryBytes": memory,
+                "elapsedSeconds": elapsed
+            }
+        }, f)
+    print(createSummary(elapsed, memory) + f" | written to {traceFileName}")
@@ -0,0 +1,365 @@
+import argparse
+import json
+import math
+import os
+
+import noteColumns
+import songBundle
+
+#
+# Precomputes the lane of every note for the Compact Mode settings, so the module
+# doesn't have to work out the overlaps every time a song is loaded.
+#
+# This is a reference implementation of the lane code in NotesContainer.cs (AddNote and
+# GetCompactModeLane), for the non Ability Bar orientations:
+#   Regular:      the lane of the noteType (NoteTypeExtensions.NoteLane), 6 lanes
+#   Compact:      notes go to the first lane, but are shifted down a lane when they start
+#                 within the collision window of the previous note, 3 lanes. With Auto Hit
+#                 Weapon 1, Weapon1 notes always stay on the first lane and other notes
+#                 don't check them
+#   UltraCompact: every note is on the first lane
+#
+# The collision window is how long a note takes to move its own width, which is its
+# size in pixels / Note Pace. The note size depends on the size of the notes window, so
+# the Compact lanes aren't stored for any one window. Instead, each note stores its
+# collision gap: the milliseconds since the previous note that it checks. A note is
+# shifted down a lane when the collision window is more than its gap, so a reader gets
+# the lanes of any note size and Note Pace with one pass over the gaps (see
+# compactLanesFromGaps).
+#
+# Regular lanes are stored before the user's utility remapping, which only swaps the
+# Utility1-3 lanes.
+#
+# Encoded layouts of a song (see songBundle.py, section "lanes"):
+#   varint note count
+#   regular:  4 bits per note, low bits first
+#   the collision gaps without Auto Hit Weapon 1, then with it: a varint per note, 0
+#   for notes that don't check a previous note, otherwise the gap + 1
+# UltraCompact is not stored, since every lane is 0.
+#
+# Run on its own to print overlap statistics of every song:
+#   python laneLayouts.py --pace 300
+#
+
+DEFAULT_SONGS_FOLDER = "../defaultSongs"
+
+# Name of the section in the song bundle
+BUNDLE_SECTION = "lanes"
+
+# SongData.MinimumNotePositionChangePerSecond, DefaultNotePositionChangePerSecond and
+# MaximumNotePositionChangePerSecond
+MIN_NOTE_PACE = 75
+DEFAULT_NOTE_PACE = 300
+MAX_NOTE_PACE = 600
+# Note Pace is shown as a percentage of the default. The report and --check-bundle use
+# steps of 25%
+NOTE_PACES = list(range(MIN_NOTE_PACE, MAX_NOTE_PACE + 1, 75))
+
+# About the note size in pixels of the notes window at its initial size, in Compact Mode
+REFERENCE_NOTE_SIZE = 100
+# Note sizes that --check-bundle computes the lanes for, from a small window to a large one
+CHECK_NOTE_SIZES = [40, 64, REFERENCE_NOTE_SIZE, 150, 240]
+
+COMPACT_LANE_COUNT = 3
+
+# NoteTypeExtensions.NoteLane. Anything else is on lane 0
+REGULAR_LANES = {
+    "Weapon1": 0,
+    "Heal": 0,
+    "Profession1": 0,
+    "Weapon2": 1,
+    "Utility1": 1,
+    "Profession2": 1,
+    "Weapon3": 2,
+    "Utility2": 2,
+    "Profession3": 2,
+    "Weapon4": 3,
+    "Utility3": 3,
+    "Profession4": 3,
+    "Weapon5": 4,
+    "Elite": 4,
+    "Profession5": 4,
+    "Dodge": 5,
+    "WeaponSwap": 5,
+    "WeaponStow": 5,
+    "Unknown": 5
+}
+
+
+# MARK: Layouts
+
+#
+# The collision window in milliseconds, the way NotesContainer computes NoteCollisionCheck.
+# TimeSpan.FromMilliseconds rounds to a whole millisecond
+#
+def collisionWindow(pace, noteSize=REFERENCE_NOTE_SIZE):
+    return int(noteSize * 1000 / max(pace, MIN_NOTE_PACE) + 0.5)
+
+def regularLanes(notes):
+    return [REGULAR_LANES.get(note.get("noteType"), 0) for note in notes]
+
+#
+# The Compact Mode lane of every note. The module finds the lane of the previous note
+# recursively, but the notes are in order here, so it has always been found already.
+# This is the reference the lanes from the collision gaps are checked against
+#
+def compactLanes(notes, window, autoHitWeapon1):
+    lanes = []
+    previousIndex = -1
+    for index, note in enumerate(notes):
+        isSkipped = autoHitWeapon1 and note.get("noteType") == "Weapon1"
+        lane = 0
+        if not isSkipped and previousIndex >= 0:
+            if notes[previousIndex]["time"] + window > note["time"]:
+                lane = (lanes[previousIndex] + 1) % COMPACT_LANE_COUNT
+        lanes.append(lane)
+        # Later notes only check the last note that wasn't skipped
+        if not isSkipped:
+            previousIndex = index
+    return lanes
+
+def ultraCompactLanes(notes):
+    return [0] * len(notes)
+
+#
+# The milliseconds between each note and the previous note it checks in Compact Mode, or
+# None for notes that don't check one. Rounded down, which gives the same lanes since the
+# collision window is a whole millisecond
+#
+def collisionGaps(notes, autoHitWeapon1):
+    gaps = []
+    previousTime = None
+    for note in notes:
+        if autoHitWeapon1 and note.get("noteType") == "Weapon1":
+            gaps.append(None)
+            continue
+        gaps.append(None if previousTime is None else max(0, math.floor(note["time"] - previousTime)))
+        previousTime = note["time"]
+    return gaps
+
+#
+# The Compact Mode lane of every note, from its collision gap
+#
+def compactLanesFromGaps(gaps, window):
+    lanes = []
+    previousLane = 0
+    for gap in gaps:
+        if gap is None:
+            # The first note, or a Weapon1 note that is skipped. Skipped notes don't change
+            # the previous lane
+            lanes.append(0)
+            continue
+        lane = (previousLane + 1) % COMPACT_LANE_COUNT if window > gap else 0
+        lanes.append(lane)
+        previousLane = lane
+    return lanes
+
+#
+# Every layout of a song:
+#   { regular, ultraCompact, collisionGaps: { autoHitWeapon1 -> gaps } }
+#
+def computeLaneLayouts(song):
+    notes = song.get("notes", [])
+    return {
+        "regular": regularLanes(notes),
+        "ultraCompact": ultraCompactLanes(notes),
+        "collisionGaps": {
+            autoHitWeapon1: collisionGaps(notes, autoHitWeapon1) for autoHitWeapon1 in [False, True]
+        }
+    }
+
+#
+# The lanes for a Compact Mode setting ("Regular", "Compact" or "UltraCompact")
+#
+def lanesFor(layouts, compactStyle, pace, autoHitWeapon1, noteSize=REFERENCE_NOTE_SIZE):
+    if compactStyle == "Regular":
+        return layouts["regular"]
+    elif compactStyle == "UltraCompact":
+        return layouts["ultraCompact"]
+    elif compactStyle == "Compact":
+        return compactLanesFromGaps(layouts["collisionGaps"][autoHitWeapon1], collisionWindow(pace, noteSize))
+    else:
+        raise ValueError(f"Unknown compact style: {compactStyle}")
+
+
+# MARK: Encoding
+
+def packLanes(output, lanes, bitsPerLane):
+    lanesPerByte = 8 // bitsPerLane
+    for start in range(0, len(lanes), lanesPerByte):
+        byte = 0
+        for shift, lane in enumerate(lanes[start:start + lanesPerByte]):
+            byte |= lane << (shift * bitsPerLane)
+        output.append(byte)
+
+#
+# Reads count lanes at offset, returns (lanes, next offset)
+#
+def unpackLanes(data, offset, count, bitsPerLane):
+    lanesPerByte = 8 // bitsPerLane
+    mask = (1 << bitsPerLane) - 1
+    byteCount = (count + lanesPerByte - 1) // lanesPerByte
+    lanes = []
+    for byte in data[offset:offset + byteCount]:
+        for shift in range(lanesPerByte):
+            lanes.append((byte >> (shift * bitsPerLane)) & mask)
+    return lanes[:count], offset + byteCount
+
+def encodeLaneLayouts(layouts):
+    output = bytearray()
+    noteColumns.writeVarint(output, len(layouts["regular"]))
+    packLanes(output, layouts["regular"], 4)
+    for autoHitWeapon1 in [False, True]:
+        for gap in layouts["collisionGaps"][autoHitWeapon1]:
+            noteColumns.writeVarint(output, 0 if gap is None else gap + 1)
+    return bytes(output)
+
+#
+# The data of a song in the bundle's section
+#
+def encodeBundleSection(song):
+    return encodeLaneLayouts(computeLaneLayouts(song))
+
+def decodeLaneLayouts(data):
+    noteCount, offset = noteColumns.readVarint(data, 0)
+    regular, offset = unpackLanes(data, offset, noteCount, 4)
+    layouts = {
+        "regular": regular,
+        "ultraCompact": [0] * noteCount,
+        "collisionGaps": {}
+    }
+    for autoHitWeapon1 in [False, True]:
+        gaps = []
+        for _ in range(noteCount):
+            value, offset = noteColumns.readVarint(data, offset)
+            gaps.append(None if value == 0 else value - 1)
+        layouts["collisionGaps"][autoHitWeapon1] = gaps
+    return layouts
+
+
+# MARK: Statistics
+
+#
+# The number of notes that start within the collision window of the previous note in
+# the same lane, which are the notes that are drawn over another note
+#
+def countOverlaps(notes, lanes, window):
+    overlaps = 0
+    lastTimes = {}
+    for note, lane in zip(notes, lanes):
+        if lane in lastTimes and lastTimes[lane] + window > note["time"]:
+            overlaps += 1
+        lastTimes[lane] = note["time"]
+    return overlaps
+
+#
+# Overlap statistics of a song at a pace:
+#   regularOverlaps, compactOverlaps, ultraCompactOverlaps: see countOverlaps
+#   shiftedNotes: notes that Compact Mode moved off the first lane
+#   maxLane:      the last Compact lane that is used
+#
+def overlapStatistics(song, layouts, pace, autoHitWeapon1, noteSize):
+    notes = song.get("notes", [])
+    window = collisionWindow(pace, noteSize)
+    compact = lanesFor(layouts, "Compact", pace, autoHitWeapon1, noteSize)
+    return {
+        "window": window,
+        "regularOverlaps": countOverlaps(notes, layouts["regular"], window),
+        "compactOverlaps": countOverlaps(notes, compact, window),
+        "ultraCompactOverlaps": countOverlaps(notes, layouts["ultraCompact"], window),
+        "shiftedNotes": sum(1 for lane in compact if lane != 0),
+        "maxLane": max(compact, default=0)
+    }
+
+def loadSongs(folder):
+    songs = []
+    for fileName in sorted(os.listdir(folder)):
+        if fileName.endswith(".json"):
+            with open(os.path.join(folder, fileName), 'r') as f:
+                songs.append((fileName, json.load(f)))
+    return songs
+
+def printReport(songs, pace, autoHitWeapon1, noteSize):
+    paces = sorted(set(NOTE_PACES + [pace]))
+    totals = {otherPace: {} for otherPace in paces}
+    rows = []
+    for fileName, song in songs:
+        layouts = computeLaneLayouts(song)
+        for otherPace in paces:
+            statistics = overlapStatistics(song, layouts, otherPace, autoHitWeapon1, noteSize)
+            for key, value in statistics.items():
+                if key not in ["window", "maxLane"]:
+                    totals[otherPace][key] = totals[otherPace].get(key, 0) + value
+            totals[otherPace]["window"] = statistics["window"]
+            if statistics["compactOverlaps"] > 0:
+                totals[otherPace]["songsWithCompactOverlaps"] = totals[otherPace].get("songsWithCompactOverlaps", 0) + 1
+            if otherPace == pace:
+                rows.append((fileName, len(song.get("notes", [])), statistics))
+
+    print(
+        f"Pace {pace} ({100 * pace // DEFAULT_NOTE_PACE}%), note size {noteSize}px, "
+        f"collision window {collisionWindow(pace, noteSize)} ms, "
+        f"Auto Hit Weapon 1 {'on' if autoHitWeapon1 else 'off'}"
+    )
+    print(f"{'song':60s} {'notes':>6s} {'regular':>8s} {'compact':>8s} {'shifted':>8s} {'lanes':>6s} {'ultra':>6s}")
+    for fileName, noteCount, statistics in rows:
+        print(
+            f"{fileName[:60]:60s} {noteCount:6d} {statistics['regularOverlaps']:8d} "
+            f"{statistics['compactOverlaps']:8d} {statistics['shiftedNotes']:8d} "
+            f"{statistics['maxLane'] + 1:6d} {statistics['ultraCompactOverlaps']:6d}"
+        )
+
+    print("")
+    print("Overlapping notes of all songs at each pace:")
+    print(f"{'pace':>6s} {'window':>7s} {'regular':>8s} {'compact':>8s} {'shifted':>8s} {'ultra':>6s} {'songs with compact overlaps':>28s}")
+    for otherPace in paces:
+        total = totals[otherPace]
+        print(
+            f"{otherPace:6d} {total['window']:5d}ms {total.get('regularOverlaps', 0):8d} "
+            f"{total.get('compactOverlaps', 0):8d} {total.get('shiftedNotes', 0):8d} "
+            f"{total.get('ultraCompactOverlaps', 0):6d} {total.get('songsWithCompactOverlaps', 0):28d}"
+        )
+
+#
+# Checks the layouts stored in a bundle are the same as computing them again, and that
+# their Compact lanes are the same as the reference compactLanes at every Note Pace and
+# CHECK_NOTE_SIZES. Returns the number of songs that were checked
+#
+def checkBundle(bundleFileName):
+    with songBundle.SongBundle(bundleFileName) as bundle:
+        if BUNDLE_SECTION not in bundle.sectionNames():
+            raise ValueError(f"{bundleFileName} has no '{BUNDLE_SECTION}' section")
+        for position, entry in enumerate(bundle.songList()):
+            stored = decodeLaneLayouts(bundle.readSection(position, BUNDLE_SECTION))
+            song = bundle.openSong(position)
+            if stored != computeLaneLayouts(song):
+                raise ValueError(f"Stored lane layouts are out of date for '{entry['name']}'")
+            notes = song.get("notes", [])
+            for noteSize in CHECK_NOTE_SIZES:
+                for pace in NOTE_PACES:
+                    window = collisionWindow(pace, noteSize)
+                    for autoHitWeapon1 in [False, True]:
+                        lanes = lanesFor(stored, "Compact", pace, autoHitWeapon1, noteSize)
+                        if lanes != compactLanes(notes, window, autoHitWeapon1):
+                            raise ValueError(
+                                f"Compact lanes of '{entry['name']}' are wrong with note size {noteSize}, "
+                                f"pace {pace}, Auto Hit Weapon 1 {'on' if autoHitWeapon1 else 'off'}"
+                            )
+        return len(bundle)
+
+
+# MARK: Main
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="laneLayouts")
+    parser.add_argument('--pace', type=int, default=DEFAULT_NOTE_PACE, help='Note Pace of the per song report')
+    parser.add_argument('--note-size', type=int, default=REFERENCE_NOTE_SIZE, help='Note size in pixels')
+    parser.add_argument('--auto-hit-weapon1', action='store_true', help='Report with Auto Hit Weapon 1 enabled')
+    parser.add_argument('--check-bundle', metavar='FILE', help='Checks the layouts stored in a song bundle')
+    args = parser.parse_args()
+
+    if args.check_bundle is not None:
+        songCount = checkBundle(args.check_bundle)
+        print(f"Lane layouts of {songCount} songs are up to date")
+    else:
+        printReport(loadSongs(DEFAULT_SONGS_FOLDER), args.pace, args.auto_hit_weapon1, args.note_size)
@@ -0,0 +1,294 @@
+import argparse
+import json
+import os
+import struct
+import time
+
+#
+# A columnar encoding for songs.
+#
+# In the .json files most of a song is the repeated note keys. This encoding stores
+# the notes as columns instead:
+#   time:      zigzag varint deltas from the previous note's time
+#   duration:  zigzag varints
+#   noteType:  one byte per note. The low 5 bits are the NoteType enum value (same
+#              order as NoteType.cs), the next 2 bits are the overrideAuto state, and
+#              the top bit is set if the abilityId was written as a string
+#   abilityId: zigzag varints
+#
+# An encoded song is:
+#   uint32 metadata length, metadata (compact json of the song, with notes = null),
+#   varint note count, then the four columns one after the other
+#
+# Decoding gives back the exact same song, including the key order of every note.
+#
+
+DEFAULT_SONGS_FOLDER = "../defaultSongs"
+
+# Same order as the NoteType enum in the module
+NOTE_TYPES = [
+    "Dodge",
+    "WeaponSwap",
+    "WeaponStow",
+    "Weapon1",
+    "Weapon2",
+    "Weapon3",
+    "Weapon4",
+    "Weapon5",
+    "Heal",
+    "Utility1",
+    "Utility2",
+    "Utility3",
+    "Elite",
+    "Profession1",
+    "Profession2",
+    "Profession3",
+    "Profession4",
+    "Profession5",
+    "Unknown"
+]
+NOTE_TYPE_CODES = {noteType: code for code, noteType in enumerate(NOTE_TYPES)}
+
+NOTE_TYPE_MASK = 0x1F
+# overrideAuto is optional, so its state is: missing, false, or true
+OVERRIDE_AUTO_SHIFT = 5
+OVERRIDE_AUTO_MISSING = 0
+OVERRIDE_AUTO_FALSE = 1
+OVERRIDE_AUTO_TRUE = 2
+OVERRIDE_AUTO_MASK = 0x03
+# Some songs have abilityIds written as strings ("44364"), which is kept as a flag
+ABILITY_ID_STRING_FLAG = 0x80
+
+NOTE_KEYS = ("time", "duration", "noteType", "abilityId")
+NOTE_KEYS_WITH_OVERRIDE = NOTE_KEYS + ("overrideAuto",)
+
+
+# MARK: Varints
+
+def zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+def unzigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+def writeVarint(output, value):
+    while value >= 0x80:
+        output.append((value & 0x7F) | 0x80)
+        value >>= 7
+    output.append(value)
+
+#
+# Reads a varint at offset, returns (value, next offset)
+#
+def readVarint(data, offset):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+# MARK: Encoding
+
+#
+# Raises a ValueError if the note can't be stored in the columns without losing
+# anything (unexpected keys, non integer times, unknown noteTypes)
+#
+def checkEncodableNote(note):
+    keys = tuple(note.keys())
+    if keys != NOTE_KEYS and keys != NOTE_KEYS_WITH_OVERRIDE:
+        raise ValueError(f"Unexpected note keys: {keys}")
+    for key in ("time", "duration"):
+        if type(note[key]) is not int:
+            raise ValueError(f"Note {key} is not an integer: {note[key]}")
+    abilityId = note["abilityId"]
+    if type(abilityId) is str:
+        if not abilityId.lstrip("-").isdigit() or str(int(abilityId)) != abilityId:
+            raise ValueError(f"Note abilityId is not an integer string: {abilityId}")
+    elif type(abilityId) is not int:
+        raise ValueError(f"Note abilityId is not an integer: {abilityId}")
+    if note["noteType"] not in NOTE_TYPE_CODES:
+        raise ValueError(f"Unknown noteType: {note['noteType']}")
+    if "overrideAuto" in note and type(note["overrideAuto"]) is not bool:
+        raise ValueError(f"Note overrideAuto is not a bool: {note['overrideAuto']}")
+
+#
+# The noteType, overrideAuto and abilityId string flag of a note, as one byte
+#
+def encodeNoteTypeByte(note):
+    overrideAuto = OVERRIDE_AUTO_MISSING
+    if "overrideAuto" in note:
+        overrideAuto = OVERRIDE_AUTO_TRUE if note["overrideAuto"] else OVERRIDE_AUTO_FALSE
+    noteTypeByte = NOTE_TYPE_CODES[note["noteType"]] | (overrideAuto << OVERRIDE_AUTO_SHIFT)
+    if type(note["abilityId"]) is str:
+        noteTypeByte |= ABILITY_ID_STRING_FLAG
+    return noteTypeByte
+
+def encodeNotes(notes):
+    timeColumn = bytearray()
+    durationColumn = bytearray()
+    noteTypeColumn = bytearray()
+    abilityIdColumn = bytearray()
+
+    previousTime = 0
+    for note in notes:
+        checkEncodableNote(note)
+        writeVarint(timeColumn, zigzag(note["time"] - previousTime))
+        previousTime = note["time"]
+        writeVarint(durationColumn, zigzag(note["duration"]))
+        noteTypeColumn.append(encodeNoteTypeByte(note))
+        writeVarint(abilityIdColumn, zigzag(int(note["abilityId"])))
+
+    output = bytearray()
+    writeVarint(output, len(notes))
+    return bytes(output + timeColumn + durationColumn + noteTypeColumn + abilityIdColumn)
+
+#
+# Encodes a whole song. Raises a ValueError if the song can't be encoded losslessly
+#
+def encodeSong(song):
+    if not isinstance(song.get("notes"), list):
+        raise ValueError("Song has no notes list")
+    metadata = dict(song)
+    metadata["notes"] = None
+    metadataBytes = json.dumps(metadata, separators=(',', ':'), ensure_ascii=False).encode("utf-8")
+    return struct.pack("<I", len(metadataBytes)) + metadataBytes + encodeNotes(song["notes"])
+
+
+# MARK: Decoding
+
+#
+# Creates a note, with its keys in the same order as the song files
+#
+def decodeNote(time, duration, noteTypeByte, abilityId):
+    note = {
+        "time": time,
+        "duration": duration,
+        "noteType": NOTE_TYPES[noteTypeByte & NOTE_TYPE_MASK],
+        "abilityId": str(abilityId) if noteTypeByte & ABILITY_ID_STRING_FLAG else abilityId
+    }
+    overrideAuto = (noteTypeByte >> OVERRIDE_AUTO_SHIFT) & OVERRIDE_AUTO_MASK
+    if overrideAuto != OVERRIDE_AUTO_MISSING:
+        note["overrideAuto"] = overrideAuto == OVERRIDE_AUTO_TRUE
+    return note
+
+#
+# Decodes the note columns starting at offset
+#
+def decodeNotes(data, offset=0):
+    noteCount, offset = readVarint(data, offset)
+
+    times = []
+    previousTime = 0
+    for _ in range(noteCount):
+        value, offset = readVarint(data, offset)
+        previousTime += unzigzag(value)
+        times.append(previousTime)
+
+    durations = []
+    for _ in range(noteCount):
+        value, offset = readVarint(data, offset)
+        durations.append(unzigzag(value))
+
+    noteTypeBytes = data[offset:offset + noteCount]
+    offset += noteCount
+
+    notes = []
+    for index in range(noteCount):
+        value, offset = readVarint(data, offset)
+        notes.append(decodeNote(times[index], durations[index], noteTypeBytes[index], unzigzag(value)))
+    return notes
+
+def decodeSong(data):
+    metadataLength = struct.unpack_from("<I", data, 0)[0]
+    song = json.loads(bytes(data[4:4 + metadataLength]).decode("utf-8"))
+    song["notes"] = decodeNotes(data, 4 + metadataLength)
+    return song
+
+
+# MARK: Report
+
+#
+# Compares the size and decode time of every song in the folder, as json and as
+# columns. Also checks every song round trips
+#
+def reportFolder(folder, repeats):
+    rows = []
+    for fileName in sorted(os.listdir(folder)):
+        if not fileName.endswith(".json"):
+            continue
+        with open(os.path.join(folder, fileName), 'rb') as f:
+            fileBytes = f.read()
+        song = json.loads(fileBytes.decode("utf-8"))
+        compactJsonBytes = json.dumps(song, separators=(',', ':'), ensure_ascii=False).encode("utf-8")
+        columnarBytes = encodeSong(song)
+        decodedJsonBytes = json.dumps(
+            decodeSong(columnarBytes), separators=(',', ':'), ensure_ascii=False
+        ).encode("utf-8")
+        if decodedJsonBytes != compactJsonBytes:
+            raise ValueError(f"Round trip failed for {fileName}")
+
+        startTime = time.perf_counter()
+        for _ in range(repeats):
+            json.loads(fileBytes.decode("utf-8"))
+        jsonTime = (time.perf_counter() - startTime) / repeats
+
+        startTime = time.perf_counter()
+        for _ in range(repeats):
+            decodeSong(columnarBytes)
+        columnarTime = (time.perf_counter() - startTime) / repeats
+
+        rows.append((
+            fileName,
+            len(song["notes"]),
+            len(fileBytes),
+            len(compactJsonBytes),
+            len(columnarBytes),
+            jsonTime,
+            columnarTime
+        ))
+
+    print(f"{'song':60s} {'notes':>6s} {'json':>9s} {'compact':>9s} {'columnar':>9s} {'ratio':>6s} {'json ms':>8s} {'col ms':>8s}")
+    for fileName, noteCount, jsonSize, compactSize, columnarSize, jsonTime, columnarTime in rows:
+        print(
+            f"{fileName[:60]:60s} {noteCount:6d} {jsonSize:9d} {compactSize:9d} {columnarSize:9d} "
+            f"{columnarSize / jsonSize:6.3f} {jsonTime * 1000:8.3f} {columnarTime * 1000:8.3f}"
+        )
+
+    totalNotes = sum(row[1] for row in rows)
+    totalJson = sum(row[2] for row in rows)
+    totalCompact = sum(row[3] for row in rows)
+    totalColumnar = sum(row[4] for row in rows)
+    totalJsonTime = sum(row[5] for row in rows)
+    totalColumnarTime = sum(row[6] for row in rows)
+    print("")
+    print(f"{len(rows)} songs, {totalNotes} notes. All songs round trip")
+    print(f"  json     : {totalJson:10d} bytes, decoded in {totalJsonTime * 1000:8.2f} ms")
+    print(f"  compact  : {totalCompact:10d} bytes")
+    print(
+        f"  columnar : {totalColumnar:10d} bytes ({100 * totalColumnar / totalJson:.1f}% of json), "
+        f"decoded in {totalColumnarTime * 1000:8.2f} ms"
+    )
+
+
+# MARK: Main
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="noteColumns")
+    parser.add_argument(
+        '--folder',
+        default=DEFAULT_SONGS_FOLDER,
+        help='Folder of song .json files to report on'
+    )
+    parser.add_argument(
+        '--repeats',
+        type=int,
+        default=5,
+        help='How many times each song is decoded when timing'
+    )
+    args = parser.parse_args()
+    reportFolder(args.folder, max(1, args.repeats))
@@ -0,0 +1,385 @@
+import argparse
+import collections
+import gzip
+import json
+import os
+import struct
+import time
+
+import noteColumns
+
+#
+# A dictionary encoding for songs, that shares the notes that songs have in common.
+#
+# Songs of the same build repeat the same runs of notes (openers, the core loop, weapon
+# swaps), and variants of a build share most of them. This encoding has a dictionary,
+# shared by all the songs in a bundle, of:
+#   tokens:  every distinct (noteType, abilityId) of a note, with its usual duration
+#   phrases: a pair of tokens or phrases that often follow each other, found by merging
+#            the most common pair again and again (byte pair encoding)
+# and each song's notes are a list of dictionary codes. Codes are numbered by how often
+# songs use them, so the common ones are a single byte.
+#
+# Recorded durations are a few milliseconds different almost every time a skill is cast,
+# so each note's duration is stored with the song, as the difference from its token's
+# usual duration. Times are not in the dictionary either, since the time between notes
+# is rarely exactly the same in two recordings. They are stored like in noteColumns.py.
+#
+# Encoded dictionary, for every code: uint8 kind, then for a token: uint8 noteType byte
+# (see noteColumns.py), varint abilityId, varint usual duration, and for a phrase: varint
+# first code, varint second code. Numbers are zigzag varints.
+#
+# An encoded song is:
+#   uint32 metadata length, metadata (compact json of the song, with notes = null),
+#   varint note count, the time column (see noteColumns.py), the codes as varints, then
+#   the difference of every note's duration from its token's as zigzag varints
+#
+# Run on its own to compare the encoding with json and gzipped json:
+#   python noteDictionary.py
+#
+
+DEFAULT_SONGS_FOLDER = "../defaultSongs"
+
+# Most phrases the dictionary can have
+MAX_PHRASES = 2048
+# A pair of codes needs to be used this many times to become a phrase
+MIN_PHRASE_USES = 3
+
+ENTRY_TOKEN = 0
+ENTRY_PHRASE = 1
+
+
+# MARK: Dictionary
+
+def noteToken(note):
+    noteColumns.checkEncodableNote(note)
+    return (noteColumns.encodeNoteTypeByte(note), int(note["abilityId"]))
+
+#
+# Returns true if every note of the song can be stored without losing anything
+#
+def isEncodable(song):
+    if not isinstance(song.get("notes"), list):
+        return False
+    try:
+        for note in song["notes"]:
+            noteColumns.checkEncodableNote(note)
+    except ValueError:
+        return False
+    return True
+
+#
+# Replaces every pair in the symbols with the phrase's symbol
+#
+def mergePair(symbols, pair, phraseSymbol):
+    first, second = pair
+    merged = []
+    index = 0
+    while index < len(symbols):
+        if index + 1 < len(symbols) and symbols[index] == first and symbols[index + 1] == second:
+            merged.append(phraseSymbol)
+            index += 2
+        else:
+            merged.append(symbols[index])
+            index += 1
+    return merged
+
+#
+# The dictionary of the songs' notes. While it is built, symbols are numbered in the
+# order they were made: tokens by how often they are used, then phrases in the order they
+# were merged. They are numbered again by use when the dictionary is encoded.
+#
+class NoteDictionary:
+    def __init__(self, tokens, durations, phrases):
+        # symbol -> token, and its usual duration
+        self.tokens = tokens
+        self.durations = durations
+        # (first symbol, second symbol) of every phrase
+        self.phrases = phrases
+        self.tokenSymbols = {token: symbol for symbol, token in enumerate(tokens)}
+        self.phraseSymbols = {pair: len(tokens) + number for number, pair in enumerate(phrases)}
+        # symbol -> code, and the other way around
+        self.codes = None
+        self.symbols = None
+
+    #
+    # Builds a dictionary from songs. Phrases are merged until there are maxPhrases, or no
+    # pair is used minPhraseUses times
+    #
+    @staticmethod
+    def build(songs, maxPhrases=MAX_PHRASES, minPhraseUses=MIN_PHRASE_USES):
+        tokenDurations = collections.defaultdict(collections.Counter)
+        for song in songs:
+            for note in song["notes"]:
+                tokenDurations[noteToken(note)][note["duration"]] += 1
+        tokens = sorted(tokenDurations, key=lambda token: (-sum(tokenDurations[token].values()), token))
+        # The most common duration, and the smallest one of those that are as common
+        durations = [
+            min(tokenDurations[token].items(), key=lambda item: (-item[1], item[0]))[0]
+            for token in tokens
+        ]
+        dictionary = NoteDictionary(tokens, durations, [])
+
+        sequences = [dictionary.tokenSequence(song) for song in songs]
+        while len(dictionary.phrases) < maxPhrases:
+            pairCounts = collections.Counter()
+            for sequence in sequences:
+                pairCounts.update(zip(sequence, sequence[1:]))
+            if len(pairCounts) == 0:
+                break
+            # Ties go to the smallest pair, so the same songs always give the same dictionary
+            uses, pair = min((-uses, pair) for pair, uses in pairCounts.items())
+            if -uses < minPhraseUses:
+                break
+            phraseSymbol = len(tokens) + len(dictionary.phrases)
+            dictionary.phrases.append(pair)
+            dictionary.phraseSymbols[pair] = phraseSymbol
+            sequences = [
+                mergePair(sequence, pair, phraseSymbol) if pair[0] in sequence else sequence
+                for sequence in sequences
+            ]
+
+        # The most used symbols get the smallest codes
+        symbolCounts = collections.Counter()
+        for sequence in sequences:
+            symbolCounts.update(sequence)
+        dictionary.symbols = sorted(
+            range(len(tokens) + len(dictionary.phrases)),
+            key=lambda symbol: (-symbolCounts[symbol], symbol)
+        )
+        dictionary.codes = {symbol: code for code, symbol in enumerate(dictionary.symbols)}
+        return dictionary
+
+    def tokenSequence(self, song):
+        return [self.tokenSymbols[noteToken(note)] for note in song["notes"]]
+
+    #
+    # The symbols of a song's notes, merged into phrases the same way the dictionary was
+    # built: always the pair whose phrase was made first
+    #
+    def symbolSequence(self, song):
+        symbols = []
+        for note in song["notes"]:
+            token = noteToken(note)
+            if token not in self.tokenSymbols:
+                raise ValueError(f"Note is not in the dictionary: {note}")
+            symbols.append(self.tokenSymbols[token])
+
+        while True:
+            firstPhrase = None
+            for pair in zip(symbols, symbols[1:]):
+                phraseSymbol = self.phraseSymbols.get(pair)
+                if phraseSymbol is not None and (firstPhrase is None or phraseSymbol < firstPhrase[1]):
+                    firstPhrase = (pair, phraseSymbol)
+            if firstPhrase is None:
+                return symbols
+            symbols = mergePair(symbols, firstPhrase[0], firstPhrase[1])
+
+    def codeSequence(self, song):
+        return [self.codes[symbol] for symbol in self.symbolSequence(song)]
+
+    def encode(self):
+        output = bytearray()
+        noteColumns.writeVarint(output, len(self.symbols))
+        for symbol in self.symbols:
+            if symbol < len(self.tokens):
+                noteTypeByte, abilityId = self.tokens[symbol]
+                output.append(ENTRY_TOKEN)
+                output.append(noteTypeByte)
+                noteColumns.writeVarint(output, noteColumns.zigzag(abilityId))
+                noteColumns.writeVarint(output, noteColumns.zigzag(self.durations[symbol]))
+            else:
+                first, second = self.phrases[symbol - len(self.tokens)]
+                output.append(ENTRY_PHRASE)
+                noteColumns.writeVarint(output, self.codes[first])
+                noteColumns.writeVarint(output, self.codes[second])
+        return bytes(output)
+
+
+#
+# A decoded dictionary, with the tokens every code expands to
+#
+class DecodedDictionary:
+    def __init__(self, data):
+        entryCount, offset = noteColumns.readVarint(data, 0)
+        entries = []
+        for _ in range(entryCount):
+            kind = data[offset]
+            offset += 1
+            if kind == ENTRY_TOKEN:
+                noteTypeByte = data[offset]
+                abilityId, offset = noteColumns.readVarint(data, offset + 1)
+                duration, offset = noteColumns.readVarint(data, offset)
+                entries.append((noteTypeByte, noteColumns.unzigzag(abilityId), noteColumns.unzigzag(duration)))
+            elif kind == ENTRY_PHRASE:
+                first, offset = noteColumns.readVarint(data, offset)
+                second, offset = noteColumns.readVarint(data, offset)
+                entries.append([first, second])
+            else:
+                raise ValueError(f"Unknown dictionary entry: {kind}")
+
+        # Phrases can use codes that come after them, so they are expanded depth first
+        self.expansions = [None] * entryCount
+        for code in range(entryCount):
+            stack = [code]
+            while len(stack) > 0:
+                current = stack[-1]
+                entry = entries[current]
+                if self.expansions[current] is not None:
+                    stack.pop()
+                elif isinstance(entry, tuple):
+                    self.expansions[current] = (entry,)
+                    stack.pop()
+                elif self.expansions[entry[0]] is None:
+                    stack.append(entry[0])
+                elif self.expansions[entry[1]] is None:
+                    stack.append(entry[1])
+                else:
+                    self.expansions[current] = self.expansions[entry[0]] + self.expansions[entry[1]]
+                    stack.pop()
+
+
+# MARK: Songs
+
+def encodeSong(song, dictionary):
+    if not isinstance(song.get("notes"), list):
+        raise ValueError("Song has no notes list")
+    metadata = dict(song)
+    metadata["notes"] = None
+    metadataBytes = json.dumps(metadata, separators=(',', ':'), ensure_ascii=False).encode("utf-8")
+
+    output = bytearray(struct.pack("<I", len(metadataBytes)) + metadataBytes)
+    noteColumns.writeVarint(output, len(song["notes"]))
+    previousTime = 0
+    for note in song["notes"]:
+        noteColumns.writeVarint(output, noteColumns.zigzag(note["time"] - previousTime))
+        previousTime = note["time"]
+    for code in dictionary.codeSequence(song):
+        noteColumns.writeVarint(output, code)
+    for note in song["notes"]:
+        usualDuration = dictionary.durations[dictionary.tokenSymbols[noteToken(note)]]
+        noteColumns.writeVarint(output, noteColumns.zigzag(note["duration"] - usualDuration))
+    return bytes(output)
+
+def decodeSong(data, decodedDictionary):
+    metadataLength = struct.unpack_from("<I", data, 0)[0]
+    song = json.loads(bytes(data[4:4 + metadataLength]).decode("utf-8"))
+    noteCount, offset = noteColumns.readVarint(data, 4 + metadataLength)
+
+    times = []
+    previousTime = 0
+    for _ in range(noteCount):
+        value, offset = noteColumns.readVarint(data, offset)
+        previousTime += noteColumns.unzigzag(value)
+        times.append(previousTime)
+
+    tokens = []
+    expansions = decodedDictionary.expansions
+    while len(tokens) < noteCount:
+        code, offset = noteColumns.readVarint(data, offset)
+        tokens.extend(expansions[code])
+
+    notes = []
+    for noteTime, (noteTypeByte, abilityId, usualDuration) in zip(times, tokens):
+        value, offset = noteColumns.readVarint(data, offset)
+        notes.append(noteColumns.decodeNote(
+            noteTime, usualDuration + noteColumns.unzigzag(value), noteTypeByte, abilityId
+        ))
+    song["notes"] = notes
+    return song
+
+
+# MARK: Report
+
+def timeRepeats(function, repeats):
+    startTime = time.perf_counter()
+    for _ in range(repeats):
+        function()
+    return (time.perf_counter() - startTime) / repeats
+
+#
+# Compares the size and decode time of all the songs in the folder as json, gzipped json,
+# columns and with a dictionary. Also checks every song round trips
+#
+def reportFolder(folder, repeats):
+    fileBytes = []
+    songs = []
+    for fileName in sorted(os.listdir(folder)):
+        if fileName.endswith(".json"):
+            with open(os.path.join(folder, fileName), 'rb') as f:
+                fileBytes.append(f.read())
+            songs.append(json.loads(fileBytes[-1].decode("utf-8")))
+    noteCount = sum(len(song["notes"]) for song in songs)
+
+    startTime = time.perf_counter()
+    dictionary = NoteDictionary.build(songs)
+    buildTime = time.perf_counter() - startTime
+    dictionaryBytes = dictionary.encode()
+    decodedDictionary = DecodedDictionary(dictionaryBytes)
+    encodedSongs = [encodeSong(song, dictionary) for song in songs]
+    for song, encodedSong in zip(songs, encodedSongs):
+        if decodeSong(encodedSong, decodedDictionary) != song:
+            raise ValueError(f"Round trip failed for '{song.get('name')}'")
+
+    gzippedSongs = [gzip.compress(data, mtime=0) for data in fileBytes]
+    columnarSongs = [noteColumns.encodeSong(song) for song in songs]
+    dictionarySize = len(dictionaryBytes) + sum(len(data) for data in encodedSongs)
+
+    rows = [
+        (
+            "json",
+            sum(len(data) for data in fileBytes),
+            timeRepeats(lambda: [json.loads(data.decode("utf-8")) for data in fileBytes], repeats)
+        ),
+        (
+            "gzip json",
+            sum(len(data) for data in gzippedSongs),
+            timeRepeats(lambda: [json.loads(gzip.decompress(data).decode("utf-8")) for data in gzippedSongs], repeats)
+        ),
+        (
+            "columnar",
+            sum(len(data) for data in columnarSongs),
+            timeRepeats(lambda: [noteColumns.decodeSong(data) for data in columnarSongs], repeats)
+        ),
+        (
+            "dictionary",
+            dictionarySize,
+            timeRepeats(lambda: [decodeSong(data, decodedDictionary) for data in encodedSongs], repeats)
+        )
+    ]
+
+    print(
+        f"{len(songs)} songs, {noteCount} notes. All songs round trip. Dictionary of "
+        f"{len(dictionary.tokens)} tokens and {len(dictionary.phrases)} phrases, "
+        f"{len(dictionaryBytes)} bytes, built in {buildTime:.2f}s"
+    )
+    # Everything but the notes is the same in the columnar and dictionary encodings
+    columnarNotesSize = sum(len(noteColumns.encodeNotes(song["notes"])) for song in songs)
+    metadataSize = rows[2][1] - columnarNotesSize
+    print(f"Notes alone: columnar {columnarNotesSize} bytes, dictionary {dictionarySize - metadataSize} bytes")
+    jsonSize = rows[0][1]
+    print(f"{'encoding':12s} {'bytes':>10s} {'ratio':>7s} {'decode ms':>10s} {'notes/s':>12s}")
+    for name, size, decodeTime in rows:
+        print(
+            f"{name:12s} {size:10d} {jsonSize / size:6.1f}x {decodeTime * 1000:10.2f} "
+            f"{noteCount / decodeTime:12.0f}"
+        )
+
+
+# MARK: Main
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="noteDictionary")
+    parser.add_argument(
+        '--folder',
+        default=DEFAULT_SONGS_FOLDER,
+        help='Folder of song .json files to report on'
+    )
+    parser.add_argument(
+        '--repeats',
+        type=int,
+        default=5,
+        help='How many times the songs are decoded when timing'
+    )
+    args = parser.parse_args()
+    reportFolder(args.folder, max(1, args.repeats))
@@ -0,0 +1,370 @@
+import argparse
+import csv
+import itertools
+import multiprocessing
+import os
+
+import numpy as np
+
+import instrumentation
+import laneLayouts
+import songModel
+
+#
+# Plays songs without the game, to see what the practice settings do to them:
+#   Note Speed (playback rate), Note Pace, Start At, Auto Hit Weapon 1 and No Miss Mode
+#
+# This is a reference implementation of how NotesContainer.cs moves notes, for the
+# RightToLeft orientation, run over every frame at once with NumPy:
+#   + The song starts when play is pressed (frame 0). The notes before Start At are
+#     skipped, and the first notes are placed on screen already (AddInitialNotes):
+#       No Miss Mode:   the first note is at the Perfect position
+#       Otherwise:      the note at Start At reaches Perfect 1s after play
+#   + A note spawns at the right edge when its time, divided by the playback rate, has
+#     passed, but UpdateNotes only spawns one note per frame, so notes closer together than
+#     a frame spawn late. Once spawned, a note moves at Note Pace pixels per second and
+#     reaches Perfect after timeToPerfect ms
+#   + The player presses every note at Perfect, so a note is on screen from its spawn until
+#     its Perfect time. Weapon1 notes with Auto Hit Weapon 1 (and no overrideAuto) are hit
+#     automatically and don't need a key press
+#   + No Miss Mode pauses the song when a note reaches Perfect before it is pressed. The
+#     player can't press keys closer together than the press interval, so the song pauses
+#     at every note that reaches Perfect sooner than that after the previous key press.
+#     Pauses don't move the notes, so only the times after them change
+#
+# The on screen notes of a frame are always a range of notes (see simulateSong), so the
+# note set of every frame is two arrays, instead of a list per frame.
+#
+# The window geometry is from NotesContainer.WindowInfo: Perfect is at PERFECT_POSITION
+# of the window length (but at least 1.5 notes in), notes spawn just past the right edge.
+#
+# Run on its own to sweep every song over a grid of settings, and write a table with a
+# row per song and setting that flags the unplayable ones (see FLAGS):
+#   python playbackSimulator.py
+#   python playbackSimulator.py --rates 0.5 1.0 --paces 150 300 --start-at 0 30
+#   python playbackSimulator.py --song "Power Weaver [SC].json"
+#
+
+DEFAULT_SONGS_FOLDER = "../defaultSongs"
+OUTPUT_FILE = "./playbackSimulation.csv"
+
+# NotesContainer.PerfectPosition
+PERFECT_POSITION = 0.14
+# Length in pixels of the notes window, along the direction the notes move
+REFERENCE_WINDOW_LENGTH = 1000
+FRAME_RATE = 60
+
+# The Note Speed trackbar, as a rate
+MIN_PLAYBACK_RATE = 0.1
+MAX_PLAYBACK_RATE = 1.0
+PLAYBACK_RATES = [0.25, 0.5, 0.75, 1.0]
+
+# About the fastest a player can press one key after another (ms)
+DEFAULT_PRESS_INTERVAL = 100
+
+# A combination is flagged when:
+#   tooManyNotes:       more notes than this are on screen at once
+#   pressesTooClose:    without No Miss Mode, more than this fraction of the key presses
+#                       come sooner than the press interval after the one before, and
+#                       will probably be missed
+#   tooManyPauses:      with No Miss Mode, it pauses more than this many times a minute
+MAX_ON_SCREEN_NOTES = 20
+MAX_CLOSE_PRESS_FRACTION = 0.15
+MAX_PAUSES_PER_MINUTE = 20
+FLAGS = ["tooManyNotes", "pressesTooClose", "tooManyPauses"]
+
+OUTPUT_COLUMNS = [
+    "song", "playbackRate", "notePace", "startAt", "autoHitWeapon1", "noMissMode",
+    "notes", "presses", "durationMs", "peakOnScreen", "minPressGapMs", "closePresses",
+    "pauses", "pauseMs", "flags"
+]
+
+
+# MARK: Settings
+
+def createSettings(playbackRate=1.0, notePace=laneLayouts.DEFAULT_NOTE_PACE, startAt=0,
+                   autoHitWeapon1=False, noMissMode=False):
+    return {
+        "playbackRate": playbackRate,
+        "notePace": notePace,
+        "startAt": startAt,
+        "autoHitWeapon1": autoHitWeapon1,
+        "noMissMode": noMissMode
+    }
+
+#
+# Every combination of the settings, with and without Auto Hit Weapon 1 and No Miss Mode
+#
+def settingsGrid(playbackRates, notePaces, startAts):
+    return [
+        createSettings(playbackRate, notePace, startAt, autoHitWeapon1, noMissMode)
+        for playbackRate, notePace, startAt, autoHitWeapon1, noMissMode in itertools.product(
+            playbackRates, notePaces, startAts, [False, True], [False, True]
+        )
+    ]
+
+#
+# How long a note takes from spawning to Perfect (ms), like WindowInfo.TimeToReachEndMs
+#
+def timeToPerfect(notePace, windowLength=REFERENCE_WINDOW_LENGTH, noteSize=laneLayouts.REFERENCE_NOTE_SIZE):
+    pace = max(notePace, laneLayouts.MIN_NOTE_PACE)
+    perfectPosition = int(max(PERFECT_POSITION * windowLength, noteSize * 1.5))
+    return abs(windowLength + noteSize // 2 - perfectPosition) / pace * 1000
+
+
+# MARK: Simulation
+
+#
+# The arrays of a song the simulation needs, sorted by time
+#
+def loadNoteArrays(song):
+    notes = [note for note in song.notes if type(note.time) in songModel.NUMBER_TYPES]
+    notes.sort(key=lambda note: note.time)
+    return {
+        "time": np.array([note.time for note in notes], dtype=np.float64),
+        "isAutoHit": np.array(
+            [note.noteType == "Weapon1" and not note.overrideAuto for note in notes], dtype=bool
+        )
+    }
+
+#
+# Plays a song with the settings. Returns the frames and statistics:
+#   spawn, perfect:     movement time (ms since play, without pauses) of each played note
+#   frameTime:          movement time of each frame
+#   frameFirst, frameEnd:
+#                       the notes on screen in a frame are frameFirst[f]:frameEnd[f] of
+#                       the played notes. Notes spawn in order and all take the same time
+#                       to reach Perfect, so the notes on screen are always a range
+#   pressNotes:         indices of the played notes that need a key press
+#   pressGaps:          ms between each key press and the one before
+#   pauseNotes, pauseMs:
+#                       No Miss Mode pauses, at the Perfect time of a note
+# Played notes are the notes at or after Start At, sorted by time. firstNote is the index
+# of the first one
+#
+def simulateSong(noteArrays, settings, pressInterval=DEFAULT_PRESS_INTERVAL,
+                 windowLength=REFERENCE_WINDOW_LENGTH, noteSize=laneLayouts.REFERENCE_NOTE_SIZE,
+                 frameRate=FRAME_RATE):
+    playbackRate = min(max(settings["playbackRate"], MIN_PLAYBACK_RATE), MAX_PLAYBACK_RATE)
+    reachMs = timeToPerfect(settings["notePace"], windowLength, noteSize)
+    frameMs = 1000 / frameRate
+
+    firstNote = int(np.searchsorted(noteArrays["time"], settings["startAt"] * 1000, side="left"))
+    times = noteArrays["time"][firstNote:]
+    isAutoHit = noteArrays["isAutoHit"][firstNote:] & settings["autoHitWeapon1"]
+
+    startTime = settings["startAt"] * 1000
+    if settings["noMissMode"]:
+        # The first note is placed at Perfect, and pressing it starts the song
+        if settings["startAt"] > 0 and len(times) > 0:
+            startTime = times[0]
+        moveTime = reachMs
+    elif reachMs >= 1.0:
+        # AddInitialNotes compares the ms with 1.0, so this is used even when a note takes
+        # less than 1s to reach Perfect
+        moveTime = reachMs - 1000
+    else:
+        moveTime = reachMs / 2
+    spawn = (times - startTime) / playbackRate - moveTime
+
+    # Notes that would have spawned before play are placed on screen together. After that,
+    # a note spawns on the first frame after its time, and one note per frame:
+    #   frame[i] = max(frame[i], frame[i - 1] + 1) = i + max(frame[j] - j for j <= i)
+    isPlaced = spawn < 0
+    indices = np.arange(len(spawn))
+    frames = np.where(isPlaced, np.iinfo(np.int64).min // 2, np.floor(spawn / frameMs).astype(np.int64) + 1)
+    frames = indices + np.maximum.accumulate(frames - indices) if len(frames) > 0 else frames
+    spawn = np.where(isPlaced, spawn, frames * frameMs)
+    perfect = spawn + reachMs
+
+    lastFrame = int(np.ceil(perfect[-1] / frameMs)) if len(perfect) > 0 else 0
+    frameTime = np.arange(lastFrame + 1) * frameMs
+    frameEnd = np.searchsorted(spawn, frameTime, side="right")
+    frameFirst = np.minimum(np.searchsorted(perfect, frameTime, side="right"), frameEnd)
+
+    pressNotes = np.nonzero(~isAutoHit)[0]
+    pressGaps = np.diff(perfect[pressNotes])
+    if settings["noMissMode"]:
+        pauses = np.maximum(pressInterval - pressGaps, 0)
+        pauseNotes = pressNotes[1:][pauses > 0]
+        pauseMs = pauses[pauses > 0]
+    else:
+        pauseNotes = np.zeros(0, dtype=np.int64)
+        pauseMs = np.zeros(0, dtype=np.float64)
+
+    return {
+        "firstNote": firstNote,
+        "spawn": spawn,
+        "perfect": perfect,
+        "frameTime": frameTime,
+        "frameFirst": frameFirst,
+        "frameEnd": frameEnd,
+        "pressNotes": pressNotes,
+        "pressGaps": pressGaps,
+        "pauseNotes": pauseNotes,
+        "pauseMs": pauseMs
+    }
+
+#
+# The statistics of a simulation, and the FLAGS it fails
+#
+def summarizeSimulation(simulation, settings, pressInterval=DEFAULT_PRESS_INTERVAL):
+    onScreen = simulation["frameEnd"] - simulation["frameFirst"]
+    pressGaps = simulation["pressGaps"]
+    pauseMs = float(simulation["pauseMs"].sum())
+    durationMs = float(simulation["frameTime"][-1]) + pauseMs
+    closePresses = int(np.count_nonzero(pressGaps < pressInterval))
+
+    summary = {
+        "notes": len(simulation["perfect"]),
+        "presses": len(simulation["pressNotes"]),
+        "durationMs": round(durationMs),
+        "peakOnScreen": int(onScreen.max()) if len(onScreen) > 0 else 0,
+        "minPressGapMs": round(float(pressGaps.min()), 1) if len(pressGaps) > 0 else None,
+        "closePresses": closePresses,
+        "pauses": len(simulation["pauseNotes"]),
+        "pauseMs": round(pauseMs)
+    }
+    flags = []
+    if summary["peakOnScreen"] > MAX_ON_SCREEN_NOTES:
+        flags.append("tooManyNotes")
+    if not settings["noMissMode"] and closePresses > MAX_CLOSE_PRESS_FRACTION * max(len(pressGaps), 1):
+        flags.append("pressesTooClose")
+    if settings["noMissMode"] and summary["pauses"] > MAX_PAUSES_PER_MINUTE * durationMs / 60000:
+        flags.append("tooManyPauses")
+    summary["flags"] = flags
+    return summary
+
+
+# MARK: Sweep
+
+#
+# Simulates a song file with every settings. Runs in the worker processes.
+# Returns (fileName, [(settings, summary)])
+#
+def sweepSongFile(task):
+    fullFileName, grid, pressInterval = task
+    with instrumentation.span("simulateSong", fileName=fullFileName):
+        noteArrays = loadNoteArrays(songModel.loadSongFile(fullFileName))
+        results = []
+        for settings in grid:
+            simulation = simulateSong(noteArrays, settings, pressInterval)
+            results.append((settings, summarizeSimulation(simulation, settings, pressInterval)))
+    return os.path.basename(fullFileName), results
+
+#
+# sweepSongFile in a worker process, with the trace events and counters it recorded
+#
+def sweepSongFileInWorker(task):
+    return sweepSongFile(task), instrumentation.takeEvents()
+
+#
+# Yields the results of sweepSongFile for each song, in order
+#
+def sweepSongs(fullFileNames, grid, pressInterval, workers):
+    tasks = [(fullFileName, grid, pressInterval) for fullFileName in fullFileNames]
+    if workers <= 1 or len(tasks) <= 1:
+        for task in tasks:
+            yield sweepSongFile(task)
+    else:
+        with multiprocessing.Pool(
+            processes=workers,
+            initializer=instrumentation.initWorker,
+            initargs=(instrumentation.workerState(),)
+        ) as pool:
+            for result, recording in pool.imap(
+                sweepSongFileInWorker,
+                tasks,
+                chunksize=max(1, len(tasks) // (workers * 4))
+            ):
+                instrumentation.addEvents(recording)
+                yield result
+
+def outputRow(fileName, settings, summary):
+    row = {"song": fileName}
+    row.update(settings)
+    row.update(summary)
+    row["flags"] = " ".join(summary["flags"])
+    return row
+
+def writeTable(rows, outputFileName):
+    tempFileName = outputFileName + ".tmp"
+    with open(tempFileName, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=OUTPUT_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(tempFileName, outputFileName)
+
+def printReport(rows, grid, printRows):
+    if printRows:
+        print(f"{'song':50s} {'rate':>5s} {'pace':>5s} {'start':>5s} {'auto':>5s} {'noMiss':>6s} "
+              f"{'peak':>5s} {'minGap':>7s} {'close':>6s} {'pauses':>6s}  flags")
+        for row in rows:
+            minPressGap = "-" if row["minPressGapMs"] is None else f"{row['minPressGapMs']:.0f}"
+            print(
+                f"{row['song'][:50]:50s} {row['playbackRate']:5.2f} {row['notePace']:5d} {row['startAt']:5d} "
+                f"{'on' if row['autoHitWeapon1'] else 'off':>5s} {'on' if row['noMissMode'] else 'off':>6s} "
+                f"{row['peakOnScreen']:5d} {minPressGap:>7s} {row['closePresses']:6d} {row['pauses']:6d}  {row['flags']}"
+            )
+        print("")
+
+    print("Flagged songs for each setting:")
+    print(f"{'rate':>5s} {'pace':>5s} {'start':>5s} {'auto':>5s} {'noMiss':>6s} " + " ".join(f"{flag:>15s}" for flag in FLAGS))
+    for settings in grid:
+        settingsRows = [row for row in rows if all(row[key] == value for key, value in settings.items())]
+        counts = [sum(1 for row in settingsRows if flag in row["flags"].split()) for flag in FLAGS]
+        print(
+            f"{settings['playbackRate']:5.2f} {settings['notePace']:5d} {settings['startAt']:5d} "
+            f"{'on' if settings['autoHitWeapon1'] else 'off':>5s} {'on' if settings['noMissMode'] else 'off':>6s} "
+            + " ".join(f"{count:15d}" for count in counts)
+        )
+    flaggedCount = sum(1 for row in rows if row["flags"] != "")
+    print("")
+    print(f"{flaggedCount} of {len(rows)} combinations of song and settings are flagged")
+
+
+# MARK: Main
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="playbackSimulator")
+    parser.add_argument('--rates', type=float, nargs='+', default=PLAYBACK_RATES, help='Playback rates (Note Speed) to simulate')
+    parser.add_argument('--paces', type=int, nargs='+', default=laneLayouts.NOTE_PACES, help='Note Paces to simulate')
+    parser.add_argument('--start-at', type=int, nargs='+', default=[0], help='Start At seconds to simulate')
+    parser.add_argument(
+        '--press-interval',
+        type=float,
+        default=DEFAULT_PRESS_INTERVAL,
+        help='Fastest the player can press one key after another (ms)'
+    )
+    parser.add_argument('--song', action='append', help='Only simulates this song file, and prints every row')
+    parser.add_argument('--output', default=OUTPUT_FILE, help='Where to write the table')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument(
+        '--trace',
+        metavar='FILE',
+        help='Records timings and counters, and writes them to FILE as a Chrome trace'
+    )
+    args = parser.parse_args()
+    if args.trace:
+        instrumentation.enable(args.trace)
+
+    if args.song is not None:
+        fullFileNames = [
+            fileName if os.path.exists(fileName) else os.path.join(DEFAULT_SONGS_FOLDER, fileName)
+            for fileName in args.song
+        ]
+    else:
+        fullFileNames = [
+            os.path.join(DEFAULT_SONGS_FOLDER, fileName)
+            for fileName in sorted(os.listdir(DEFAULT_SONGS_FOLDER)) if fileName.endswith(".json")
+        ]
+    grid = settingsGrid(args.rates, args.paces, args.start_at)
+
+    rows = []
+    with instrumentation.span("sweep", songs=len(fullFileNames), settings=len(grid), workers=args.workers):
+        for fileName, results in sweepSongs(fullFileNames, grid, args.press_interval, args.workers):
+            for settings, summary in results:
+                rows.append(outputRow(fileName, settings, summary))
+    writeTable(rows, args.output)
+    printReport(rows, grid, args.song is not None)
+    print(f"Wrote {args.output}")
@@ -0,0 +1,245 @@
+import argparse
+import json
+
+import noteColumns
+import songBundle
+
+#
+# The build's skill bar of a song with its palette IDs already resolved to abilityIds,
+# and the slot of every note that uses it, so loading a song and remapping its utility
+# skills doesn't need paletteSkillLookup.json.
+#
+# A song's palette has a slot for each of heal, utility 1-3 and elite
+# (decodedBuildTemplate.skills.terrestrial). Each slot has:
+#   paletteId:      the ID in the build template
+#   status:         how the slot was resolved, one of STATUS_NAMES:
+#                     resolved:   paletteId is in paletteSkillLookup.json
+#                     empty:      the build template leaves the slot empty (paletteId 0)
+#                     unresolved: paletteId is not in paletteSkillLookup.json
+#                     legend:     Revenant slots. Their skills come from the legend, and
+#                                 the build template's palette IDs are the same for every
+#                                 legend, so the slot is resolved from the notes instead
+#   abilityId:      the resolved abilityId, None unless the status is resolved
+#   noteAbilityIds: the abilityIds the notes play in the slot, in order of first use
+#   isFlex:         the notes play more than one ability in the slot, or a different one
+#                   than the resolved abilityId (kits, tomes, legend swaps, ...)
+#
+# A note is in a slot if its noteType is the slot's (Heal, Utility1, ...), or if it has a
+# different noteType but plays the resolved abilityId of a slot. Notes of other skills have
+# no slot (NO_SLOT).
+#
+# Encoded palette of a song (see songBundle.py, section "palette"):
+#   for each of the 5 slots: status byte, then varints paletteId, abilityId (0 if None),
+#   isFlex, noteAbilityId count and the zigzag noteAbilityIds
+#   then the notes with a slot: varint count, then for each note the varint difference
+#   to the index of the previous one and a slot byte
+#
+# Run on its own to print the palettes in a bundle:
+#   python resolvedPalettes.py ../DanceDanceRotationModule/ref/defaultSongs.ddrbundle
+#
+
+PALETTE_SKILL_LOOKUP_FILE = '../DanceDanceRotationModule/ref/paletteSkillLookup.json'
+
+# Name of the section in the song bundle
+BUNDLE_SECTION = "palette"
+
+REVENANT_PROFESSION = 9
+
+SLOT_NAMES = ["heal", "utility1", "utility2", "utility3", "elite"]
+# The noteType of the notes in each slot
+SLOT_NOTE_TYPES = ["Heal", "Utility1", "Utility2", "Utility3", "Elite"]
+NO_SLOT = 0xFF
+
+STATUS_RESOLVED = 0
+STATUS_EMPTY = 1
+STATUS_UNRESOLVED = 2
+STATUS_LEGEND = 3
+STATUS_NAMES = ["resolved", "empty", "unresolved", "legend"]
+
+
+# MARK: Lookup Table
+
+paletteSkillLookup = None
+
+def loadPaletteSkillLookup():
+    global paletteSkillLookup
+    if paletteSkillLookup is None:
+        with open(PALETTE_SKILL_LOOKUP_FILE, 'r') as f:
+            paletteSkillLookup = {paletteId: int(abilityId) for paletteId, abilityId in json.load(f).items()}
+    return paletteSkillLookup
+
+
+# MARK: Resolving
+
+#
+# The palette IDs of the heal, utility and elite slots of a build template
+#
+def slotPaletteIds(buildTemplate):
+    terrestrial = buildTemplate.get("skills", {}).get("terrestrial", {})
+    utilities = list(terrestrial.get("utilities") or [])
+    utilities = (utilities + [0, 0, 0])[:3]
+    return [terrestrial.get("heal") or 0] + utilities + [terrestrial.get("elite") or 0]
+
+def resolveSlot(paletteId, isRevenant, lookup):
+    if isRevenant:
+        return STATUS_LEGEND, None
+    if paletteId == 0:
+        return STATUS_EMPTY, None
+    if str(paletteId) in lookup:
+        return STATUS_RESOLVED, lookup[str(paletteId)]
+    return STATUS_UNRESOLVED, None
+
+#
+# { slots: [5 slots], noteSlots: [slot of every note] } of a song
+#
+def resolvePalette(song, lookup=None):
+    if lookup is None:
+        lookup = loadPaletteSkillLookup()
+    buildTemplate = song.get("decodedBuildTemplate", {})
+    isRevenant = buildTemplate.get("profession") == REVENANT_PROFESSION
+    notes = song.get("notes", [])
+
+    slots = []
+    for paletteId in slotPaletteIds(buildTemplate):
+        status, abilityId = resolveSlot(paletteId, isRevenant, lookup)
+        slots.append({
+            "paletteId": paletteId,
+            "status": status,
+            "abilityId": abilityId,
+            "noteAbilityIds": [],
+            "isFlex": False
+        })
+    slotByAbilityId = {}
+    for slot, slotInfo in enumerate(slots):
+        if slotInfo["abilityId"] is not None:
+            slotByAbilityId.setdefault(slotInfo["abilityId"], slot)
+
+    noteSlots = []
+    for note in notes:
+        abilityId = int(note.get("abilityId", 0))
+        noteType = note.get("noteType")
+        if noteType in SLOT_NOTE_TYPES:
+            slot = SLOT_NOTE_TYPES.index(noteType)
+        else:
+            slot = slotByAbilityId.get(abilityId, NO_SLOT)
+        noteSlots.append(slot)
+        if slot != NO_SLOT and abilityId not in slots[slot]["noteAbilityIds"]:
+            slots[slot]["noteAbilityIds"].append(abilityId)
+
+    for slotInfo in slots:
+        noteAbilityIds = slotInfo["noteAbilityIds"]
+        if slotInfo["abilityId"] is None:
+            slotInfo["isFlex"] = len(noteAbilityIds) > 1
+        else:
+            slotInfo["isFlex"] = any(abilityId != slotInfo["abilityId"] for abilityId in noteAbilityIds)
+    return {"slots": slots, "noteSlots": noteSlots}
+
+#
+# The palette IDs of a song that are not in paletteSkillLookup.json
+#
+def unresolvedPaletteIds(palette):
+    return [slot["paletteId"] for slot in palette["slots"] if slot["status"] == STATUS_UNRESOLVED]
+
+
+# MARK: Encoding
+
+def encodePalette(palette):
+    output = bytearray()
+    for slot in palette["slots"]:
+        output.append(slot["status"])
+        noteColumns.writeVarint(output, slot["paletteId"])
+        noteColumns.writeVarint(output, slot["abilityId"] or 0)
+        noteColumns.writeVarint(output, 1 if slot["isFlex"] else 0)
+        noteColumns.writeVarint(output, len(slot["noteAbilityIds"]))
+        for abilityId in slot["noteAbilityIds"]:
+            noteColumns.writeVarint(output, noteColumns.zigzag(abilityId))
+
+    slottedNotes = [(index, slot) for index, slot in enumerate(palette["noteSlots"]) if slot != NO_SLOT]
+    noteColumns.writeVarint(output, len(slottedNotes))
+    previousIndex = 0
+    for index, slot in slottedNotes:
+        noteColumns.writeVarint(output, index - previousIndex)
+        output.append(slot)
+        previousIndex = index
+    return bytes(output)
+
+#
+# The data of a song in the bundle's section
+#
+def encodeBundleSection(song):
+    return encodePalette(resolvePalette(song))
+
+#
+# Decodes a palette. noteCount is needed to fill in the notes with no slot
+#
+def decodePalette(data, noteCount):
+    offset = 0
+    slots = []
+    for _ in SLOT_NAMES:
+        status = data[offset]
+        paletteId, offset = noteColumns.readVarint(data, offset + 1)
+        abilityId, offset = noteColumns.readVarint(data, offset)
+        isFlex, offset = noteColumns.readVarint(data, offset)
+        abilityIdCount, offset = noteColumns.readVarint(data, offset)
+        noteAbilityIds = []
+        for _ in range(abilityIdCount):
+            value, offset = noteColumns.readVarint(data, offset)
+            noteAbilityIds.append(noteColumns.unzigzag(value))
+        slots.append({
+            "paletteId": paletteId,
+            "status": status,
+            "abilityId": abilityId if status == STATUS_RESOLVED else None,
+            "noteAbilityIds": noteAbilityIds,
+            "isFlex": isFlex != 0
+        })
+
+    noteSlots = [NO_SLOT] * noteCount
+    slottedCount, offset = noteColumns.readVarint(data, offset)
+    index = 0
+    for _ in range(slottedCount):
+        indexDelta, offset = noteColumns.readVarint(data, offset)
+        index += indexDelta
+        noteSlots[index] = data[offset]
+        offset += 1
+    return {"slots": slots, "noteSlots": noteSlots}
+
+
+# MARK: Main
+
+def formatSlot(slot):
+    if slot["status"] == STATUS_RESOLVED:
+        text = f"{slot['paletteId']} -> {slot['abilityId']}"
+    else:
+        text = f"{slot['paletteId']} {STATUS_NAMES[slot['status']]}"
+    if slot["isFlex"]:
+        text += f" (flex: {slot['noteAbilityIds']})"
+    return text
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="resolvedPalettes")
+    parser.add_argument('bundleFile', help='Song bundle written by createDefaultSongsArray.py')
+    parser.add_argument('--song', help='Only prints the song with this name')
+    args = parser.parse_args()
+
+    statusCounts = [0] * len(STATUS_NAMES)
+    flexCount = 0
+    with songBundle.SongBundle(args.bundleFile) as bundle:
+        if BUNDLE_SECTION not in bundle.sectionNames():
+            raise SystemExit(f"{args.bundleFile} has no '{BUNDLE_SECTION}' section")
+        for position, entry in enumerate(bundle.songList()):
+            palette = decodePalette(bundle.readSection(position, BUNDLE_SECTION), entry["noteCount"])
+            for slot in palette["slots"]:
+                statusCounts[slot["status"]] += 1
+                flexCount += 1 if slot["isFlex"] else 0
+            if args.song is not None and entry["name"] != args.song:
+                continue
+            slottedCount = len([slot for slot in palette["noteSlots"] if slot != NO_SLOT])
+            print(f"{position:4d}  {entry['name']}  ({slottedCount} of {entry['noteCount']} notes in a slot)")
+            for name, slot in zip(SLOT_NAMES, palette["slots"]):
+                print(f"      {name:9s} {formatSlot(slot)}")
+
+    if args.song is None:
+        print("")
+        print(f"{sum(statusCounts)} slots: " + ", ".join(
+            f"{count} {name}" for name, count in zip(STATUS_NAMES, statusCounts)
+        ) + f". {flexCount} flex")
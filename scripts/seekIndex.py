@@ -0,0 +1,273 @@
+import argparse
+
+import noteColumns
+import songBundle
+
+#
+# A seek index of a song, to find where to start playing from without scanning the notes.
+#
+# The module's Start At setting (and Start Songs With First Skill / No Miss Mode) starts
+# playing at the first note at or after a time. The seek index has a checkpoint every
+# interval milliseconds with:
+#   noteIndex: the first note at or after the checkpoint's time
+#   noteTime:  the time of that note, which Start With First Skill starts at. None if
+#              there is no note after the checkpoint
+# So a lookup goes straight to the checkpoint before the time, and only scans the notes
+# between it and the time. Start At is in whole seconds, so with an interval that divides
+# a second, the checkpoint alone is the answer.
+#
+# Every note before a checkpoint's noteIndex is before its time, so lookups also give the
+# same answer as scanning from the first note for songs with notes out of order.
+#
+# Encoded seek index of a song (see songBundle.py, section "seek"), all varints:
+#   interval, checkpoint count, then for each checkpoint: noteIndex - noteIndex of the
+#   previous checkpoint, and noteTime - checkpoint time (0 if there is no note)
+#
+# Run with --check to check the edge cases in EDGE_CASES, and compare lookups with scanning
+# the notes for every song in the bundle:
+#   python seekIndex.py --check ../DanceDanceRotationModule/ref/defaultSongs.ddrbundle
+#
+
+# Name of the section in the song bundle
+BUNDLE_SECTION = "seek"
+
+DEFAULT_INTERVAL = 1000
+
+# Start At lookups with known answers, checked by --check with several intervals:
+#   (description, noteTimes, startAtSecond, startWithFirstSkill, expected (note index, start time))
+EDGE_CASES = [
+    ("Start At before the first note", [2500, 3000, 4200], 1, False, (0, 1000)),
+    ("Start At before the first note, with first skill", [2500, 3000, 4200], 1, True, (0, 2500)),
+    ("Start At after the last note", [0, 500, 1200], 3, False, (3, 3000)),
+    ("Start At after the last note, with first skill", [0, 500, 1200], 3, True, (3, 3000)),
+    ("Start At in the second after the last note", [0, 500, 1200], 2, True, (3, 2000)),
+    ("Note exactly on an interval boundary", [0, 999, 1000, 2000, 2001], 1, False, (2, 1000)),
+    ("Note exactly on an interval boundary, with first skill", [0, 999, 1000, 2000, 2001], 2, True, (3, 2000)),
+    ("Notes on the same boundary", [1000, 2000, 2000, 2000, 3000], 2, True, (1, 2000)),
+    ("Note just after an interval boundary", [0, 999, 1001], 1, True, (2, 1001)),
+    ("Start At on the time of the last note", [0, 1000, 3000], 3, True, (2, 3000)),
+    ("No notes", [], 2, True, (0, 2000)),
+    ("Start At 0 with the first note later", [1500, 2000], 0, True, (0, 0)),
+    # Rounded to 1000, 1500 and 2000, like the module does
+    ("Note times in fractions of a millisecond", [999.5, 1500.5, 2000.4], 1, True, (0, 1000)),
+    ("Note times in fractions of a millisecond, on a boundary", [999.5, 1500.5, 2000.4], 2, True, (2, 2000)),
+]
+EDGE_CASE_INTERVALS = [250, DEFAULT_INTERVAL, 1500]
+
+
+# MARK: Seek Index
+
+#
+# The index of the first note at or after the time, by scanning every note from the
+# start, the way NotesContainer.AddInitialNotes does
+#
+def scanFirstNoteAt(noteTimes, time):
+    index = 0
+    for noteTime in noteTimes:
+        if noteTime < time:
+            index += 1
+        else:
+            break
+    return index
+
+#
+# { interval, checkpoints: [(noteIndex, noteTime)] }
+#
+def createSeekIndex(noteTimes, interval=DEFAULT_INTERVAL):
+    checkpoints = []
+    if len(noteTimes) > 0:
+        checkpointCount = int(max(0, max(noteTimes)) // interval) + 1
+        noteIndex = 0
+        for checkpoint in range(checkpointCount):
+            checkpointTime = checkpoint * interval
+            while noteIndex < len(noteTimes) and noteTimes[noteIndex] < checkpointTime:
+                noteIndex += 1
+            noteTime = noteTimes[noteIndex] if noteIndex < len(noteTimes) else None
+            checkpoints.append((noteIndex, noteTime))
+    return {"interval": interval, "checkpoints": checkpoints}
+
+def songNoteTimes(song):
+    return moduleNoteTimes(note["time"] for note in song.get("notes", []))
+
+#
+# The note times in whole milliseconds, the way SongTranslator reads them. Math.Round
+# rounds halves to even, the same as round
+#
+def moduleNoteTimes(times):
+    return [round(time) for time in times]
+
+#
+# The index of the first note at or after the time. noteTimes is only read between the
+# checkpoint before the time and the note that is found
+#
+def findFirstNoteAt(seekIndex, noteTimes, time):
+    if time <= 0:
+        return scanFirstNoteAt(noteTimes, time)
+    checkpoint = int(time // seekIndex["interval"])
+    if checkpoint >= len(seekIndex["checkpoints"]):
+        # Every note is before the last checkpoint
+        return len(noteTimes)
+    noteIndex, noteTime = seekIndex["checkpoints"][checkpoint]
+    if noteTime is not None and noteTime >= time:
+        return noteIndex
+    while noteIndex < len(noteTimes) and noteTimes[noteIndex] < time:
+        noteIndex += 1
+    return noteIndex
+
+#
+# Where playing starts for the Start At setting: (note index, start time in ms), like
+# NotesContainer.AddInitialNotes. With startWithFirstSkill (Start Songs With First Skill,
+# or No Miss Mode), the start time is moved to the first note
+#
+def findStart(seekIndex, noteTimes, startAtSecond, startWithFirstSkill):
+    startTime = startAtSecond * 1000
+    if startAtSecond <= 0:
+        return 0, startTime
+    noteIndex = findFirstNoteAt(seekIndex, noteTimes, startTime)
+    if startWithFirstSkill and noteIndex < len(noteTimes):
+        startTime = noteTimes[noteIndex]
+    return noteIndex, startTime
+
+
+# MARK: Encoding
+
+def encodeSeekIndex(seekIndex):
+    output = bytearray()
+    noteColumns.writeVarint(output, seekIndex["interval"])
+    noteColumns.writeVarint(output, len(seekIndex["checkpoints"]))
+    previousNoteIndex = 0
+    for checkpoint, (noteIndex, noteTime) in enumerate(seekIndex["checkpoints"]):
+        noteColumns.writeVarint(output, noteIndex - previousNoteIndex)
+        noteColumns.writeVarint(output, 0 if noteTime is None else noteTime - checkpoint * seekIndex["interval"])
+        previousNoteIndex = noteIndex
+    return bytes(output)
+
+#
+# The data of a song in the bundle's section
+#
+def encodeBundleSection(song):
+    return encodeSeekIndex(createSeekIndex(songNoteTimes(song)))
+
+#
+# Decodes a seek index. noteCount is needed to know which checkpoints have no note
+#
+def decodeSeekIndex(data, noteCount):
+    interval, offset = noteColumns.readVarint(data, 0)
+    checkpointCount, offset = noteColumns.readVarint(data, offset)
+    checkpoints = []
+    noteIndex = 0
+    for checkpoint in range(checkpointCount):
+        noteIndexDelta, offset = noteColumns.readVarint(data, offset)
+        noteTimeDelta, offset = noteColumns.readVarint(data, offset)
+        noteIndex += noteIndexDelta
+        noteTime = checkpoint * interval + noteTimeDelta if noteIndex < noteCount else None
+        checkpoints.append((noteIndex, noteTime))
+    return {"interval": interval, "checkpoints": checkpoints}
+
+
+# MARK: Check
+
+#
+# The times to check a song at: every whole second (the Start At values), every
+# checkpoint and note time, and the milliseconds around them
+#
+def checkTimes(noteTimes, interval):
+    lastTime = max(noteTimes, default=0)
+    times = set(range(0, lastTime + 2000, 1000))
+    times.update(range(0, lastTime + interval + 1, interval))
+    times.update(noteTimes)
+    return sorted(set(
+        time + offset for time in times for offset in [-1, 0, 1]
+    ))
+
+#
+# Checks every one of EDGE_CASES with each of EDGE_CASE_INTERVALS. Returns the number of
+# lookups that were checked, and raises a ValueError on the first wrong answer
+#
+def checkEdgeCases():
+    lookupCount = 0
+    for description, times, startAtSecond, startWithFirstSkill, expected in EDGE_CASES:
+        noteTimes = moduleNoteTimes(times)
+        for interval in EDGE_CASE_INTERVALS:
+            seekIndex = createSeekIndex(noteTimes, interval)
+            decoded = decodeSeekIndex(encodeSeekIndex(seekIndex), len(noteTimes))
+            for checkedIndex in [seekIndex, decoded]:
+                found = findStart(checkedIndex, noteTimes, startAtSecond, startWithFirstSkill)
+                if found != expected:
+                    raise ValueError(
+                        f"{description} (interval {interval} ms): seek index found {found}, expected {expected}"
+                    )
+                lookupCount += 1
+    return lookupCount
+
+#
+# Compares lookups with scanning the notes for every song in a bundle. Returns
+# (songs, lookups) that were checked, and raises a ValueError on the first difference
+#
+def checkBundle(bundleFileName):
+    lookupCount = 0
+    with songBundle.SongBundle(bundleFileName) as bundle:
+        if BUNDLE_SECTION not in bundle.sectionNames():
+            raise ValueError(f"{bundleFileName} has no '{BUNDLE_SECTION}' section")
+        for position, entry in enumerate(bundle.songList()):
+            noteTimes = songNoteTimes(bundle.openSong(position))
+            seekIndex = decodeSeekIndex(bundle.readSection(position, BUNDLE_SECTION), len(noteTimes))
+            if seekIndex != createSeekIndex(noteTimes, seekIndex["interval"]):
+                raise ValueError(f"Stored seek index is out of date for '{entry['name']}'")
+
+            for time in checkTimes(noteTimes, seekIndex["interval"]):
+                expected = scanFirstNoteAt(noteTimes, time)
+                found = findFirstNoteAt(seekIndex, noteTimes, time)
+                if found != expected:
+                    raise ValueError(
+                        f"'{entry['name']}' at {time} ms: seek index found note {found}, scanning found {expected}"
+                    )
+                lookupCount += 1
+
+            for startAtSecond in range(0, max(noteTimes, default=0) // 1000 + 2):
+                for startWithFirstSkill in [False, True]:
+                    startTime = startAtSecond * 1000
+                    expectedIndex = scanFirstNoteAt(noteTimes, startTime) if startAtSecond > 0 else 0
+                    if startWithFirstSkill and startAtSecond > 0 and expectedIndex < len(noteTimes):
+                        startTime = noteTimes[expectedIndex]
+                    found = findStart(seekIndex, noteTimes, startAtSecond, startWithFirstSkill)
+                    if found != (expectedIndex, startTime):
+                        raise ValueError(
+                            f"'{entry['name']}' starting at {startAtSecond}s: seek index found {found}, "
+                            f"scanning found {(expectedIndex, startTime)}"
+                        )
+                    lookupCount += 1
+        return len(bundle), lookupCount
+
+
+# MARK: Main
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="seekIndex")
+    parser.add_argument('bundleFile', help='Song bundle written by createDefaultSongsArray.py')
+    parser.add_argument(
+        '--check',
+        action='store_true',
+        help='Compares seek index lookups with scanning the notes, for every song'
+    )
+    args = parser.parse_args()
+
+    if args.check:
+        edgeCaseCount = checkEdgeCases()
+        print(f"{edgeCaseCount} lookups of {len(EDGE_CASES)} edge cases are right")
+        songCount, lookupCount = checkBundle(args.bundleFile)
+        print(f"{lookupCount} lookups in {songCount} songs match scanning the notes")
+    else:
+        with songBundle.SongBundle(args.bundleFile) as bundle:
+            totalSize = 0
+            for position, entry in enumerate(bundle.songList()):
+                data = bundle.readSection(position, BUNDLE_SECTION)
+                if data is None:
+                    raise SystemExit(f"{args.bundleFile} has no '{BUNDLE_SECTION}' section")
+                seekIndex = decodeSeekIndex(data, entry["noteCount"])
+                totalSize += len(data)
+                print(
+                    f"{position:4d}  {entry['name']}  ({len(seekIndex['checkpoints'])} checkpoints "
+                    f"every {seekIndex['interval']} ms, {len(data)} bytes)"
+                )
+            print(f"{len(bundle)} songs, {totalSize} bytes of seek indexes")
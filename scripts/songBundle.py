@@ -0,0 +1,366 @@
+import argparse
+import hashlib
+import json
+import struct
+
+import noteColumns
+import noteDictionary
+
+#
+# A random access bundle of songs.
+#
+# defaultSongs.json is one big array, so showing the song list or opening a single
+# song means parsing every song. The bundle splits it into:
+#   + a small catalog with the info needed to show the song list
+#   + an index of where each song's payload starts in the file
+#   + the individually encoded song payloads
+#   + optional sections of data precomputed for each song (like the lane layouts
+#     in laneLayouts.py), which can be read without decoding the song
+# so a reader can show the song list by only reading the catalog, and open a song
+# with a single seek and a parse of just that song.
+#
+# Layout (all little endian):
+#   header:   magic "DDRB", uint16 version, uint16 sectionCount, uint32 songCount,
+#             uint32 catalogSize
+#   catalog:  catalogSize bytes of utf-8 json. An array with one entry per song:
+#             { name, profession, noteCount, duration, hash }
+#   sections: sectionCount * 16 byte ascii names, padded with zeros
+#   uint32 dictionarySize, then the dictionary shared by the payloads that are encoded
+#             with one (see noteDictionary.py). Empty if none are
+#   index:    songCount * (1 + sectionCount) * (uint64 offset, uint32 length). For
+#             each song, the payload followed by its data of every section. Offsets
+#             are relative to the start of the payloads
+#   payloads: the encoded songs, in the same order as the catalog. Each payload
+#             starts with a uint8 that says how the rest of it is encoded. The
+#             section data of every song comes after all of the payloads
+#
+# Version 1 bundles have no sections, and their sectionCount is always 0. Their payloads
+# are only the song's json, with no encoding byte. Version 1 and 2 bundles have no
+# dictionary.
+#
+
+MAGIC = b"DDRB"
+VERSION = 3
+SUPPORTED_VERSIONS = [1, 2, 3]
+# The first version whose payloads start with their encoding
+ENCODING_BYTE_VERSION = 2
+HEADER_FORMAT = "<4sHHII"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+INDEX_ENTRY_FORMAT = "<QI"
+INDEX_ENTRY_SIZE = struct.calcsize(INDEX_ENTRY_FORMAT)
+SECTION_NAME_FORMAT = "<16s"
+SECTION_NAME_SIZE = struct.calcsize(SECTION_NAME_FORMAT)
+DICTIONARY_SIZE_FORMAT = "<I"
+DICTIONARY_SIZE_SIZE = struct.calcsize(DICTIONARY_SIZE_FORMAT)
+
+# Song payload encodings
+ENCODING_JSON = 0
+# See noteColumns.py
+ENCODING_COLUMNAR = 1
+# See noteDictionary.py
+ENCODING_DICTIONARY = 2
+
+
+# MARK: Encoding
+
+#
+# Encodes a song as compact json
+#
+def encodeSongJson(song):
+    return json.dumps(song, separators=(',', ':'), ensure_ascii=False).encode("utf-8")
+
+def decodeSongJson(payload):
+    return json.loads(payload.decode("utf-8"))
+
+#
+# Encodes a song as a payload. Songs that can't be stored as columns (or with the
+# dictionary) without losing anything fall back to json
+#
+def encodeSongPayload(song, encoding, dictionary=None):
+    if encoding == ENCODING_COLUMNAR:
+        try:
+            return bytes([ENCODING_COLUMNAR]) + noteColumns.encodeSong(song)
+        except ValueError as e:
+            print(f"Storing '{song.get('name')}' as json: {e}")
+    elif encoding == ENCODING_DICTIONARY:
+        try:
+            return bytes([ENCODING_DICTIONARY]) + noteDictionary.encodeSong(song, dictionary)
+        except ValueError as e:
+            print(f"Storing '{song.get('name')}' as json: {e}")
+    return bytes([ENCODING_JSON]) + encodeSongJson(song)
+
+#
+# Decodes a payload. decodedDictionary is the bundle's noteDictionary.DecodedDictionary,
+# which is only needed for payloads encoded with it
+#
+def decodeSongPayload(payload, decodedDictionary=None):
+    encoding = payload[0]
+    if encoding == ENCODING_JSON:
+        return decodeSongJson(payload[1:])
+    elif encoding == ENCODING_COLUMNAR:
+        return noteColumns.decodeSong(memoryview(payload)[1:])
+    elif encoding == ENCODING_DICTIONARY:
+        if decodedDictionary is None:
+            raise ValueError("Song payload needs a dictionary")
+        return noteDictionary.decodeSong(memoryview(payload)[1:], decodedDictionary)
+    else:
+        raise ValueError(f"Unsupported song payload encoding: {encoding}")
+
+#
+# The length of a song in milliseconds, which is when the last note ends
+#
+def songDuration(song):
+    duration = 0
+    for note in song.get("notes", []):
+        duration = max(duration, note.get("time", 0) + note.get("duration", 0))
+    return duration
+
+#
+# Creates the catalog entry for a song. The hash is of the song's json, so it
+# changes whenever anything in the song changes
+#
+def createCatalogEntry(song):
+    return {
+        "name": song.get("name"),
+        "profession": song.get("decodedBuildTemplate", {}).get("profession"),
+        "noteCount": len(song.get("notes", [])),
+        "duration": songDuration(song),
+        "hash": hashlib.sha256(encodeSongJson(song)).hexdigest()
+    }
+
+#
+# Encodes a list of songs into the bundle format
+#
+def encodeSongBundle(songs, encoding=ENCODING_JSON):
+    dictionary = None
+    if encoding == ENCODING_DICTIONARY:
+        dictionary = noteDictionary.NoteDictionary.build(
+            [song for song in songs if noteDictionary.isEncodable(song)]
+        )
+
+    catalog = []
+    payloads = []
+    for song in songs:
+        catalog.append(createCatalogEntry(song))
+        payloads.append(encodeSongPayload(song, encoding, dictionary))
+    return assembleSongBundle(catalog, payloads, dictionary=dictionary.encode() if dictionary is not None else b"")
+
+#
+# Builds the bundle bytes out of already encoded catalog entries and payloads.
+# sections is { name -> [data of each song] }, in the same order as the payloads, and
+# dictionary is the encoded dictionary of the payloads encoded with one
+#
+def assembleSongBundle(catalog, payloads, sections=None, dictionary=b""):
+    sections = sections or {}
+    catalogBytes = json.dumps(catalog, separators=(',', ':'), ensure_ascii=False).encode("utf-8")
+
+    sectionNames = bytearray()
+    for name in sections:
+        nameBytes = name.encode("ascii")
+        if len(nameBytes) > SECTION_NAME_SIZE:
+            raise ValueError(f"Section name is too long: {name}")
+        if len(sections[name]) != len(payloads):
+            raise ValueError(f"Section '{name}' doesn't have data for every song")
+        sectionNames.extend(struct.pack(SECTION_NAME_FORMAT, nameBytes))
+
+    # Payloads first, then the data of each section
+    offsets = []
+    offset = 0
+    for data in payloads + [data for sectionData in sections.values() for data in sectionData]:
+        offsets.append((offset, len(data)))
+        offset += len(data)
+
+    index = bytearray()
+    for position in range(len(payloads)):
+        index.extend(struct.pack(INDEX_ENTRY_FORMAT, *offsets[position]))
+        for sectionNumber in range(len(sections)):
+            index.extend(struct.pack(INDEX_ENTRY_FORMAT, *offsets[(sectionNumber + 1) * len(payloads) + position]))
+
+    return b"".join([
+        struct.pack(HEADER_FORMAT, MAGIC, VERSION, len(sections), len(catalog), len(catalogBytes)),
+        catalogBytes,
+        bytes(sectionNames),
+        struct.pack(DICTIONARY_SIZE_FORMAT, len(dictionary)),
+        dictionary,
+        bytes(index)
+    ] + payloads + [data for sectionData in sections.values() for data in sectionData])
+
+def writeSongBundle(songs, fileName, encoding=ENCODING_JSON):
+    with open(fileName, "wb") as f:
+        f.write(encodeSongBundle(songs, encoding))
+
+#
+# Converts a defaultSongs.json style array of songs into a bundle
+#
+def convertSongArray(arrayFileName, bundleFileName, encoding=ENCODING_JSON):
+    with open(arrayFileName, 'r', encoding='utf-8') as f:
+        songs = json.load(f)
+    writeSongBundle(songs, bundleFileName, encoding)
+    return len(songs)
+
+
+# MARK: Reading
+
+#
+# Reads a song bundle. Opening the bundle only reads the header, catalog and index.
+# Songs are read from the file when they are requested.
+#
+class SongBundle:
+    def __init__(self, fileName):
+        self.file = open(fileName, "rb")
+        magic, version, sectionCount, songCount, catalogSize = struct.unpack(
+            HEADER_FORMAT, self.file.read(HEADER_SIZE)
+        )
+        if magic != MAGIC:
+            raise ValueError(f"Not a song bundle: {fileName}")
+        if version not in SUPPORTED_VERSIONS:
+            raise ValueError(f"Unsupported song bundle version: {version}")
+        self.version = version
+
+        self.catalog = json.loads(self.file.read(catalogSize).decode("utf-8"))
+        sectionNameBytes = self.file.read(SECTION_NAME_SIZE * sectionCount)
+        # name -> position of its entry in each song's index entries
+        self.sections = {}
+        for sectionNumber in range(sectionCount):
+            name, = struct.unpack_from(SECTION_NAME_FORMAT, sectionNameBytes, SECTION_NAME_SIZE * sectionNumber)
+            self.sections[name.rstrip(b"\0").decode("ascii")] = sectionNumber + 1
+
+        self.dictionaryBytes = b""
+        if version >= 3:
+            dictionarySize, = struct.unpack(DICTIONARY_SIZE_FORMAT, self.file.read(DICTIONARY_SIZE_SIZE))
+            self.dictionaryBytes = self.file.read(dictionarySize)
+        # Decoded the first time a song that needs it is opened
+        self.decodedDictionary = None
+
+        entriesPerSong = 1 + sectionCount
+        indexBytes = self.file.read(INDEX_ENTRY_SIZE * entriesPerSong * songCount)
+        # Each song's (offset, length) of its payload and of its data in every section
+        self.index = [
+            [
+                struct.unpack_from(
+                    INDEX_ENTRY_FORMAT,
+                    indexBytes,
+                    INDEX_ENTRY_SIZE * (entriesPerSong * position + entry)
+                )
+                for entry in range(entriesPerSong)
+            ]
+            for position in range(songCount)
+        ]
+        # The payloads start right after the index
+        self.payloadsOffset = self.file.tell()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self.catalog)
+
+    def close(self):
+        self.file.close()
+
+    #
+    # The catalog entries, in bundle order
+    #
+    def songList(self):
+        return self.catalog
+
+    #
+    # Returns the position of the song with this name, or -1 if it is not in the bundle
+    #
+    def findSong(self, name):
+        for position, entry in enumerate(self.catalog):
+            if entry["name"] == name:
+                return position
+        return -1
+
+    def readEntry(self, position, entry):
+        offset, length = self.index[position][entry]
+        self.file.seek(self.payloadsOffset + offset)
+        return self.file.read(length)
+
+    def readPayload(self, position):
+        return self.readEntry(position, 0)
+
+    def sectionNames(self):
+        return list(self.sections)
+
+    #
+    # Reads a song's data in a section, or returns None if the bundle doesn't have it
+    #
+    def readSection(self, position, name):
+        if name not in self.sections:
+            return None
+        return self.readEntry(position, self.sections[name])
+
+    #
+    # Reads and decodes the song at a position in the catalog
+    #
+    def openSong(self, position):
+        payload = self.readPayload(position)
+        if self.version < ENCODING_BYTE_VERSION:
+            return decodeSongJson(payload)
+        if payload[0] == ENCODING_DICTIONARY and self.decodedDictionary is None:
+            self.decodedDictionary = noteDictionary.DecodedDictionary(self.dictionaryBytes)
+        return decodeSongPayload(payload, self.decodedDictionary)
+
+    def songs(self):
+        for position in range(len(self.catalog)):
+            yield self.openSong(position)
+
+
+# MARK: Main
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="songBundle")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    convertParser = subparsers.add_parser("convert", help="Converts a defaultSongs.json array into a bundle")
+    convertParser.add_argument("arrayFile")
+    convertParser.add_argument("bundleFile")
+    encodingGroup = convertParser.add_mutually_exclusive_group()
+    encodingGroup.add_argument(
+        "--columnar",
+        action="store_true",
+        help="Stores the notes of each song as columns (see noteColumns.py)"
+    )
+    encodingGroup.add_argument(
+        "--dictionary",
+        action="store_true",
+        help="Stores the notes of each song with a dictionary shared by all songs (see noteDictionary.py)"
+    )
+
+    listParser = subparsers.add_parser("list", help="Prints the song list of a bundle")
+    listParser.add_argument("bundleFile")
+
+    showParser = subparsers.add_parser("show", help="Prints one song of a bundle")
+    showParser.add_argument("bundleFile")
+    showParser.add_argument("name", help="Song name, or its position in the bundle")
+
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        encoding = ENCODING_JSON
+        if args.columnar:
+            encoding = ENCODING_COLUMNAR
+        elif args.dictionary:
+            encoding = ENCODING_DICTIONARY
+        songCount = convertSongArray(args.arrayFile, args.bundleFile, encoding)
+        print(f"Wrote {songCount} songs to {args.bundleFile}")
+    elif args.command == "list":
+        with SongBundle(args.bundleFile) as bundle:
+            for position, entry in enumerate(bundle.songList()):
+                print(
+                    f"{position:4d}  {entry['name']}  (profession {entry['profession']}, "
+                    f"{entry['noteCount']} notes, {entry['duration'] / 1000:.1f}s)"
+                )
+            if len(bundle.sectionNames()) > 0:
+                print("Sections: " + ", ".join(bundle.sectionNames()))
+    elif args.command == "show":
+        with SongBundle(args.bundleFile) as bundle:
+            position = int(args.name) if args.name.isdigit() else bundle.findSong(args.name)
+            if position < 0 or position >= len(bundle):
+                raise SystemExit(f"Song not found: {args.name}")
+            print(json.dumps(bundle.openSong(position), indent=4, ensure_ascii=False))
@@ -0,0 +1,368 @@
+import argparse
+import hashlib
+import json
+import os
+
+import songModel
+import songVerifier
+import verifyData
+
+#
+# An inverted index of the songs in defaultSongs/:
+#   abilityId -> the songs that use it, and the positions of its notes in each song
+#   paletteId -> the songs whose build uses it
+#
+# The index is saved between runs and only songs that were added or changed since the
+# last run are read again, so it can answer "which songs use skill X?" without reading
+# every song.
+#
+# It also remembers what every referenced ID looked like in the skill tables the last
+# time the songs were verified. After generateData.py refreshes the tables, 'reverify'
+# finds the IDs that were added, removed or changed, and only verifies the songs that
+# use them:
+#   python songIndex.py uses 12345
+#   python songIndex.py reverify
+#   python songIndex.py reverify --table allSkills --old oldAllSkills.json
+# Tables whose files don't exist yet (allSkills.json is only written by generateData.py)
+# are skipped, unless they are asked for with --table.
+#
+
+INDEX_FILE = "./songIndex.json"
+INDEX_VERSION = 1
+
+# Changed IDs printed per table, before the rest are only counted
+MAX_PRINTED_CHANGES = 50
+
+# name -> (files, index map the table's keys are looked up in)
+SKILL_TABLES = {
+    "abilityInfo": (songVerifier.ABILITY_INFO_FILES, "abilities"),
+    "allSkills": ([songVerifier.ALL_SKILLS_FILE], "abilities"),
+    "paletteSkillLookup": ([songVerifier.PALETTE_SKILL_LOOKUP_FILE], "palettes")
+}
+
+
+# MARK: Index
+
+def createEmptyIndex():
+    return {
+        "version": INDEX_VERSION,
+        # fileName -> { stat, abilityIds, paletteIds }
+        "songs": {},
+        # abilityId -> { fileName -> [note positions] }
+        "abilities": {},
+        # paletteId -> [fileNames]
+        "palettes": {},
+        # What was verified last: fileName -> stat, and table name -> { id -> digest }
+        "verified": {"songs": {}, "tables": {}}
+    }
+
+def loadIndex():
+    try:
+        with open(INDEX_FILE, 'r') as f:
+            index = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return createEmptyIndex()
+    if index.get("version") != INDEX_VERSION:
+        return createEmptyIndex()
+    return index
+
+def saveIndex(index):
+    tempFileName = INDEX_FILE + ".tmp"
+    with open(tempFileName, "w") as f:
+        json.dump(index, f, separators=(',', ':'))
+    os.replace(tempFileName, INDEX_FILE)
+
+def fileStat(fileName):
+    stat = os.stat(fileName)
+    return [stat.st_size, stat.st_mtime_ns]
+
+#
+# Returns the positions of the notes of every abilityId in the song, and the paletteIds
+# of its build. IDs are strings, since some songs have abilityIds written as strings
+#
+def indexSong(song):
+    abilityPositions = {}
+    for position, note in enumerate(song.notes):
+        if note.abilityId is not None:
+            abilityPositions.setdefault(str(note.abilityId), []).append(position)
+
+    paletteIds = []
+    for paletteSkill in song.buildTemplate.utilities:
+        if paletteSkill > 0 and str(paletteSkill) not in paletteIds:
+            paletteIds.append(str(paletteSkill))
+
+    return abilityPositions, paletteIds
+
+def removeSong(index, fileName):
+    entry = index["songs"].pop(fileName)
+    for abilityId in entry["abilityIds"]:
+        songs = index["abilities"][abilityId]
+        del songs[fileName]
+        if len(songs) == 0:
+            del index["abilities"][abilityId]
+    for paletteId in entry["paletteIds"]:
+        fileNames = index["palettes"][paletteId]
+        fileNames.remove(fileName)
+        if len(fileNames) == 0:
+            del index["palettes"][paletteId]
+
+def addSong(index, fileName, stat, song):
+    abilityPositions, paletteIds = indexSong(song)
+    index["songs"][fileName] = {
+        "stat": stat,
+        "abilityIds": sorted(abilityPositions),
+        "paletteIds": paletteIds
+    }
+    for abilityId, positions in abilityPositions.items():
+        index["abilities"].setdefault(abilityId, {})[fileName] = positions
+    for paletteId in paletteIds:
+        index["palettes"].setdefault(paletteId, []).append(fileName)
+
+#
+# Reads the songs that were added or changed since the index was saved, and removes the
+# songs that were deleted. Returns (added, modified, removed) counts
+#
+def updateIndex(index, folder):
+    addedCount = 0
+    modifiedCount = 0
+    fileNames = sorted(fileName for fileName in os.listdir(folder) if fileName.endswith(".json"))
+    for fileName in fileNames:
+        stat = fileStat(os.path.join(folder, fileName))
+        entry = index["songs"].get(fileName)
+        if entry is not None and entry["stat"] == stat:
+            continue
+        try:
+            song = songModel.loadSongFile(os.path.join(folder, fileName))
+        except (songModel.SongFormatError, json.JSONDecodeError, UnicodeDecodeError) as e:
+            print(f"Skipping {fileName}: {e}")
+            if entry is not None:
+                modifiedCount += 1
+                removeSong(index, fileName)
+            continue
+        if entry is None:
+            addedCount += 1
+        else:
+            modifiedCount += 1
+            removeSong(index, fileName)
+        addSong(index, fileName, stat, song)
+
+    removedFileNames = set(index["songs"]) - set(fileNames)
+    for fileName in removedFileNames:
+        removeSong(index, fileName)
+    return addedCount, modifiedCount, len(removedFileNames)
+
+def songsUsingAbility(index, abilityId):
+    return index["abilities"].get(str(abilityId), {})
+
+def songsUsingPalette(index, paletteId):
+    return index["palettes"].get(str(paletteId), [])
+
+
+# MARK: Skill Table Changes
+
+def missingTableFiles(name):
+    return [fileName for fileName in SKILL_TABLES[name][0] if not os.path.exists(fileName)]
+
+def loadTable(fileNames):
+    table = {}
+    for fileName in fileNames:
+        with open(fileName, 'r', encoding='utf-8-sig') as f:
+            table.update(json.load(f))
+    return table
+
+#
+# A short hash of a table entry, or None if the table doesn't have it
+#
+def entryDigest(table, key):
+    if key not in table:
+        return None
+    entryJson = json.dumps(table[key], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(entryJson.encode("utf-8")).hexdigest()[:16]
+
+#
+# Returns the IDs that were added, removed or changed between two versions of a table
+#
+def diffTables(oldTable, newTable):
+    changes = {
+        "added": set(newTable) - set(oldTable),
+        "removed": set(oldTable) - set(newTable),
+        "changed": set()
+    }
+    for key in set(oldTable) & set(newTable):
+        if oldTable[key] != newTable[key]:
+            changes["changed"].add(key)
+    return changes
+
+#
+# Same as diffTables, but against what the table looked like the last time the songs
+# were verified. Only IDs used by songs are compared. IDs that weren't used then are
+# reported as changed, since no song using them was verified against the table
+#
+def diffAgainstVerified(index, name, table):
+    verifiedDigests = index["verified"]["tables"].get(name, {})
+    changes = {"added": set(), "removed": set(), "changed": set()}
+    for key in index[SKILL_TABLES[name][1]]:
+        digest = entryDigest(table, key)
+        if key not in verifiedDigests:
+            changes["changed"].add(key)
+        elif verifiedDigests[key] == digest:
+            continue
+        elif verifiedDigests[key] is None:
+            changes["added"].add(key)
+        elif digest is None:
+            changes["removed"].add(key)
+        else:
+            changes["changed"].add(key)
+    return changes
+
+#
+# The songs that use any of the IDs, from the table's index map
+#
+def songsUsingIds(index, name, ids):
+    indexMap = index[SKILL_TABLES[name][1]]
+    fileNames = set()
+    for key in ids:
+        fileNames.update(indexMap.get(key, ()))
+    return fileNames
+
+#
+# The songs that were added or changed since they were last verified
+#
+def unverifiedSongs(index):
+    verifiedSongs = index["verified"]["songs"]
+    return set(
+        fileName for fileName, entry in index["songs"].items()
+        if verifiedSongs.get(fileName) != entry["stat"]
+    )
+
+#
+# Remembers the songs and tables as verified
+#
+def markVerified(index, tables):
+    index["verified"]["songs"] = {
+        fileName: entry["stat"] for fileName, entry in index["songs"].items()
+    }
+    for name, table in tables.items():
+        index["verified"]["tables"][name] = {
+            key: entryDigest(table, key) for key in index[SKILL_TABLES[name][1]]
+        }
+
+
+# MARK: Main
+
+def printChanges(name, changes, index):
+    total = sum(len(ids) for ids in changes.values())
+    print(f"{name}: {total} used IDs changed")
+    lines = []
+    for kind in ["added", "removed", "changed"]:
+        for key in sorted(changes[kind], key=lambda key: (len(key), key)):
+            fileNames = songsUsingIds(index, name, [key])
+            if len(fileNames) > 0:
+                lines.append(f"  {kind:8s} {key}: {len(fileNames)} songs")
+    for line in lines[:MAX_PRINTED_CHANGES]:
+        print(line)
+    if len(lines) > MAX_PRINTED_CHANGES:
+        print(f"  ... and {len(lines) - MAX_PRINTED_CHANGES} more")
+
+def findAffectedSongs(index, tableNames, oldFile, newFile):
+    affectedFileNames = set()
+    tables = {}
+    for name in tableNames:
+        table = loadTable([newFile] if newFile is not None else SKILL_TABLES[name][0])
+        if oldFile is not None:
+            changes = diffTables(loadTable([oldFile]), table)
+        else:
+            changes = diffAgainstVerified(index, name, table)
+        printChanges(name, changes, index)
+        for ids in changes.values():
+            affectedFileNames |= songsUsingIds(index, name, ids)
+        tables[name] = table
+    return affectedFileNames, tables
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="songIndex")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("build", help="Updates the index with the songs that changed")
+
+    usesParser = subparsers.add_parser("uses", help="Prints the songs that use a skill")
+    usesParser.add_argument("id", help="abilityId, or paletteId with --palette")
+    usesParser.add_argument('--palette', action='store_true', help='Looks up a paletteId')
+
+    for command, help in [
+        ("changes", "Prints the used IDs that changed in the skill tables"),
+        ("reverify", "Verifies the songs that use IDs that changed in the skill tables")
+    ]:
+        changesParser = subparsers.add_parser(command, help=help)
+        changesParser.add_argument(
+            '--table',
+            choices=list(SKILL_TABLES),
+            help='Only compare this table. All tables are compared by default'
+        )
+        changesParser.add_argument(
+            '--old',
+            help='Old version of the table (needs --table). '
+                 'Defaults to the table as it was when the songs were last verified'
+        )
+        changesParser.add_argument(
+            '--new',
+            help='New version of the table (needs --table). Defaults to the current file'
+        )
+        if command == "reverify":
+            changesParser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+
+    args = parser.parse_args()
+
+    index = loadIndex()
+    added, modified, removed = updateIndex(index, songVerifier.DEFAULT_SONGS_FOLDER)
+    if added + modified + removed > 0:
+        print(f"Indexed songs: {added} added, {modified} modified, {removed} removed")
+
+    if args.command == "uses":
+        if args.palette:
+            for fileName in songsUsingPalette(index, args.id):
+                print(fileName)
+        else:
+            for fileName, positions in sorted(songsUsingAbility(index, args.id).items()):
+                print(f"{fileName}: {len(positions)} notes at {positions}")
+    elif args.command in ["changes", "reverify"]:
+        if (args.old is not None or args.new is not None) and args.table is None:
+            raise SystemExit("--old and --new need --table")
+        if args.table is not None:
+            tableNames = [args.table]
+            if args.new is None and len(missingTableFiles(args.table)) > 0:
+                raise SystemExit(f"{args.table} has no file: {', '.join(missingTableFiles(args.table))}")
+        else:
+            tableNames = []
+            for name in SKILL_TABLES:
+                missingFiles = missingTableFiles(name)
+                if len(missingFiles) > 0:
+                    print(f"Skipping {name}, which has no file: {', '.join(missingFiles)}")
+                else:
+                    tableNames.append(name)
+        affectedFileNames, tables = findAffectedSongs(index, tableNames, args.old, args.new)
+        newFileNames = unverifiedSongs(index) - affectedFileNames
+        if len(newFileNames) > 0:
+            print(f"{len(newFileNames)} songs were added or changed since they were last verified")
+        affectedFileNames |= newFileNames
+        print(f"{len(affectedFileNames)} of {len(index['songs'])} songs need to be verified")
+
+        if args.command == "reverify" and len(affectedFileNames) > 0:
+            verifyData.parseFiles(
+                [
+                    songVerifier.DEFAULT_SONGS_FOLDER + "/" + fileName
+                    for fileName in sorted(affectedFileNames)
+                ],
+                args.workers
+            )
+        if args.command == "reverify":
+            # Verifying against explicit table files doesn't say anything about the
+            # current files, so only remember the tables that were read from the project
+            if args.old is None and args.new is None:
+                markVerified(index, tables)
+            else:
+                index["verified"]["songs"] = {
+                    fileName: entry["stat"] for fileName, entry in index["songs"].items()
+                }
+
+    saveIndex(index)
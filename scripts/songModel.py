@@ -0,0 +1,257 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    # Songs are parsed with the standard library when orjson is not installed
+    orjson = None
+
+#
+# Typed records for the songs in defaultSongs/, shared by the data scripts instead of
+# the raw dicts json.load returns.
+#
+#   song = songModel.loadSongFile("../defaultSongs/mySong.json")
+#   for note in song.notes:
+#       note.time, note.abilityId ...
+#
+# Song, Note and BuildTemplate use __slots__, so a note is a fixed size record instead of
+# a dict, and the noteType strings are interned so every note of a type shares one.
+# A note takes about half the memory of its dict (see the songModel benchmark in
+# benchmark.py).
+#
+# decodeSong checks the schema while it builds the records, in the same pass:
+#   + Problems with the song itself (not an object, no notes list, a build template that
+#     isn't one) raise a SongFormatError
+#   + Problems with a single note (a missing key, a value of the wrong type) are kept in
+#     song.noteProblems as (note index, reason), so a verifier can report every one of
+#     them. The note is still in song.notes, with None for the values it is missing
+# abilityIds written as strings ("44364") are converted to ints.
+#
+# The records are only read by the scripts, never written back out, so the outputs that
+# have to match the song files byte for byte (see createDefaultSongsArray.py) are still
+# made from the parsed json.
+#
+# orjson is used to parse the json when it is installed, and the standard library
+# otherwise. setJsonBackend picks one, for comparing them.
+#
+
+NOTE_KEYS = ("time", "duration", "noteType", "abilityId")
+
+JSON_BACKEND_ORJSON = "orjson"
+JSON_BACKEND_STDLIB = "json"
+jsonBackend = JSON_BACKEND_STDLIB if orjson is None else JSON_BACKEND_ORJSON
+
+
+class SongFormatError(ValueError):
+    pass
+
+
+# MARK: Records
+
+class Note:
+    __slots__ = ("time", "duration", "noteType", "abilityId", "overrideAuto")
+
+    def __init__(self, time, duration, noteType, abilityId, overrideAuto=None):
+        self.time = time
+        self.duration = duration
+        self.noteType = noteType
+        self.abilityId = abilityId
+        self.overrideAuto = overrideAuto
+
+    #
+    # (name, value) of every value the note has, in the order of the song files
+    #
+    def fields(self):
+        return [(name, getattr(self, name)) for name in self.__slots__ if getattr(self, name) is not None]
+
+    def __repr__(self):
+        return "Note(" + ", ".join(f"{name}={value!r}" for name, value in self.fields()) + ")"
+
+class BuildTemplate:
+    __slots__ = ("profession", "specializations", "heal", "utilities", "elite", "aquatic", "specific")
+
+    def __init__(self, profession, specializations, heal, utilities, elite, aquatic, specific):
+        self.profession = profession
+        # ((specialization id, (trait choices)), ...)
+        self.specializations = specializations
+        self.heal = heal
+        # Palette IDs of the 3 utility slots
+        self.utilities = utilities
+        self.elite = elite
+        # (heal, utilities, elite) underwater
+        self.aquatic = aquatic
+        self.specific = specific
+
+class Song:
+    __slots__ = (
+        "name", "description", "logUrl", "buildChatCode", "buildUrl", "buildTemplate", "notes", "noteProblems"
+    )
+
+    def __init__(self, name, description, logUrl, buildChatCode, buildUrl, buildTemplate, notes, noteProblems):
+        self.name = name
+        self.description = description
+        self.logUrl = logUrl
+        self.buildChatCode = buildChatCode
+        self.buildUrl = buildUrl
+        self.buildTemplate = buildTemplate
+        self.notes = notes
+        self.noteProblems = noteProblems
+
+    def __repr__(self):
+        return f"Song({self.name!r}, {len(self.notes)} notes)"
+
+
+# MARK: Decoding
+
+NUMBER_TYPES = (int, float)
+
+# noteType -> the one string every note of the type uses
+noteTypeStrings = {}
+
+def decodeInt(value, description):
+    if type(value) is not int:
+        raise SongFormatError(f"{description} is not an integer: {value!r}")
+    return value
+
+def decodePaletteIds(skills, description):
+    if not isinstance(skills, dict):
+        raise SongFormatError(f"{description} is not an object")
+    utilities = skills.get("utilities") or []
+    if not isinstance(utilities, list):
+        raise SongFormatError(f"{description} utilities is not a list")
+    return (
+        decodeInt(skills.get("heal", 0), description + " heal"),
+        tuple(decodeInt(paletteId, description + " utility") for paletteId in utilities),
+        decodeInt(skills.get("elite", 0), description + " elite")
+    )
+
+def decodeBuildTemplate(buildTemplateJson):
+    if not isinstance(buildTemplateJson, dict):
+        raise SongFormatError("decodedBuildTemplate is not an object")
+    skills = buildTemplateJson.get("skills", {})
+    if not isinstance(skills, dict):
+        raise SongFormatError("decodedBuildTemplate skills is not an object")
+    heal, utilities, elite = decodePaletteIds(skills.get("terrestrial", {}), "terrestrial skills")
+    specializations = []
+    for specialization in buildTemplateJson.get("specializations", []):
+        if not isinstance(specialization, dict):
+            raise SongFormatError("specialization is not an object")
+        specializations.append((
+            decodeInt(specialization.get("id", 0), "specialization id"),
+            tuple(decodeInt(trait, "trait") for trait in specialization.get("traits", []))
+        ))
+    return BuildTemplate(
+        profession=decodeInt(buildTemplateJson.get("profession", 0), "profession"),
+        specializations=tuple(specializations),
+        heal=heal,
+        utilities=utilities,
+        elite=elite,
+        aquatic=decodePaletteIds(skills.get("aquatic", {}), "aquatic skills"),
+        specific=tuple(buildTemplateJson.get("specific", []))
+    )
+
+#
+# Returns (note, problem). problem is None if the note matches the schema.
+# decodeSong has a faster path for notes that match it, this finds out what is wrong
+#
+def decodeNote(noteJson):
+    if not isinstance(noteJson, dict):
+        return Note(None, None, None, None), "NOTE IS NOT AN OBJECT"
+
+    problem = None
+    for key in NOTE_KEYS:
+        if key not in noteJson:
+            problem = "MISSING EXPECTED KEY: " + key
+
+    time = noteJson.get("time")
+    duration = noteJson.get("duration")
+    noteType = noteJson.get("noteType")
+    abilityId = noteJson.get("abilityId")
+    overrideAuto = noteJson.get("overrideAuto")
+    if type(abilityId) is str and abilityId.lstrip("-").isdigit():
+        abilityId = int(abilityId)
+    if type(noteType) is str:
+        noteType = noteTypeStrings.setdefault(noteType, noteType)
+
+    if problem is None:
+        if type(time) not in NUMBER_TYPES:
+            problem = f"TIME IS NOT A NUMBER: {time!r}"
+        elif type(duration) not in NUMBER_TYPES:
+            problem = f"DURATION IS NOT A NUMBER: {duration!r}"
+        elif type(noteType) is not str:
+            problem = f"NOTE TYPE IS NOT A STRING: {noteType!r}"
+        elif type(abilityId) is not int:
+            problem = f"ABILITY ID IS NOT AN INTEGER: {abilityId!r}"
+        elif overrideAuto is not None and type(overrideAuto) is not bool:
+            problem = f"OVERRIDE AUTO IS NOT A BOOLEAN: {overrideAuto!r}"
+    return Note(time, duration, noteType, abilityId, overrideAuto), problem
+
+#
+# Builds a Song from the parsed json of a song file
+#
+def decodeSong(songJson):
+    if not isinstance(songJson, dict):
+        raise SongFormatError("Song is not a json object")
+    notesJson = songJson.get("notes")
+    if not isinstance(notesJson, list):
+        raise SongFormatError("Song has no notes list")
+
+    notes = []
+    noteProblems = []
+    for noteJson in notesJson:
+        # Notes that match the schema only need these lookups and type checks
+        try:
+            time = noteJson["time"]
+            duration = noteJson["duration"]
+            noteType = noteJson["noteType"]
+            abilityId = noteJson["abilityId"]
+            overrideAuto = noteJson.get("overrideAuto")
+        except (KeyError, TypeError, AttributeError):
+            time = None
+        if (
+            type(time) in NUMBER_TYPES
+            and type(duration) in NUMBER_TYPES
+            and type(abilityId) is int
+            and type(noteType) is str
+            and (overrideAuto is None or type(overrideAuto) is bool)
+        ):
+            notes.append(Note(time, duration, noteTypeStrings.setdefault(noteType, noteType), abilityId, overrideAuto))
+        else:
+            note, problem = decodeNote(noteJson)
+            notes.append(note)
+            if problem is not None:
+                noteProblems.append((len(notes) - 1, problem))
+
+    return Song(
+        name=songJson.get("name"),
+        description=songJson.get("description"),
+        logUrl=songJson.get("logUrl"),
+        buildChatCode=songJson.get("buildChatCode"),
+        buildUrl=songJson.get("buildUrl"),
+        buildTemplate=decodeBuildTemplate(songJson.get("decodedBuildTemplate", {})),
+        notes=notes,
+        noteProblems=noteProblems
+    )
+
+
+# MARK: Loading
+
+def setJsonBackend(name):
+    global jsonBackend
+    if name == JSON_BACKEND_ORJSON and orjson is None:
+        raise ValueError("orjson is not installed")
+    if name not in (JSON_BACKEND_ORJSON, JSON_BACKEND_STDLIB):
+        raise ValueError(f"Unknown json backend: {name}")
+    jsonBackend = name
+
+#
+# Parses json bytes with the current backend
+#
+def loadsJson(data):
+    if jsonBackend == JSON_BACKEND_ORJSON:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def loadSongFile(fileName):
+    with open(fileName, 'rb') as f:
+        return decodeSong(loadsJson(f.read()))
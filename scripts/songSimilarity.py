@@ -0,0 +1,329 @@
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import sys
+
+import numpy as np
+
+import songModel
+
+#
+# Finds songs in defaultSongs/ that are close variants of each other (the same rotation
+# with a different weapon, a re-upload, ...), so duplicates can be caught when songs are
+# added instead of by hand.
+#
+# Each song is turned into the set of its shingles: every run of SHINGLE_SIZE notes in a
+# row, as (abilityId, noteType). The similarity of two songs is the Jaccard similarity of
+# their shingle sets, estimated from MinHash signatures:
+#   + A song's signature is the minimum of each of NUM_PERMUTATIONS hash functions over its
+#     shingles. The fraction of the values two signatures share is the estimate
+#   + The signature is split into BANDS bands of ROWS values. Songs with the same values in
+#     any band share an LSH bucket, and only songs that share a bucket are compared
+#     (locality-sensitive hashing). Songs that are about SIMILARITY_THRESHOLD similar or more
+#     are very likely to share one
+#
+# The index is saved between runs and only songs that were added or changed since the
+# last run are read again, like songIndex.py:
+#   python songSimilarity.py build
+#   python songSimilarity.py similar mySong.json
+#   python songSimilarity.py similar ../newSongs/upload.json --threshold 0.8
+#   python songSimilarity.py pairs --threshold 0.7
+# 'similar' takes a song in the index, or any song file. It exits with an error if a song
+# is at least --threshold similar, so it can be used to check a song before adding it.
+#
+
+INDEX_FILE = "./songSimilarityIndex.json"
+INDEX_VERSION = 1
+
+DEFAULT_SONGS_FOLDER = "../defaultSongs"
+
+SHINGLE_SIZE = 4
+NUM_PERMUTATIONS = 128
+BANDS = 32
+ROWS = NUM_PERMUTATIONS // BANDS
+# The similarity where songs are as likely to share a bucket as not: (1 / BANDS) ^ (1 / ROWS)
+SIMILARITY_THRESHOLD = (1 / BANDS) ** (1 / ROWS)
+# The hash functions are made from this, so the signatures in a saved index stay valid
+HASH_SEED = 20240521
+
+# Nearest songs printed by 'similar'
+DEFAULT_SIMILAR_COUNT = 10
+# Weapon variants of the same build are usually 0.5 - 0.7 similar
+DEFAULT_PAIRS_THRESHOLD = 0.5
+
+
+# MARK: MinHash
+
+hashParameters = None
+
+#
+# (a, b) of the NUM_PERMUTATIONS hash functions h(x) = (a * x + b) >> 32 (mod 2^64), with
+# a odd, which map the 32 bit shingle hashes to 32 bit values
+#
+def loadHashParameters():
+    global hashParameters
+    if hashParameters is None:
+        rng = np.random.default_rng(HASH_SEED)
+        a = rng.integers(1, 2**63, size=NUM_PERMUTATIONS, dtype=np.uint64) | np.uint64(1)
+        b = rng.integers(0, 2**63, size=NUM_PERMUTATIONS, dtype=np.uint64)
+        hashParameters = (a, b)
+    return hashParameters
+
+#
+# The 32 bit hashes of the song's shingles. Songs shorter than SHINGLE_SIZE notes are one
+# shingle
+#
+def shingleHashes(song):
+    tokens = [f"{note.abilityId}:{note.noteType}" for note in song.notes]
+    shingleCount = max(1, len(tokens) - SHINGLE_SIZE + 1) if len(tokens) > 0 else 0
+    hashes = set()
+    for start in range(shingleCount):
+        shingle = "|".join(tokens[start:start + SHINGLE_SIZE]).encode("utf-8")
+        hashes.add(int.from_bytes(hashlib.blake2b(shingle, digest_size=4).digest(), "little"))
+    return np.array(sorted(hashes), dtype=np.uint64)
+
+#
+# The MinHash signature of a set of shingle hashes, as NUM_PERMUTATIONS uint32. None if
+# there are no shingles
+#
+def minHashSignature(hashes):
+    if len(hashes) == 0:
+        return None
+    a, b = loadHashParameters()
+    # The uint64 multiply wraps around, which is the mod 2^64
+    with np.errstate(over="ignore"):
+        permuted = (hashes[:, np.newaxis] * a + b) >> np.uint64(32)
+    return permuted.min(axis=0).astype(np.uint32)
+
+def songSignature(song):
+    return minHashSignature(shingleHashes(song))
+
+#
+# The estimated Jaccard similarity of the songs of two signatures
+#
+def estimateSimilarity(signature, otherSignature):
+    return float(np.count_nonzero(signature == otherSignature)) / NUM_PERMUTATIONS
+
+#
+# The LSH bucket keys of a signature, one per band
+#
+def bandKeys(signature):
+    return [
+        f"{band}:{signature[band * ROWS:(band + 1) * ROWS].tobytes().hex()}"
+        for band in range(BANDS)
+    ]
+
+def encodeSignature(signature):
+    return signature.astype("<u4").tobytes().hex()
+
+def decodeSignature(text):
+    return np.frombuffer(bytes.fromhex(text), dtype="<u4").astype(np.uint32)
+
+
+# MARK: Index
+
+def createEmptyIndex():
+    return {
+        "version": INDEX_VERSION,
+        # The saved signatures are only valid for the same parameters
+        "parameters": indexParameters(),
+        # fileName -> { stat, name, signature }, signature is None for songs with no notes
+        "songs": {},
+        # band key -> [fileNames]
+        "buckets": {}
+    }
+
+def indexParameters():
+    return {
+        "shingleSize": SHINGLE_SIZE,
+        "permutations": NUM_PERMUTATIONS,
+        "bands": BANDS,
+        "seed": HASH_SEED
+    }
+
+def loadIndex():
+    try:
+        with open(INDEX_FILE, 'r') as f:
+            index = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return createEmptyIndex()
+    if index.get("version") != INDEX_VERSION or index.get("parameters") != indexParameters():
+        return createEmptyIndex()
+    return index
+
+def saveIndex(index):
+    tempFileName = INDEX_FILE + ".tmp"
+    with open(tempFileName, "w") as f:
+        json.dump(index, f, separators=(',', ':'))
+    os.replace(tempFileName, INDEX_FILE)
+
+def fileStat(fileName):
+    stat = os.stat(fileName)
+    return [stat.st_size, stat.st_mtime_ns]
+
+def removeSong(index, fileName):
+    entry = index["songs"].pop(fileName)
+    if entry["signature"] is None:
+        return
+    for key in bandKeys(decodeSignature(entry["signature"])):
+        fileNames = index["buckets"][key]
+        fileNames.remove(fileName)
+        if len(fileNames) == 0:
+            del index["buckets"][key]
+
+def addSong(index, fileName, stat, song):
+    signature = songSignature(song)
+    index["songs"][fileName] = {
+        "stat": stat,
+        "name": song.name,
+        "signature": None if signature is None else encodeSignature(signature)
+    }
+    if signature is not None:
+        for key in bandKeys(signature):
+            index["buckets"].setdefault(key, []).append(fileName)
+
+#
+# Reads the songs that were added or changed since the index was saved, and removes the
+# songs that were deleted. Returns (added, modified, removed) counts
+#
+def updateIndex(index, folder):
+    addedCount = 0
+    modifiedCount = 0
+    fileNames = sorted(fileName for fileName in os.listdir(folder) if fileName.endswith(".json"))
+    for fileName in fileNames:
+        stat = fileStat(os.path.join(folder, fileName))
+        entry = index["songs"].get(fileName)
+        if entry is not None and entry["stat"] == stat:
+            continue
+        try:
+            song = songModel.loadSongFile(os.path.join(folder, fileName))
+        except (songModel.SongFormatError, json.JSONDecodeError, UnicodeDecodeError) as e:
+            print(f"Skipping {fileName}: {e}")
+            if entry is not None:
+                modifiedCount += 1
+                removeSong(index, fileName)
+            continue
+        if entry is None:
+            addedCount += 1
+        else:
+            modifiedCount += 1
+            removeSong(index, fileName)
+        addSong(index, fileName, stat, song)
+
+    removedFileNames = set(index["songs"]) - set(fileNames)
+    for fileName in removedFileNames:
+        removeSong(index, fileName)
+    return addedCount, modifiedCount, len(removedFileNames)
+
+
+# MARK: Queries
+
+#
+# (similarity, fileName) of the songs that share a bucket with the signature, most similar
+# first. excludeFileName is left out, for looking up a song that is in the index
+#
+def nearestSongs(index, signature, excludeFileName=None):
+    candidates = set()
+    for key in bandKeys(signature):
+        candidates.update(index["buckets"].get(key, ()))
+    candidates.discard(excludeFileName)
+    nearest = [
+        (estimateSimilarity(signature, decodeSignature(index["songs"][fileName]["signature"])), fileName)
+        for fileName in candidates
+    ]
+    nearest.sort(key=lambda item: (-item[0], item[1]))
+    return nearest
+
+#
+# (similarity, fileName, otherFileName) of every pair of songs that share a bucket and are
+# at least threshold similar, most similar first
+#
+def similarPairs(index, threshold):
+    signatures = {}
+    comparedPairs = set()
+    pairs = []
+    for fileNames in index["buckets"].values():
+        for fileName, otherFileName in itertools.combinations(sorted(fileNames), 2):
+            if (fileName, otherFileName) in comparedPairs:
+                continue
+            comparedPairs.add((fileName, otherFileName))
+            for name in [fileName, otherFileName]:
+                if name not in signatures:
+                    signatures[name] = decodeSignature(index["songs"][name]["signature"])
+            similarity = estimateSimilarity(signatures[fileName], signatures[otherFileName])
+            if similarity >= threshold:
+                pairs.append((similarity, fileName, otherFileName))
+    pairs.sort(key=lambda pair: (-pair[0], pair[1], pair[2]))
+    return pairs
+
+#
+# (fileName in the index or None, signature) of a song given as a file name in the index,
+# or as a path to any song file
+#
+def lookupSong(index, song):
+    fileName = os.path.basename(song)
+    if not os.path.exists(song) and fileName in index["songs"]:
+        signature = index["songs"][fileName]["signature"]
+        return fileName, None if signature is None else decodeSignature(signature)
+    songFile = song if os.path.exists(song) else os.path.join(DEFAULT_SONGS_FOLDER, song)
+    isIndexed = os.path.abspath(os.path.dirname(songFile)) == os.path.abspath(DEFAULT_SONGS_FOLDER)
+    return fileName if isIndexed else None, songSignature(songModel.loadSongFile(songFile))
+
+
+# MARK: Main
+
+def formatSong(index, fileName):
+    return f"{fileName} ({index['songs'][fileName]['name']})"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="songSimilarity")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("build", help="Updates the index with the songs that changed")
+
+    similarParser = subparsers.add_parser("similar", help="Prints the songs nearest to songs")
+    similarParser.add_argument("songs", nargs="+", help="Song file names in the index, or paths to song files")
+    similarParser.add_argument('--count', type=int, default=DEFAULT_SIMILAR_COUNT, help='Songs printed per song')
+    similarParser.add_argument(
+        '--threshold',
+        type=float,
+        help='Exits with an error if a song is at least this similar to one in the index'
+    )
+
+    pairsParser = subparsers.add_parser("pairs", help="Prints every pair of songs that are at least --threshold similar")
+    pairsParser.add_argument('--threshold', type=float, default=DEFAULT_PAIRS_THRESHOLD)
+
+    args = parser.parse_args()
+
+    index = loadIndex()
+    added, modified, removed = updateIndex(index, DEFAULT_SONGS_FOLDER)
+    if added + modified + removed > 0:
+        print(f"Indexed songs: {added} added, {modified} modified, {removed} removed")
+    saveIndex(index)
+
+    if args.command == "similar":
+        duplicateCount = 0
+        for song in args.songs:
+            fileName, signature = lookupSong(index, song)
+            print(song)
+            if signature is None:
+                print("  <No notes>")
+                continue
+            nearest = nearestSongs(index, signature, excludeFileName=fileName)
+            if args.threshold is not None:
+                duplicates = [item for item in nearest if item[0] >= args.threshold]
+                duplicateCount += len(duplicates)
+            if len(nearest) == 0:
+                print(f"  No songs are more than about {SIMILARITY_THRESHOLD:.2f} similar")
+            for similarity, otherFileName in nearest[:args.count]:
+                print(f"  {similarity:.2f}  {formatSong(index, otherFileName)}")
+        if duplicateCount > 0:
+            sys.exit(f"{duplicateCount} songs are at least {args.threshold} similar")
+    elif args.command == "pairs":
+        pairs = similarPairs(index, args.threshold)
+        for similarity, fileName, otherFileName in pairs:
+            print(f"{similarity:.2f}  {formatSong(index, fileName)}")
+            print(f"      {formatSong(index, otherFileName)}")
+        print(f"{len(pairs)} pairs of songs are at least {args.threshold} similar")
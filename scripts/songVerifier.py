@@ -0,0 +1,276 @@
+import json
+import os
+import pickle
+
+import instrumentation
+import songModel
+import timelineRules
+
+#
+# The song checks used by verifyData.py, as a library that other tools can use.
+#
+#   findings = songVerifier.verifySong(song)
+#   if songVerifier.hasFindings(findings):
+#       ...
+#
+# Songs are songModel.Song records. Findings refer to the notes they are about, and never
+# change the song.
+#
+# Reference tables are only loaded the first time a check needs them, and only in the
+# form the checks use (ID sets, and just the name and slot of every skill). That form is
+# also cached on disk, and rebuilt whenever its source .json files change, so a new
+# process doesn't have to parse the large source files again.
+#
+
+# MARK: Resources in project
+
+ALL_SKILLS_FILE = './allSkills.json'
+DEFAULT_SONGS_FOLDER = '../defaultSongs'
+ABILITY_INFO_FILES = [
+    '../DanceDanceRotationModule/ref/abilityInfoApi.json',
+    '../DanceDanceRotationModule/ref/abilityInfoCustom.json'
+]
+PALETTE_SKILL_LOOKUP_FILE = '../DanceDanceRotationModule/ref/paletteSkillLookup.json'
+
+# Indexed reference tables, cached between runs
+REFERENCE_CACHE_FOLDER = './verifyCache'
+
+
+# MARK: Reference Tables
+
+#
+# The set of every abilityId (as a string) with ability info
+#
+def buildKnownAbilityIds():
+    knownAbilityIds = set()
+    for fileName in ABILITY_INFO_FILES:
+        with open(fileName, 'r', encoding='utf-8-sig') as f:
+            knownAbilityIds.update(json.load(f).keys())
+    return frozenset(knownAbilityIds)
+
+def buildPaletteSkillLookup():
+    with open(PALETTE_SKILL_LOOKUP_FILE, 'r') as f:
+        return json.load(f)
+
+#
+# abilityId -> { name, slot } of every skill in allSkills.json, which is all the reports use
+#
+def buildSkillSummaries():
+    with open(ALL_SKILLS_FILE, 'r') as f:
+        allSkills = json.load(f)
+    skillSummaries = {}
+    for abilityId, skill in allSkills.items():
+        skillSummaries[abilityId] = {
+            "name": skill.get("name"),
+            "slot": skill.get("slot")
+        }
+    return skillSummaries
+
+# name -> (source files, function that builds the table)
+REFERENCE_TABLES = {
+    "knownAbilityIds": (ABILITY_INFO_FILES, buildKnownAbilityIds),
+    "paletteSkillLookup": ([PALETTE_SKILL_LOOKUP_FILE], buildPaletteSkillLookup),
+    "skillSummaries": ([ALL_SKILLS_FILE], buildSkillSummaries)
+}
+
+# Tables that have been loaded by this process
+loadedTables = {}
+
+def sourceStats(fileNames):
+    stats = []
+    for fileName in fileNames:
+        stat = os.stat(fileName)
+        stats.append((fileName, stat.st_size, stat.st_mtime_ns))
+    return stats
+
+#
+# Returns a reference table, loading it the first time it is needed. The disk cache is
+# used if it was made from the same source files
+#
+def getReferenceTable(name):
+    if name in loadedTables:
+        return loadedTables[name]
+
+    with instrumentation.span("loadReferenceTable", table=name):
+        table = loadReferenceTable(name)
+    loadedTables[name] = table
+    return table
+
+def loadReferenceTable(name):
+    sourceFiles, buildTable = REFERENCE_TABLES[name]
+    stats = sourceStats(sourceFiles)
+    cacheFileName = os.path.join(REFERENCE_CACHE_FOLDER, name + ".pickle")
+
+    table = None
+    try:
+        with open(cacheFileName, 'rb') as f:
+            cached = pickle.load(f)
+        if cached["sources"] == stats:
+            table = cached["table"]
+    except (OSError, pickle.UnpicklingError, EOFError, KeyError, TypeError):
+        pass
+
+    if table is None:
+        table = buildTable()
+        os.makedirs(REFERENCE_CACHE_FOLDER, exist_ok=True)
+        tempFileName = cacheFileName + ".tmp"
+        with open(tempFileName, 'wb') as f:
+            pickle.dump({"sources": stats, "table": table}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tempFileName, cacheFileName)
+    return table
+
+#
+# Returns the table if it is loaded already, without loading it. None otherwise
+#
+def loadedReferenceTable(name):
+    return loadedTables.get(name)
+
+#
+# Sets already loaded tables, for example in worker processes that were sent them
+#
+def primeReferenceTables(tables):
+    loadedTables.update(tables)
+
+#
+# Forgets the loaded tables, so they are loaded again the next time they are needed
+#
+def clearReferenceTables(names=None):
+    if names is None:
+        loadedTables.clear()
+    else:
+        for name in names:
+            loadedTables.pop(name, None)
+
+#
+# Returns the keys that were added, removed or changed between two versions of a table
+#
+def changedReferenceKeys(oldTable, newTable):
+    changedKeys = set(oldTable) ^ set(newTable)
+    if isinstance(oldTable, dict) and isinstance(newTable, dict):
+        for key in set(oldTable) & set(newTable):
+            if oldTable[key] != newTable[key]:
+                changedKeys.add(key)
+    return changedKeys
+
+def getKnownAbilityIds():
+    return getReferenceTable("knownAbilityIds")
+
+def getPaletteSkillLookup():
+    return getReferenceTable("paletteSkillLookup")
+
+def getSkillSummaries():
+    return getReferenceTable("skillSummaries")
+
+
+# MARK: Verification
+
+#
+# Counts a note in abilityId -> { note, index, count }, keeping the first note
+#
+def countNote(notesByAbilityId, note, index):
+    entry = notesByAbilityId.get(note.abilityId)
+    if entry is None:
+        notesByAbilityId[note.abilityId] = {"note": note, "index": index, "count": 1}
+    else:
+        entry["count"] += 1
+
+#
+# Runs every check on a song and returns the findings:
+#   unknownPaletteSkills: palette IDs of the build that are not in paletteSkillLookup
+#   invalidNotes:         { note, index, invalidReason } of the notes that don't match the
+#                         schema (see songModel.py) or go back in time
+#   unknownNotes:         abilityId -> { note, index, count } of the first note, for known
+#                         abilities with an Unknown noteType
+#   unknownAbilities:     abilityId -> { note, index, count } of the first note, for
+#                         abilities with no ability info
+#   timelineProblems:     see timelineRules.py
+#
+def verifySong(song):
+    paletteSkillLookup = getPaletteSkillLookup()
+    knownAbilityIds = getKnownAbilityIds()
+
+    # Check palette
+    unknownPaletteSkills = []
+    profession = song.buildTemplate.profession
+    # There are issues with the Revenant. Just ignore those
+    if profession != 9:
+        paletteSkills = song.buildTemplate.utilities
+        for paletteSkill in paletteSkills:
+            if paletteSkill > 0 and str(paletteSkill) not in paletteSkillLookup:
+                unknownPaletteSkills.append(paletteSkill)
+
+    # Invalid format for notes
+    invalidNotes = []
+
+    # Unknown notes (abilityId is known, but the noteType was not determined)
+    unknownNotes = {}
+
+    # Unknown abilityIds ("abilityId" is missing or not known in the lookup table)
+    unknownAbilities = {}
+
+    # Notes with all keys in order, for the timeline rules
+    validNotes = []
+
+    # Parse Notes
+    noteProblems = dict(song.noteProblems)
+    time = 0
+    for index, note in enumerate(song.notes):
+        invalidNoteReason = noteProblems.get(index, "")
+
+        if isinstance(note.time, (int, float)) and note.time < time:
+            invalidNoteReason = "TIME IS BEFORE PREVIOUS NOTE: " + str(time)
+
+        if invalidNoteReason != "":
+            invalidNotes.append({"note": note, "index": index, "invalidReason": invalidNoteReason})
+        else:
+            time = note.time
+            validNotes.append((index, note))
+
+            if str(note.abilityId) not in knownAbilityIds:
+                countNote(unknownAbilities, note, index)
+            elif note.noteType == "Unknown":
+                countNote(unknownNotes, note, index)
+
+    # Timeline problems (overlapping casts, duplicates, gaps, durations)
+    timelineProblems = timelineRules.findTimelineProblems(
+        timelineRules.NoteTable.fromSongs([validNotes]),
+        1
+    )[0]
+
+    return {
+        "unknownPaletteSkills": unknownPaletteSkills,
+        "invalidNotes": invalidNotes,
+        "unknownNotes": unknownNotes,
+        "unknownAbilities": unknownAbilities,
+        "timelineProblems": timelineProblems
+    }
+
+#
+# The keys of each reference table that the findings of a song depend on. If none of them
+# change, verifying the song again gives the same findings
+#
+def songReferences(song):
+    abilityIds = set()
+    for note in song.notes:
+        if note.abilityId is not None:
+            abilityIds.add(str(note.abilityId))
+
+    paletteIds = set()
+    if song.buildTemplate.profession != 9:
+        for paletteSkill in song.buildTemplate.utilities:
+            paletteIds.add(str(paletteSkill))
+
+    return {
+        "knownAbilityIds": abilityIds,
+        "paletteSkillLookup": paletteIds
+    }
+
+def hasFindings(findings):
+    return any(len(values) != 0 for values in findings.values())
+
+#
+# Reads and verifies a song file
+#
+def verifySongFile(fileName):
+    song = songModel.loadSongFile(fileName)
+    return song, verifySong(song)
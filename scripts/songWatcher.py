@@ -0,0 +1,223 @@
+import os
+import time
+
+import songVerifier
+import timelineRules
+
+#
+# Keeps verifying songs while they are being edited (verifyData.py --watch).
+#
+# The reference tables and the findings of every song are kept in memory. The song folder
+# and the reference .json files are polled, and only what changed is verified again:
+#   + A song file that was added or changed is verified again
+#   + A reference file that changed is reloaded, and only the songs that use one of the
+#     IDs that were added, removed or changed in it are verified again
+# Files that can't be read (for example because they are only half written) are
+# reported, and picked up again on their next change.
+#
+
+# Seconds between checking the files for changes
+WATCH_INTERVAL = 0.2
+
+FINDING_NAMES = [
+    "invalidNotes",
+    "unknownPaletteSkills",
+    "unknownAbilities",
+    "unknownNotes"
+]
+
+
+def fileStat(fileName):
+    try:
+        stat = os.stat(fileName)
+    except OSError:
+        return None
+    return (stat.st_size, stat.st_mtime_ns)
+
+#
+# Returns true if the findings should fail verification. Timeline warnings don't
+#
+def hasErrors(findings):
+    for name in FINDING_NAMES:
+        if len(findings[name]) != 0:
+            return True
+    for problem in findings["timelineProblems"]:
+        if problem["severity"] == timelineRules.SEVERITY_ERROR:
+            return True
+    return False
+
+
+class SongWatcher:
+    def __init__(self, folder):
+        self.folder = folder
+        # fullFileName -> { stat, findings, references, error }
+        self.songs = {}
+        # reference file name -> stat
+        self.referenceStats = {}
+        for sourceFiles, _ in songVerifier.REFERENCE_TABLES.values():
+            for fileName in sourceFiles:
+                self.referenceStats[fileName] = fileStat(fileName)
+
+    def listSongFiles(self):
+        try:
+            fileNames = os.listdir(self.folder)
+        except OSError:
+            return []
+        return sorted(
+            os.path.join(self.folder, fileName)
+            for fileName in fileNames
+            if fileName.endswith(".json")
+        )
+
+    def verifySongFile(self, fullFileName, stat):
+        entry = {"stat": stat, "findings": None, "references": None, "error": None}
+        try:
+            song, findings = songVerifier.verifySongFile(fullFileName)
+            entry["findings"] = findings
+            entry["references"] = songVerifier.songReferences(song)
+        except Exception as e:
+            entry["error"] = f"{type(e).__name__}: {e}"
+        self.songs[fullFileName] = entry
+
+    #
+    # Reloads the tables that use a changed reference file. Returns the files of the
+    # songs that have to be verified again
+    #
+    # Tables that aren't loaded and that no song references are only forgotten, and are
+    # loaded from the new file if they are ever needed
+    #
+    def reloadReferences(self, changedFiles):
+        affectedFiles = set()
+        for name, (sourceFiles, _) in songVerifier.REFERENCE_TABLES.items():
+            if not any(fileName in changedFiles for fileName in sourceFiles):
+                continue
+            oldTable = songVerifier.loadedReferenceTable(name)
+            isReferenced = any(
+                entry["references"] is not None and name in entry["references"]
+                for entry in self.songs.values()
+            )
+            songVerifier.clearReferenceTables([name])
+            if oldTable is None and not isReferenced:
+                continue
+            try:
+                newTable = songVerifier.getReferenceTable(name)
+            except Exception as e:
+                # Keep using the last table that loaded, until the file is fixed
+                if oldTable is not None:
+                    songVerifier.primeReferenceTables({name: oldTable})
+                print(f"Could not reload {name}: {type(e).__name__}: {e}")
+                continue
+
+            if oldTable is None:
+                # Nothing to compare with, so every ID counts as changed
+                changedKeys = set(newTable)
+            else:
+                changedKeys = songVerifier.changedReferenceKeys(oldTable, newTable)
+            print(f"Reloaded {name}: {len(changedKeys)} IDs changed")
+            for fullFileName, entry in self.songs.items():
+                references = entry["references"]
+                if references is not None and name in references:
+                    if not references[name].isdisjoint(changedKeys):
+                        affectedFiles.add(fullFileName)
+        return affectedFiles
+
+    #
+    # Checks every watched file once. Returns a description of what was verified, or
+    # None if nothing changed
+    #
+    def update(self):
+        changedReferenceFiles = set()
+        for fileName, stat in self.referenceStats.items():
+            newStat = fileStat(fileName)
+            if newStat != stat:
+                self.referenceStats[fileName] = newStat
+                changedReferenceFiles.add(fileName)
+
+        toVerify = set()
+        if len(changedReferenceFiles) > 0:
+            toVerify |= self.reloadReferences(changedReferenceFiles)
+
+        songFiles = self.listSongFiles()
+        stats = {fullFileName: fileStat(fullFileName) for fullFileName in songFiles}
+        for fullFileName, stat in stats.items():
+            entry = self.songs.get(fullFileName)
+            if entry is None or entry["stat"] != stat:
+                toVerify.add(fullFileName)
+        removedFiles = set(self.songs) - set(stats)
+        for fullFileName in removedFiles:
+            del self.songs[fullFileName]
+        toVerify -= removedFiles
+
+        if len(toVerify) == 0 and len(removedFiles) == 0 and len(changedReferenceFiles) == 0:
+            return None
+
+        for fullFileName in sorted(toVerify):
+            if fullFileName in stats:
+                self.verifySongFile(fullFileName, stats[fullFileName])
+
+        changes = []
+        if len(changedReferenceFiles) > 0:
+            changes.append(f"{len(changedReferenceFiles)} reference files changed")
+        changes.append(f"verified {len(toVerify)} songs")
+        if len(removedFiles) > 0:
+            changes.append(f"{len(removedFiles)} songs removed")
+        return ", ".join(changes)
+
+    #
+    # Prints every song with errors, and the totals
+    #
+    def printSummary(self):
+        errorSongs = 0
+        warningSongs = 0
+        unreadableSongs = 0
+        for fullFileName in sorted(self.songs):
+            entry = self.songs[fullFileName]
+            fileName = os.path.basename(fullFileName)
+            if entry["error"] is not None:
+                unreadableSongs += 1
+                print(f"  [Unreadable] {fileName}: {entry['error']}")
+                continue
+
+            findings = entry["findings"]
+            if not songVerifier.hasFindings(findings):
+                continue
+            if not hasErrors(findings):
+                # Only warnings. These are in the full report
+                warningSongs += 1
+                continue
+            errorSongs += 1
+            counts = [
+                f"{name} {len(findings[name])}"
+                for name in FINDING_NAMES + ["timelineProblems"]
+                if len(findings[name]) > 0
+            ]
+            print(f"  [Error] {fileName}: " + ", ".join(counts))
+
+        print(
+            f"{len(self.songs)} songs: {errorSongs} with errors, {warningSongs} with only warnings, "
+            f"{unreadableSongs} unreadable"
+        )
+        if errorSongs == 0 and unreadableSongs == 0:
+            print("All Data is Valid!")
+        else:
+            print("!! There were errors !! (run verifyData.py without --watch for the full report)")
+
+#
+# Verifies the folder, then keeps verifying changes until interrupted
+#
+def watch(folder):
+    watcher = SongWatcher(folder)
+    print(f"Watching {folder} (Ctrl+C to stop)")
+    try:
+        while True:
+            startTime = time.perf_counter()
+            changes = watcher.update()
+            if changes is not None:
+                elapsed = (time.perf_counter() - startTime) * 1000
+                print("")
+                print(f"== {time.strftime('%H:%M:%S')} {changes} ({elapsed:.0f} ms) ==")
+                watcher.printSummary()
+            time.sleep(WATCH_INTERVAL)
+    except KeyboardInterrupt:
+        print("")
+        print("Stopped watching")
@@ -0,0 +1,166 @@
+import argparse
+import json
+import os
+import random
+
+#
+# Generates corpora of synthetic songs for benchmarks (see benchmark.py).
+#
+# Every synthetic song is based on a real default song. It keeps that song's build
+# (decodedBuildTemplate, buildChatCode, ...), and its notes are spliced together from
+# runs of the real song's notes. So the noteType distribution, the abilityIds, the
+# durations and the timing between notes all look like a real rotation of that build.
+#
+# The same seed and size always generate the same songs.
+#
+
+SOURCE_SONGS_FOLDER = "../defaultSongs"
+ABILITY_INFO_FILE = "../DanceDanceRotationModule/ref/abilityInfoApi.json"
+
+# Bumped whenever the generated songs change, so old corpora are generated again
+GENERATOR_VERSION = 1
+CORPUS_INFO_FILE_NAME = "corpus.json"
+
+# Notes are copied from the real song in runs of this many notes
+MIN_RUN_LENGTH = 8
+MAX_RUN_LENGTH = 40
+# Synthetic songs have this many times the notes of their real song
+MIN_LENGTH_SCALE = 0.8
+MAX_LENGTH_SCALE = 1.2
+
+# allSkills.json slots of the noteTypes, for synthetic skill data
+SLOTS_BY_NOTE_TYPE = {
+    "Weapon1": "Weapon_1",
+    "Weapon2": "Weapon_2",
+    "Weapon3": "Weapon_3",
+    "Weapon4": "Weapon_4",
+    "Weapon5": "Weapon_5",
+    "Heal": "Heal",
+    "Utility1": "Utility",
+    "Utility2": "Utility",
+    "Utility3": "Utility",
+    "Elite": "Elite",
+    "Profession1": "Profession_1",
+    "Profession2": "Profession_2",
+    "Profession3": "Profession_3",
+    "Profession4": "Profession_4",
+    "Profession5": "Profession_5"
+}
+
+
+# MARK: Songs
+
+def loadSourceSongs(folder):
+    songs = []
+    for fileName in sorted(os.listdir(folder)):
+        if fileName.endswith(".json"):
+            with open(os.path.join(folder, fileName), 'r') as f:
+                songs.append(json.load(f))
+    return songs
+
+#
+# Creates a synthetic song from a real one
+#
+def createSong(generator, sourceSong, number):
+    sourceNotes = sourceSong["notes"]
+    gaps = [
+        nextNote["time"] - note["time"]
+        for note, nextNote in zip(sourceNotes, sourceNotes[1:])
+    ]
+    noteCount = max(1, round(len(sourceNotes) * generator.uniform(MIN_LENGTH_SCALE, MAX_LENGTH_SCALE)))
+
+    notes = []
+    time = sourceNotes[0]["time"]
+    while len(notes) < noteCount:
+        start = generator.randrange(len(sourceNotes))
+        run = sourceNotes[start:start + generator.randint(MIN_RUN_LENGTH, MAX_RUN_LENGTH)]
+        runStartTime = run[0]["time"]
+        for sourceNote in run:
+            if len(notes) == noteCount:
+                break
+            note = dict(sourceNote)
+            note["time"] = time + sourceNote["time"] - runStartTime
+            notes.append(note)
+        time = notes[-1]["time"] + (generator.choice(gaps) if len(gaps) > 0 else 0)
+
+    song = dict(sourceSong)
+    song["name"] = f"{sourceSong['name']} #{number}"
+    song["notes"] = notes
+    return song
+
+#
+# Synthetic allSkills.json, built from the ability info table and the noteTypes the
+# abilities are used as in the songs
+#
+def createAllSkills(abilityInfoFileName, songs):
+    slots = {}
+    for song in songs:
+        for note in song["notes"]:
+            if note["noteType"] in SLOTS_BY_NOTE_TYPE:
+                slots[str(note["abilityId"])] = SLOTS_BY_NOTE_TYPE[note["noteType"]]
+
+    with open(abilityInfoFileName, 'r', encoding='utf-8-sig') as f:
+        abilityInfo = json.load(f)
+    allSkills = {}
+    for abilityId, info in abilityInfo.items():
+        skill = {"id": int(abilityId)}
+        if "assetId" in info:
+            skill["icon"] = f"https://render.guildwars2.com/file/0000000000000000/{info['assetId']}.png"
+        if "name" in info:
+            skill["name"] = info["name"]
+        if abilityId in slots:
+            skill["slot"] = slots[abilityId]
+        allSkills[abilityId] = skill
+    return allSkills
+
+
+# MARK: Corpus
+
+def corpusInfo(size, seed):
+    return {"version": GENERATOR_VERSION, "size": size, "seed": seed}
+
+#
+# Returns true if the folder has the corpus for this size and seed
+#
+def isCorpusCurrent(folder, size, seed):
+    infoFileName = os.path.join(os.path.dirname(os.path.abspath(folder)), CORPUS_INFO_FILE_NAME)
+    try:
+        with open(infoFileName, 'r') as f:
+            return json.load(f) == corpusInfo(size, seed)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return False
+
+#
+# Writes size synthetic songs into the folder, as .json files in the same format as the
+# default songs. The info file is written next to the folder, since everything in a song
+# folder is read as a song
+#
+def generateCorpus(folder, size, seed, sourceSongs):
+    if os.path.realpath(folder) == os.path.realpath(SOURCE_SONGS_FOLDER):
+        raise ValueError("Synthetic songs can't be written over the default songs")
+    os.makedirs(folder, exist_ok=True)
+    for fileName in os.listdir(folder):
+        os.remove(os.path.join(folder, fileName))
+
+    generator = random.Random(seed)
+    for number in range(size):
+        song = createSong(generator, generator.choice(sourceSongs), number)
+        with open(os.path.join(folder, f"synthetic{number:06d}.json"), "w") as f:
+            f.write(json.dumps(song, indent=2))
+
+    infoFileName = os.path.join(os.path.dirname(os.path.abspath(folder)), CORPUS_INFO_FILE_NAME)
+    with open(infoFileName, "w") as f:
+        json.dump(corpusInfo(size, seed), f, indent=4)
+
+
+# MARK: Main
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="syntheticSongs")
+    parser.add_argument('folder', help='Folder to write the songs to. Its contents are deleted')
+    parser.add_argument('--size', type=int, default=1000, help='Number of songs')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed')
+    args = parser.parse_args()
+
+    generateCorpus(args.folder, args.size, args.seed, loadSourceSongs(SOURCE_SONGS_FOLDER))
+    print(f"Wrote {args.size} songs to {args.folder}")
@@ -0,0 +1,299 @@
+import argparse
+import time
+
+import numpy as np
+
+import noteColumns
+
+#
+# Timeline checks for song notes, run as whole array operations with NumPy.
+#
+# The notes of one or more songs are loaded into a NoteTable (parallel arrays of song
+# index, note index, time, duration, noteType code and abilityId). Every rule looks at
+# the whole table at once and returns the rows it flags, so checking many songs costs
+# about the same number of operations as checking one. songVerifier.py verifies one
+# song at a time, so it builds a table per song. The timing in __main__ uses one big table.
+#
+
+# Notes further apart than this (ms) probably mean part of the rotation is missing
+MAX_NOTE_GAP = 15000
+# No skill in the game has a cast this long (ms)
+MAX_NOTE_DURATION = 10000
+# A cast cancelled by the next cast of the same skill overlaps it, by up to most of a
+# second in the default songs. Only longer overlaps are reported (ms)
+MAX_CAST_OVERLAP = 1000
+
+SEVERITY_ERROR = "Error"
+# Warnings are printed, but don't fail the verification
+SEVERITY_WARNING = "Warning"
+
+
+# MARK: Note Table
+
+class NoteTable:
+    def __init__(self, songIndex, noteIndex, time, duration, noteType, abilityId):
+        self.songIndex = songIndex
+        self.noteIndex = noteIndex
+        self.time = time
+        self.duration = duration
+        self.noteType = noteType
+        self.abilityId = abilityId
+
+    def __len__(self):
+        return len(self.time)
+
+    #
+    # Builds a table from (noteIndex, songModel.Note) pairs of each song. Notes must match
+    # the schema, so invalid notes should be filtered out first
+    #
+    @staticmethod
+    def fromSongs(indexedNotesPerSong):
+        songIndex = []
+        noteIndex = []
+        times = []
+        durations = []
+        noteTypes = []
+        abilityIds = []
+        unknownCode = noteColumns.NOTE_TYPE_CODES["Unknown"]
+        for position, indexedNotes in enumerate(indexedNotesPerSong):
+            for index, note in indexedNotes:
+                songIndex.append(position)
+                noteIndex.append(index)
+                times.append(note.time)
+                durations.append(note.duration)
+                noteTypes.append(noteColumns.NOTE_TYPE_CODES.get(note.noteType, unknownCode))
+                abilityIds.append(note.abilityId)
+        return NoteTable(
+            np.array(songIndex, dtype=np.int64),
+            np.array(noteIndex, dtype=np.int64),
+            np.array(times, dtype=np.float64),
+            np.array(durations, dtype=np.float64),
+            np.array(noteTypes, dtype=np.int8),
+            np.array(abilityIds, dtype=np.int64)
+        )
+
+
+# MARK: Rules
+#
+# Each rule returns (rows, relatedRows). rows are the flagged rows of the table, and
+# relatedRows are the rows they were compared against (or None)
+#
+
+def sameSongAsPrevious(table):
+    return table.songIndex[1:] == table.songIndex[:-1]
+
+def ruleTimeBeforePrevious(table):
+    rows = np.nonzero(sameSongAsPrevious(table) & (table.time[1:] < table.time[:-1]))[0] + 1
+    return rows, rows - 1
+
+#
+# Packs the song index and a 32 bit value into one int64 key that sorts by song, then
+# value. A single stable argsort of this key is much faster than np.lexsort.
+# Returns None if the values aren't integers that fit in 32 bits
+#
+def songKey(table, values):
+    if len(values) == 0:
+        return np.zeros(0, dtype=np.int64)
+    if values.dtype.kind == "f":
+        if not np.all(np.floor(values) == values):
+            return None
+    if values.min() < -2**31 or values.max() >= 2**31:
+        return None
+    return (table.songIndex << 32) | (values.astype(np.int64) + 2**31)
+
+#
+# A note starts more than MAX_CAST_OVERLAP before the previous note of the same skill has
+# finished casting
+#
+def ruleOverlappingCast(table):
+    key = songKey(table, table.abilityId)
+    if key is None:
+        order = np.lexsort((np.arange(len(table)), table.abilityId, table.songIndex))
+    else:
+        # Stable, so notes of the same skill stay in song order
+        order = np.argsort(key, kind="stable")
+    previous = order[:-1]
+    current = order[1:]
+    sameSkill = (
+        (table.songIndex[current] == table.songIndex[previous])
+        & (table.abilityId[current] == table.abilityId[previous])
+    )
+    overlaps = sameSkill & (table.time[current] < table.time[previous] + table.duration[previous] - MAX_CAST_OVERLAP)
+    flagged = np.nonzero(overlaps)[0]
+    return current[flagged], previous[flagged]
+
+#
+# Two notes with the same time, noteType and abilityId
+#
+def ruleDuplicateNote(table):
+    key = songKey(table, table.time)
+    if key is None:
+        candidates = np.arange(len(table))
+    else:
+        # Only notes that share their song and time with another note can be duplicates,
+        # and there are very few of those, so only they get the full sort
+        order = np.argsort(key, kind="stable")
+        sortedKey = key[order]
+        sameTime = sortedKey[1:] == sortedKey[:-1]
+        isCandidate = np.zeros(len(order), dtype=bool)
+        isCandidate[1:] |= sameTime
+        isCandidate[:-1] |= sameTime
+        candidates = order[isCandidate]
+
+    order = candidates[np.lexsort((
+        candidates,
+        table.abilityId[candidates],
+        table.noteType[candidates],
+        table.time[candidates],
+        table.songIndex[candidates]
+    ))]
+    previous = order[:-1]
+    current = order[1:]
+    duplicates = (
+        (table.songIndex[current] == table.songIndex[previous])
+        & (table.time[current] == table.time[previous])
+        & (table.noteType[current] == table.noteType[previous])
+        & (table.abilityId[current] == table.abilityId[previous])
+    )
+    flagged = np.nonzero(duplicates)[0]
+    return current[flagged], previous[flagged]
+
+def ruleLongGap(table):
+    rows = np.nonzero(
+        sameSongAsPrevious(table) & ((table.time[1:] - table.time[:-1]) > MAX_NOTE_GAP)
+    )[0] + 1
+    return rows, rows - 1
+
+def ruleBadDuration(table):
+    rows = np.nonzero((table.duration < 0) | (table.duration > MAX_NOTE_DURATION))[0]
+    return rows, None
+
+def describeTimeBeforePrevious(table, row, relatedRow):
+    return f"TIME IS BEFORE PREVIOUS NOTE: {table.time[relatedRow]:g}"
+
+def describeOverlappingCast(table, row, relatedRow):
+    overlap = table.time[relatedRow] + table.duration[relatedRow] - table.time[row]
+    return (
+        f"STARTS {overlap:g}ms BEFORE THE PREVIOUS CAST OF THIS SKILL ENDS "
+        f"(note {table.noteIndex[relatedRow]})"
+    )
+
+def describeDuplicateNote(table, row, relatedRow):
+    return f"DUPLICATE OF NOTE {table.noteIndex[relatedRow]}"
+
+def describeLongGap(table, row, relatedRow):
+    gap = table.time[row] - table.time[relatedRow]
+    return f"{gap:g}ms GAP AFTER PREVIOUS NOTE (more than {MAX_NOTE_GAP}ms)"
+
+def describeBadDuration(table, row, relatedRow):
+    return f"DURATION {table.duration[row]:g}ms IS NEGATIVE OR MORE THAN {MAX_NOTE_DURATION}ms"
+
+TIMELINE_RULES = [
+    {
+        "name": "timeBeforePrevious",
+        "severity": SEVERITY_ERROR,
+        "check": ruleTimeBeforePrevious,
+        "describe": describeTimeBeforePrevious
+    },
+    {
+        "name": "overlappingCast",
+        # Cancelled casts are a normal part of many rotations
+        "severity": SEVERITY_WARNING,
+        "check": ruleOverlappingCast,
+        "describe": describeOverlappingCast
+    },
+    {
+        "name": "duplicateNote",
+        "severity": SEVERITY_ERROR,
+        "check": ruleDuplicateNote,
+        "describe": describeDuplicateNote
+    },
+    {
+        "name": "longGap",
+        "severity": SEVERITY_ERROR,
+        "check": ruleLongGap,
+        "describe": describeLongGap
+    },
+    {
+        "name": "badDuration",
+        "severity": SEVERITY_ERROR,
+        "check": ruleBadDuration,
+        "describe": describeBadDuration
+    }
+]
+
+
+# MARK: Running Rules
+
+#
+# Runs the rules and returns every flagged row as
+#   (rule, rows, relatedRows)
+# without building any per note objects
+#
+def runTimelineRules(table, rules=TIMELINE_RULES):
+    results = []
+    if len(table) == 0:
+        return results
+    for rule in rules:
+        rows, relatedRows = rule["check"](table)
+        if len(rows) > 0:
+            results.append((rule, rows, relatedRows))
+    return results
+
+#
+# Runs the rules and returns a list of findings for each song in the table:
+#   { rule, severity, index, reason }
+# Findings of a song are sorted by note index, then rule order
+#
+def findTimelineProblems(table, songCount, rules=TIMELINE_RULES):
+    findingsPerSong = [[] for _ in range(songCount)]
+    for ruleOrder, (rule, rows, relatedRows) in enumerate(runTimelineRules(table, rules)):
+        for position, row in enumerate(rows):
+            relatedRow = None if relatedRows is None else relatedRows[position]
+            findingsPerSong[table.songIndex[row]].append({
+                "rule": rule["name"],
+                "severity": rule["severity"],
+                "index": int(table.noteIndex[row]),
+                "reason": rule["describe"](table, row, relatedRow),
+                "order": ruleOrder
+            })
+    for findings in findingsPerSong:
+        findings.sort(key=lambda finding: (finding["index"], finding["order"]))
+        for finding in findings:
+            del finding["order"]
+    return findingsPerSong
+
+
+# MARK: Main
+
+#
+# Builds a synthetic table of songs directly as arrays, to time the rules alone
+#
+def createSyntheticTable(songCount, notesPerSong, seed):
+    random = np.random.default_rng(seed)
+    noteCount = songCount * notesPerSong
+    songIndex = np.repeat(np.arange(songCount, dtype=np.int64), notesPerSong)
+    noteIndex = np.tile(np.arange(notesPerSong, dtype=np.int64), songCount)
+    gaps = random.gamma(2.0, 220.0, noteCount)
+    gaps[noteIndex == 0] = 0
+    times = np.cumsum(gaps)
+    times -= np.repeat(times[::notesPerSong], notesPerSong)
+    durations = np.round(random.gamma(2.0, 220.0, noteCount))
+    noteTypes = random.integers(0, len(noteColumns.NOTE_TYPES), noteCount, dtype=np.int8)
+    abilityIds = random.integers(1, 80000, noteCount, dtype=np.int64)
+    return NoteTable(songIndex, noteIndex, np.round(times), durations, noteTypes, abilityIds)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="timelineRules")
+    parser.add_argument('--songs', type=int, default=100000, help='Number of synthetic songs')
+    parser.add_argument('--notes', type=int, default=200, help='Notes per synthetic song')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed')
+    args = parser.parse_args()
+
+    table = createSyntheticTable(args.songs, args.notes, args.seed)
+    startTime = time.perf_counter()
+    results = runTimelineRules(table)
+    elapsed = time.perf_counter() - startTime
+    print(f"Checked {args.songs} songs ({len(table)} notes) in {elapsed:.2f}s")
+    for rule, rows, _ in results:
+        print(f"  {rule['name']}: {len(rows)} flagged")
@@ -1,31 +1,38 @@
-import json
+import argparse
+import multiprocessing
 import os
+import tempfile
+
+import instrumentation
+import songModel
+import songVerifier
+import songWatcher
+import timelineRules
 
 #
 # This is a script that will validate the data in the blish module:
 #   + All default songs are missing "Unknown"
 #   + All abilityIds are known
 #   + All palleteIds are known
+#   + Note timelines make sense (see timelineRules.py)
 #
 # If anything is missing, it will be printed out (it's recommended to dump the output to a file)
 #
-
-# MARK: Resources in project
-
-ALL_SKILLS_FILE = './allSkills.json'
-DEFAULT_SONGS_FOLDER = '../defaultSongs'
-ABILITY_INFO_FILES = [
-    '../DanceDanceRotationModule/ref/abilityInfoApi.json',
-    '../DanceDanceRotationModule/ref/abilityInfoCustom.json'
-]
-PALETTE_SKILL_LOOKUP_FILE = '../DanceDanceRotationModule/ref/paletteSkillLookup.json'
-
-EXPECTED_KEYS_IN_NOTES = [
-    "time",
-    "duration",
-    "noteType",
-    "abilityId"
-]
+# Songs are verified in parallel across a pool of worker processes (see --workers).
+# The report is the same no matter how many workers are used.
+#
+# The songs are verified as a stream, so memory doesn't grow with the size of the library:
+#   + Workers only send back the findings of a song (see compactFindings), with the few
+#     notes the report prints, instead of the whole song
+#   + The findings are added to a VerifyReport as they arrive, in one pass for every
+#     section of the report. It keeps the first song for each unknown ID, and writes the
+#     per-song lines of the invalid notes and timeline sections to temporary files until
+#     the report is printed
+#
+# The checks themselves are in songVerifier.py. Pass song files to only verify those:
+#   python verifyData.py ../defaultSongs/mySong.json
+# Or run with --watch to keep verifying songs as they are edited (see songWatcher.py)
+#
 
 PROFESSIONS_BY_CODE = {
    1: "Guardian",
@@ -39,20 +46,15 @@ PROFESSIONS_BY_CODE = {
    9: "Revenant"
 }
 
-# MARK: Read in resources
-
-with open(ALL_SKILLS_FILE, 'r') as f:
-    allSkills = json.load(f)
+# MARK: Workers
 
-abilityInfo = {}
-for fileName in ABILITY_INFO_FILES:
-    with open(fileName, 'r', encoding='utf-8-sig') as f:
-        fileContents = json.load(f)
-        for k,v in fileContents.items():
-            abilityInfo[k] = v
-
-with open(PALETTE_SKILL_LOOKUP_FILE, 'r') as f:
-    paletteSkillLookup = json.load(f)
+#
+# Worker processes only need the tables parseSong uses. They are sent them once, when the
+# worker starts, instead of with every song
+#
+def initVerifyWorker(tables, instrumentationState):
+    songVerifier.primeReferenceTables(tables)
+    instrumentation.initWorker(instrumentationState)
 
 
 # MARK: Read in resources
@@ -62,19 +64,25 @@ knownSkillIds = {
 }
 
 
-def badNoteInfo(note, notes):
+#
+# Describes a { note, index, count, nearby } finding (see compactFindings), and the notes
+# around it
+#
+def badNoteInfo(noteInfo):
     output_lines = []
     
     global knownSkillIds
-    abilityId = str(note["abilityId"])
-    time = note["time"]
-    index = note["index"]
+    allSkills = songVerifier.getSkillSummaries()
+    note = noteInfo["note"]
+    abilityId = str(note.abilityId)
+    time = note.time
+    index = noteInfo["index"]
     
     output_lines.append(f"    abilityId: {abilityId}")
     output_lines.append(f"        index   :       {index}")
     output_lines.append(f"        time    :       {time} ({time//1000}.{time%1000:03d}s )")
-    output_lines.append(f"        duration: {note['duration']}")
-    output_lines.append(f"        total # : {note['count']}")
+    output_lines.append(f"        duration: {note.duration}")
+    output_lines.append(f"        total # : {noteInfo['count']}")
     if abilityId in allSkills:
         skill = allSkills[abilityId]
         output_lines.append(f"        name    : {skill.get('name')}")
@@ -84,11 +92,8 @@ def badNoteInfo(note, notes):
         
     # Nearby
     output_lines.append("        nearby notes [")
-    for i in range(index - 2, index + 2):
-        if i < 0 or i >= len(notes):
-            break
-        nearbyNote = notes[i]
-        nearbyAbilityId = str(nearbyNote["abilityId"])
+    for i, nearbyNote in noteInfo["nearby"]:
+        nearbyAbilityId = str(nearbyNote.abilityId)
         if nearbyAbilityId in allSkills:
             nearbyAbility = allSkills[nearbyAbilityId]
             nearbyName = nearbyAbility["name"]
@@ -96,96 +101,162 @@ def badNoteInfo(note, notes):
             nearbyName = knownSkillIds[nearbyAbilityId]
         else:
             nearbyName = "<Not in all skills>"
-        nearbyTime = nearbyNote["time"]
+        nearbyTime = nearbyNote.time
         output_lines.append(f"            index    : {i}")
         output_lines.append(f"                abilityId : {nearbyAbilityId}")
         output_lines.append(f"                name      : {nearbyName}")
         output_lines.append(f"                time      :       {nearbyTime} ({nearbyTime//1000}.{nearbyTime%1000:03d}s )")
-        output_lines.append(f"                duration  : {nearbyNote['duration']}")
+        output_lines.append(f"                duration  : {nearbyNote.duration}")
         
     output_lines.append("        ]")
     return "\n".join(output_lines)
 
 def parseSong(song):
+    findings = songVerifier.verifySong(song)
+    if songVerifier.hasFindings(findings):
+        return compactFindings(song, findings)
+    else:
+        return None
 
-    # Check palette
-    unknownPaletteSkills = []
-    profession = song["decodedBuildTemplate"]["profession"]
-    # There are issues with the Revenant. Just ignore those
-    if profession != 9:
-        paletteSkills = song["decodedBuildTemplate"]["skills"]["terrestrial"]["utilities"]
-        for paletteSkill in paletteSkills:
-            if paletteSkill > 0 and str(paletteSkill) not in paletteSkillLookup:
-                unknownPaletteSkills.append(paletteSkill)
 
-    # Invalid format for notes
-    invalidNotes = []
+# MARK: Findings
 
-    # Unknown notes (abilityId is known, but the noteType was not determined)
-    unknownNotes = {}
+#
+# (index, note) of the notes badNoteInfo prints around the note at index
+#
+def nearbyNotes(notes, index):
+    nearby = []
+    for i in range(index - 2, index + 2):
+        if i < 0 or i >= len(notes):
+            break
+        nearby.append((i, notes[i]))
+    return nearby
 
-    # Unknown abilityIds ("abilityId" is missing or not known in the lookup table)
-    unknownAbilities = {}
+#
+# The findings of a song, with the song's name, urls and build template but not its notes.
+# Only the notes the report prints are kept:
+#   unknownAbilities/unknownNotes:  "nearby", the notes around the first one (see nearbyNotes)
+#   timelineProblems:               "note", the note with the problem
+#
+def compactFindings(song, findings):
+    songInfo = dict(findings)
+    songInfo["song"] = songModel.Song(
+        name=song.name,
+        description=None,
+        logUrl=song.logUrl,
+        buildChatCode=song.buildChatCode,
+        buildUrl=song.buildUrl,
+        buildTemplate=song.buildTemplate,
+        notes=[],
+        noteProblems=[]
+    )
+    for key in ["unknownAbilities", "unknownNotes"]:
+        songInfo[key] = {
+            abilityId: dict(noteInfo, nearby=nearbyNotes(song.notes, noteInfo["index"]))
+            for abilityId, noteInfo in findings[key].items()
+        }
+    songInfo["timelineProblems"] = [
+        dict(problem, note=song.notes[problem["index"]]) for problem in findings["timelineProblems"]
+    ]
+    return songInfo
 
-    # Parse Notes
-    notes = song["notes"]
-    time = 0
-    for note, index in zip(notes, range(len(notes))):
-        invalidNoteReason = ""
-        for expectedKey in EXPECTED_KEYS_IN_NOTES:
-            if expectedKey not in note:
-                invalidNoteReason = "MISSING EXPECTED KEY: " + expectedKey
+#
+# Everything the report prints, added to one song at a time.
+#
+# The sections about unknown IDs print the first song each ID was found in, so only those
+# songs are kept. The sections that print every song write their lines to a temporary file,
+# since their headers need the totals
+#
+class VerifyReport:
+    def __init__(self):
+        self.songCount = 0
 
-        if "time" in note and note["time"] < time:
-            invalidNoteReason = "TIME IS BEFORE PREVIOUS NOTE: " + str(time)
+        self.invalidSongCount = 0
+        self.invalidNoteCount = 0
+        self.invalidNoteLines = tempfile.TemporaryFile(mode="w+", encoding="utf-8")
 
-        if invalidNoteReason != "":
-            note["invalidReason"] = invalidNoteReason
-            invalidNotes.append(note)
-        else:
-            time = note["time"]
-
-            if str(note["abilityId"]) not in abilityInfo:
-                abilityId = note["abilityId"]
-                if abilityId not in unknownAbilities:
-                    unknownAbilities[abilityId] = note
-                    unknownAbilities[abilityId]["index"] = index
-                    unknownAbilities[abilityId]["count"] = 1
-                else:
-                    unknownAbilities[abilityId]["count"] += 1
-            elif note["noteType"] == "Unknown":
-                abilityId = note["abilityId"]
-                if abilityId not in unknownNotes:
-                    unknownNotes[abilityId] = note
-                    unknownNotes[abilityId]["index"] = index
-                    unknownNotes[abilityId]["count"] = 1
+        # paletteId/abilityId -> songInfo of the first song with it
+        self.missingPaletteIds = {}
+        self.unknownAbilities = {}
+        self.unknownNotes = {}
+        # (song name, unknown note count) of every song with unknown notes
+        self.songsWithUnknownNotes = []
+
+        self.timelineSongCount = 0
+        self.timelineErrorCount = 0
+        self.timelineWarningCount = 0
+        self.timelineLines = tempfile.TemporaryFile(mode="w+", encoding="utf-8")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.invalidNoteLines.close()
+        self.timelineLines.close()
+
+    def add(self, songInfo):
+        self.songCount += 1
+        song = songInfo["song"]
+
+        invalidNotes = songInfo["invalidNotes"]
+        if len(invalidNotes) > 0:
+            self.invalidSongCount += 1
+            self.invalidNoteCount += len(invalidNotes)
+            lines = ["{", "    Invalid Notes:"]
+            for invalidNote in invalidNotes:
+                lines.append(f"    index: {invalidNote['index']}")
+                for k,v in invalidNote["note"].fields():
+                    lines.append(f"    {k}: {v}")
+                lines.append(f"    invalidReason: {invalidNote['invalidReason']}")
+            lines.append("}")
+            self.invalidNoteLines.write("\n".join(lines) + "\n")
+
+        # The invalid notes and timeline problems are already written out
+        keptInfo = {
+            key: value for key, value in songInfo.items() if key not in ["invalidNotes", "timelineProblems"]
+        }
+        for paletteId in songInfo["unknownPaletteSkills"]:
+            self.missingPaletteIds.setdefault(paletteId, keptInfo)
+        for abilityId in songInfo["unknownAbilities"]:
+            self.unknownAbilities.setdefault(abilityId, keptInfo)
+        for abilityId in songInfo["unknownNotes"]:
+            self.unknownNotes.setdefault(abilityId, keptInfo)
+        if len(songInfo["unknownNotes"]) > 0:
+            self.songsWithUnknownNotes.append((song.name, len(songInfo["unknownNotes"])))
+
+        timelineProblems = songInfo["timelineProblems"]
+        if len(timelineProblems) > 0:
+            self.timelineSongCount += 1
+            lines = ["{", f"  {song.name}"]
+            for problem in timelineProblems:
+                if problem["severity"] == timelineRules.SEVERITY_ERROR:
+                    self.timelineErrorCount += 1
                 else:
-                    unknownNotes[abilityId]["count"] += 1
+                    self.timelineWarningCount += 1
+                note = problem["note"]
+                lines.append(
+                    f"    [{problem['severity']}] {problem['rule']} index {problem['index']} "
+                    f"abilityId {note.abilityId} time {note.time}: {problem['reason']}"
+                )
+            lines.append("}")
+            self.timelineLines.write("\n".join(lines) + "\n")
 
+#
+# Prints the lines written to one of the report's temporary files
+#
+def printSpooledLines(spoolFile):
+    spoolFile.seek(0)
+    for line in spoolFile:
+        print(line, end="")
 
-    
 
-    if len(invalidNotes) != 0 or len(unknownPaletteSkills) != 0 or len(unknownNotes) != 0 or len(unknownAbilities) != 0:
-        songInfo = {}
-        songInfo["song"] = song
-        songInfo["unknownPaletteSkills"] = unknownPaletteSkills
-        songInfo["invalidNotes"] = invalidNotes
-        songInfo["unknownNotes"] = unknownNotes
-        songInfo["unknownAbilities"] = unknownAbilities
-        return songInfo
-    else:
-        return None
+# MARK: Report
 
-def checkInvalidNotes(songInfos):   
-    invalidCount = 0
-    badSongs = []
-    for songInfo in songInfos:
-        invalidNoteCount = len(songInfo["invalidNotes"])
-        if invalidNoteCount > 0:
-            invalidCount += invalidNoteCount
-            badSongs.append(songInfo)
-        
-    if len(badSongs) == 0:
+def checkInvalidNotes(report):
+    if report.invalidSongCount == 0:
         return False
     
     print("\n\n")
@@ -200,31 +271,48 @@ def checkInvalidNotes(songInfos):
     print("FIX:")
     print("  No easy fix. Have to debug the composer")
     print("")
-    print(f"There were {len(badSongs)} songs that had invalid notes")
-    print(f"There are {invalidCount} invalid notes total")
+    print(f"There were {report.invalidSongCount} songs that had invalid notes")
+    print(f"There are {report.invalidNoteCount} invalid notes total")
     print("")
     print("\nSONGS WITH INVALID NOTES:")
-    for songInfo in badSongs:
-        song = songInfo["song"]
-        invalidNotes = songInfo["invalidNotes"]
-        print("{")
-        print("    Invalid Notes:")
-        for note in invalidNotes:
-            for k,v in note.items():
-                print(f"    {k}: {v}")
-        print("}")
+    printSpooledLines(report.invalidNoteLines)
         
     return True
 
-def checkPaletteSkills(songInfos):
-    missingPaletteIds = {}
-    for songInfo in songInfos:
-        for unknownSkillId in songInfo["unknownPaletteSkills"]:
-            if unknownSkillId not in missingPaletteIds:
-                missingPaletteIds[unknownSkillId] = songInfo
-    
+def checkTimelineProblems(report):
+    if report.timelineSongCount == 0:
+        return False
+
+    print("\n\n")
+    print("============================")
+    print("== TIMELINE PROBLEMS      ==")
+    print("============================")
+    print("Severity: Medium (Errors) / Low (Warnings)")
+    print("  The notes are valid, but their timing probably won't play well:")
+    print(f"    overlappingCast   : A note starts more than {timelineRules.MAX_CAST_OVERLAP}ms before the previous cast of the same skill ends (Warning)")
+    print("                        Shorter overlaps are normal for cancelled casts, so they aren't reported")
+    print("    duplicateNote     : Two identical notes at the same time (Error)")
+    print(f"    longGap           : More than {timelineRules.MAX_NOTE_GAP}ms without a note (Error)")
+    print(f"    badDuration       : Negative duration, or more than {timelineRules.MAX_NOTE_DURATION}ms (Error)")
+    print("")
+    print("FIX:")
+    print("  Check the dps report. Duplicates and gaps usually come from a composer bug or manual edits")
+    print("")
+    print(f"There were {report.timelineSongCount} songs with timeline problems")
+    print(f"There are {report.timelineErrorCount} errors and {report.timelineWarningCount} warnings total")
+    print("")
+    print("\nSONGS WITH TIMELINE PROBLEMS:")
+    printSpooledLines(report.timelineLines)
+
+    return report.timelineErrorCount > 0
+
+def checkPaletteSkills(report):
+    missingPaletteIds = report.missingPaletteIds
     if len(missingPaletteIds) == 0:
         return False
+
+    allSkills = songVerifier.getSkillSummaries()
+    paletteSkillLookup = songVerifier.getPaletteSkillLookup()
       
     print("\n\n")
     print("============================")      
@@ -252,13 +340,13 @@ def checkPaletteSkills(songInfos):
         song = songInfo["song"]
         unknownPaletteSkills = songInfo["unknownPaletteSkills"]
         print("{")
-        print(f"  {song['name']}")
-        print(f"  {song['logUrl']}")
-        print(f"  {song['buildChatCode']}")
-        print(f"  {song['buildUrl']}")
+        print(f"  {song.name}")
+        print(f"  {song.logUrl}")
+        print(f"  {song.buildChatCode}")
+        print(f"  {song.buildUrl}")
         print("  Palette Skills:")
-        profession = song["decodedBuildTemplate"]["profession"]
-        paletteSkills = song["decodedBuildTemplate"]["skills"]["terrestrial"]["utilities"]
+        profession = song.buildTemplate.profession
+        paletteSkills = song.buildTemplate.utilities
         for paletteSkill in paletteSkills:
             if paletteSkill == 0:
                 print("    0: <Not Defined/Flex Slot. Ignore>")
@@ -274,14 +362,8 @@ def checkPaletteSkills(songInfos):
         print("}")
     return True
         
-def checkUnknownAbilities(songInfos):
-    unknownAbilities = {}
-    for songInfo in songInfos:
-        unknownAbility = songInfo["unknownAbilities"]
-        for abilityId in unknownAbility:
-            if abilityId not in unknownAbilities:
-                unknownAbilities[abilityId] = songInfo
-    
+def checkUnknownAbilities(report):
+    unknownAbilities = report.unknownAbilities
     if len(unknownAbilities) == 0:
         return False
         
@@ -331,32 +413,23 @@ def checkUnknownAbilities(songInfos):
         song = songInfo["song"]
         unknownAbility = songInfo["unknownAbilities"]
         print("{")
-        print(f"  {song['name']}")
-        print(f"  {song['logUrl']}")
+        print(f"  {song.name}")
+        print(f"  {song.logUrl}")
         print(f"  Unknown Ability ID: {abilityId}")
-        print(badNoteInfo(unknownAbility[abilityId], song["notes"]))
+        print(badNoteInfo(unknownAbility[abilityId]))
         print("}")
         
     return True
         
-def checkUnknownNotes(songInfos, hasError):
-    global allSkills
-    global paletteSkillLookup
-    
-    songsWithUnknownNotes = []
-    unknownNotes = {}
-    for songInfo in songInfos:
-        unknownNote = songInfo["unknownNotes"]
-        if len(unknownNote):
-            songsWithUnknownNotes.append(songInfo)
-        for abilityId in unknownNote:
-            if abilityId not in unknownNotes:
-                unknownNotes[abilityId] = songInfo
+def checkUnknownNotes(report, hasError):
+    allSkills = songVerifier.getSkillSummaries()
+    paletteSkillLookup = songVerifier.getPaletteSkillLookup()
     
+    unknownNotes = report.unknownNotes
     if len(unknownNotes) == 0:
         return False
         
-    sortedSongs = sorted(songsWithUnknownNotes, key=lambda song: song["song"]["name"])
+    sortedSongs = sorted(report.songsWithUnknownNotes, key=lambda songUnknownNotes: songUnknownNotes[0])
     sortedUnknownNotes = sorted(unknownNotes.keys())
       
     print("\n\n")
@@ -390,10 +463,8 @@ def checkUnknownNotes(songInfos, hasError):
     print("")
     print("  ==> You may be able to just ignore these! <==")
     print("")
-    print(f"SONGS WITH UNKNOWN NOTES: {len(songsWithUnknownNotes)}")
-    for songInfo in sortedSongs:
-        songName = songInfo["song"]["name"]
-        unknownNotesInSong = len(songInfo["unknownNotes"])
+    print(f"SONGS WITH UNKNOWN NOTES: {len(sortedSongs)}")
+    for songName, unknownNotesInSong in sortedSongs:
         print(f"  {songName} : {unknownNotesInSong}")
     
     # There is a special prompt at the end to delete the songs that have mismatch problems
@@ -405,16 +476,16 @@ def checkUnknownNotes(songInfos, hasError):
         song = songInfo["song"]
         unknownNotesInSong = songInfo["unknownNotes"]
         print("{")
-        print(f"  {song['name']}")
-        print(f"  {song['logUrl']}")
-        print(f"  {song['buildChatCode']}")
-        print(f"  {song['buildUrl']}")
+        print(f"  {song.name}")
+        print(f"  {song.logUrl}")
+        print(f"  {song.buildChatCode}")
+        print(f"  {song.buildUrl}")
         print(f"  Ability ID: {abilityId}")
         skill = allSkills[str(abilityId)]
         
         skillName = skill.get('name')
         slot = skill.get('slot')
-        professionCode = song["decodedBuildTemplate"]["profession"]
+        professionCode = song.buildTemplate.profession
     
         if slot == None:
             profession = ""
@@ -437,7 +508,7 @@ def checkUnknownNotes(songInfos, hasError):
             utilityAbilityNames = []
             paletteInfo = ""
             if professionCode != 9:
-                paletteSkills = song["decodedBuildTemplate"]["skills"]["terrestrial"]["utilities"]
+                paletteSkills = song.buildTemplate.utilities
                 for paletteSkill in paletteSkills:
                     if paletteSkill <= 0:
                         paletteInfo += "    |   " + str(paletteSkill) + " : <Flex Slot>\n"
@@ -475,7 +546,7 @@ def checkUnknownNotes(songInfos, hasError):
                 print("    +-------------------")
     
         unknownNote = unknownNotesInSong[abilityId]
-        print(badNoteInfo(unknownNote, song["notes"]))
+        print(badNoteInfo(unknownNote))
         print("}")
         
     if len(mismatchSongs) > 0:
@@ -505,33 +576,125 @@ def promptToDeleteUnknownNoteSongs(songInfos):
             print("Deleting: " + fullFileName)
             os.remove(fullFileName)
 
-def parseFolder(folder):
-    songInfos = []
-    for fileName in os.listdir(folder):
-        fullFileName = folder + "/" + fileName
-        with open(fullFileName, 'r') as f:
-            song = json.load(f)
-            info = parseSong(song)
-            if info != None:
-                info["fileName"] = fileName
-                info["fullFileName"] = fullFileName
-                songInfos.append(info)
-                
-    if len(songInfos) == 0:
+#
+# Reads and parses a single song file. Runs in the worker processes.
+# Returns (noteCount, info), where info is None if the song has no findings
+#
+def parseSongFile(fullFileName):
+    with instrumentation.span("verifySong", fileName=fullFileName):
+        song, findings = songVerifier.verifySongFile(fullFileName)
+    if songVerifier.hasFindings(findings):
+        info = compactFindings(song, findings)
+        info["fileName"] = os.path.basename(fullFileName)
+        info["fullFileName"] = fullFileName
+        return len(song.notes), info
+    return len(song.notes), None
+
+#
+# parseSongFile in a worker process, with the trace events and counters it recorded
+#
+def parseSongFileInWorker(fullFileName):
+    return parseSongFile(fullFileName), instrumentation.takeEvents()
+
+def listSongFiles(folder):
+    # Sorted, so the report is in the same order every time
+    return [folder + "/" + fileName for fileName in sorted(os.listdir(folder))]
+
+def parseFiles(fullFileNames, workers):
+    with VerifyReport() as report:
+        with instrumentation.span("verifySongs", songs=len(fullFileNames), workers=workers):
+            # The results come back in the order of fullFileNames, so the report is the same
+            # every time
+            for noteCount, info in verifyFiles(fullFileNames, workers):
+                instrumentation.count("songs")
+                instrumentation.count("notes", noteCount)
+                if info != None:
+                    report.add(info)
+        instrumentation.count("songsWithFindings", report.songCount)
+
+        with instrumentation.span("report"):
+            printReport(report)
+
+#
+# Yields the (noteCount, info) of each song as it is verified
+#
+def verifyFiles(fullFileNames, workers):
+    if workers <= 1 or len(fullFileNames) <= 1:
+        for fullFileName in fullFileNames:
+            yield parseSongFile(fullFileName)
+    else:
+        # Load the tables once here, instead of once in every worker
+        tables = {
+            "knownAbilityIds": songVerifier.getKnownAbilityIds(),
+            "paletteSkillLookup": songVerifier.getPaletteSkillLookup()
+        }
+        with multiprocessing.Pool(
+            processes=workers,
+            initializer=initVerifyWorker,
+            initargs=(tables, instrumentation.workerState())
+        ) as pool:
+            for result, recording in pool.imap(
+                parseSongFileInWorker,
+                fullFileNames,
+                chunksize=max(1, len(fullFileNames) // (workers * 4))
+            ):
+                instrumentation.addEvents(recording)
+                yield result
+
+def printReport(report):
+    if report.songCount == 0:
         print("All Data is Valid!")
     else:
         # There was at least one error!
         
         hasError = False
-        hasError = hasError or checkInvalidNotes(songInfos)
-        hasError = hasError or checkPaletteSkills(songInfos)
-        hasError = hasError or checkUnknownAbilities(songInfos)
-        hasError = hasError or checkUnknownNotes(songInfos, hasError)
+        hasError = hasError or checkInvalidNotes(report)
+        hasError = hasError or checkPaletteSkills(report)
+        hasError = hasError or checkUnknownAbilities(report)
+        hasError = hasError or checkUnknownNotes(report, hasError)
+        # Always printed, since most timeline problems are only warnings
+        hasError = checkTimelineProblems(report) or hasError
         
         if hasError:
             print("")
             print("-- Verify Results --")
             print("!! There were errors !!")
+        else:
+            print("")
+            print("-- Verify Results --")
+            print("All Data is Valid! (There are only warnings)")
         
 
-parseFolder(DEFAULT_SONGS_FOLDER)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="verifyData")
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=os.cpu_count() or 1,
+        help='Number of processes used to verify songs (1 verifies everything in this process)'
+    )
+    parser.add_argument(
+        '--watch',
+        action='store_true',
+        help='Keeps running, and verifies songs again whenever they or the reference files change'
+    )
+    parser.add_argument(
+        '--trace',
+        metavar='FILE',
+        help='Records timings and counters, and writes them to FILE as a Chrome trace'
+    )
+    parser.add_argument(
+        'files',
+        nargs='*',
+        help='Song files to verify. Verifies every default song if none are given'
+    )
+    args = parser.parse_args()
+    if args.trace:
+        instrumentation.enable(args.trace)
+
+    if args.watch:
+        songWatcher.watch(songVerifier.DEFAULT_SONGS_FOLDER)
+    elif len(args.files) > 0:
+        parseFiles(args.files, args.workers)
+    else:
+        parseFiles(listSongFiles(songVerifier.DEFAULT_SONGS_FOLDER), args.workers)